@@ -1,4 +1,7 @@
 from utils.answer import Answerer
-answ = Answerer()
 
-answ.answer_all_mvp()
\ No newline at end of file
+if __name__ == '__main__':
+    # the map rendering processes import this module again
+    answ = Answerer()
+
+    answ.answer_all_mvp()
@@ -0,0 +1,31 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.benchmark import generate_databases
+from utils.platforms import PLATFORM_SCHEMAS
+
+
+@pytest.fixture(scope='session')
+def generated_dir(tmp_path_factory):
+    """Small synthetic platform databases, generated once per test run."""
+    db_dir = tmp_path_factory.mktemp('generated')
+    generate_databases(str(db_dir), restaurant_count=200)
+    return db_dir
+
+
+@pytest.fixture
+def db_dir(generated_dir, tmp_path):
+    """A copy of the synthetic databases the test can write to."""
+    for db_name in PLATFORM_SCHEMAS:
+        shutil.copy(generated_dir / f'{db_name}.db', tmp_path / f'{db_name}.db')
+    return tmp_path
+
+
+@pytest.fixture
+def db_urls(db_dir):
+    return {db_name: f'sqlite:///{db_dir / f"{db_name}.db"}' for db_name in PLATFORM_SCHEMAS}
@@ -0,0 +1,47 @@
+import json
+
+import pandas as pd
+
+from utils.benchmark import compare_results, generate_databases
+from utils.dbhandler import DataBaseManager
+from utils.platforms import PLATFORM_SCHEMAS
+
+
+def get_restaurants(db_dir):
+    manager = DataBaseManager({db_name: f'sqlite:///{db_dir / f"{db_name}.db"}' for db_name in PLATFORM_SCHEMAS})
+    return manager.get_restaurants('takeaway')
+
+
+def test_databases_are_generated_once_per_parameters(tmp_path):
+    assert generate_databases(str(tmp_path / 'a'), restaurant_count=50) > 0
+    assert generate_databases(str(tmp_path / 'a'), restaurant_count=50) == 0
+    assert generate_databases(str(tmp_path / 'a'), restaurant_count=60) > 0
+    assert len(get_restaurants(tmp_path / 'a')) == 60
+
+
+def test_same_seed_gives_the_same_databases(tmp_path):
+    generate_databases(str(tmp_path / 'a'), restaurant_count=50, seed=1)
+    generate_databases(str(tmp_path / 'b'), restaurant_count=50, seed=1)
+    generate_databases(str(tmp_path / 'c'), restaurant_count=50, seed=2)
+    pd.testing.assert_frame_equal(get_restaurants(tmp_path / 'a'), get_restaurants(tmp_path / 'b'))
+    assert not get_restaurants(tmp_path / 'a').equals(get_restaurants(tmp_path / 'c'))
+
+
+def write_results(path, seconds, peak_memory_mb):
+    results = {'store': False, 'trace_memory': True, 'scales': [{
+        'restaurants': 100,
+        'setup': {'seconds': 1.0, 'peak_memory_mb': 10.0},
+        'questions': {'answer_q1': {'seconds': seconds, 'peak_memory_mb': peak_memory_mb}},
+    }]}
+    with open(path, 'w') as f:
+        json.dump(results, f)
+    return str(path)
+
+
+def test_compare_flags_slower_and_bigger_steps(tmp_path):
+    baseline = write_results(tmp_path / 'baseline.json', 2.0, 50.0)
+    df = compare_results(baseline, write_results(tmp_path / 'slower.json', 3.0, 50.0)).set_index('step')
+    assert df['regression'].to_dict() == {'setup': False, 'answer_q1': True}
+    assert df.loc['answer_q1', 'time_ratio'] == 1.5
+    df = compare_results(baseline, write_results(tmp_path / 'bigger.json', 2.0, 70.0), tolerance=0.5)
+    assert not df['regression'].any()
@@ -0,0 +1,50 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from utils import borders
+
+
+def write_regions(path, wiggles=200):
+    """Two regions that share a detailed, zigzagging border."""
+    lats = np.linspace(50.6, 51.4, wiggles)
+    edge = [(4.2 + 0.002 * (number % 2), lat) for number, lat in enumerate(lats)]
+    west = shapely.Polygon([(3.4, 50.6)] + edge + [(3.4, 51.4)])
+    east = shapely.Polygon(edge + [(5.1, 51.4), (5.1, 50.6)])
+    gpd.GeoDataFrame({'id': ['W', 'E'], 'name': ['West', 'East']}, geometry=[west, east], crs='EPSG:4326'). \
+        to_file(path, driver='GeoJSON')
+    return str(path)
+
+
+def test_borders_are_cached_until_the_file_changes(tmp_path, monkeypatch):
+    border_path = write_regions(tmp_path / 'regions.geojson')
+    regions = borders.load_borders(border_path)
+    assert regions.crs == 'EPSG:3857'
+    assert borders.is_border_cache_current(border_path, borders.get_cache_dir(border_path))
+
+    def build_border_cache(*args, **kwargs):
+        raise AssertionError('the border cache was built again')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(borders, 'build_border_cache', build_border_cache)
+        assert borders.load_borders(border_path).geometry.equals(regions.geometry)
+
+    write_regions(tmp_path / 'regions.geojson', wiggles=20)
+    assert not borders.is_border_cache_current(border_path, borders.get_cache_dir(border_path))
+    assert borders.load_borders(border_path).geometry.count_coordinates().sum() < regions.geometry.count_coordinates().sum()
+
+
+def test_simplified_regions_keep_sharing_their_border(tmp_path):
+    border_path = write_regions(tmp_path / 'regions.geojson')
+    detailed = borders.load_borders(border_path)
+    simplified = borders.load_borders(border_path, pixel_size=1000)
+    assert simplified.geometry.count_coordinates().sum() < detailed.geometry.count_coordinates().sum()
+    west, east = simplified.geometry
+    assert west.intersection(east).area < 1e-6 * west.area
+    assert abs(shapely.union(west, east).area - detailed.union_all().area) < 1e-6 * detailed.union_all().area
+
+
+def test_coarsest_tolerance_below_a_pixel():
+    assert borders.pick_tolerance(0) == 0
+    assert borders.pick_tolerance(149) == 50
+    assert borders.pick_tolerance(10000) == borders.BORDER_TOLERANCES[-1]
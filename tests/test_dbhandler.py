@@ -0,0 +1,197 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from utils import queries
+from utils.dbhandler import DataBaseManager, create_sqlite_engine, get_db_file
+
+
+def add_menu_item(db_url, name, price=1475):
+    with sqlite3.connect(get_db_file(db_url)) as connection:
+        connection.execute('INSERT INTO menu_items (restaurant_id, name, description, price) VALUES (0, ?, \'\', ?)', (name, price))
+    connection.close()
+
+
+def test_fts_index_follows_new_menu_items(db_urls):
+    DataBaseManager(db_urls).build_indexes('ubereats')
+    add_menu_item(db_urls['ubereats'], 'Kapsalon XL')
+    manager = DataBaseManager(db_urls)
+    assert manager.get_schema('ubereats').has_menu_fts()
+    df = manager.run_query(queries.restaurants_with_dish, 'ubereats', dish='Kapsalon XL')
+    assert len(df) == 1
+
+
+def test_build_indexes_rebuilds_current_fts_index(db_urls):
+    manager = DataBaseManager(db_urls)
+    manager.build_indexes('ubereats')
+    rebuild = manager.get_schema('ubereats').fts_rebuild_statement()
+    assert manager.build_indexes('ubereats') == [rebuild]
+
+
+def test_fts_index_without_triggers_is_not_used(db_urls):
+    manager = DataBaseManager(db_urls)
+    manager.build_indexes('ubereats')
+    trigger_names = manager.get_schema('ubereats').menu_fts_triggers()
+    with sqlite3.connect(get_db_file(db_urls['ubereats'])) as connection:
+        for trigger_name in trigger_names:
+            connection.execute(f'DROP TRIGGER "{trigger_name}"')
+    connection.close()
+    add_menu_item(db_urls['ubereats'], 'Kapsalon XL')
+    manager = DataBaseManager(db_urls)
+    assert not manager.get_schema('ubereats').has_menu_fts()
+    assert len(manager.run_query(queries.restaurants_with_dish, 'ubereats', dish='Kapsalon XL')) == 1
+    assert set(manager.get_schema('ubereats').fts_statements()) <= set(manager.get_missing_indexes('ubereats'))
+
+
+def test_explain_queries_only_flags_table_scans(db_urls):
+    manager = DataBaseManager(db_urls)
+    plan = manager.explain_queries('takeaway')
+    scanned = {detail.split()[1] for detail in plan.loc[plan['full_scan'], 'detail']}
+    assert scanned and scanned <= manager.get_tables('takeaway').table_names()
+    assert plan['detail'].str.contains('SCAN anon_|SCAN \\(subquery-').any()
+
+
+def test_concurrent_fan_outs_keep_their_own_timings(db_urls):
+    manager = DataBaseManager(db_urls)
+    calls = {f'call {number}': ['ubereats'] if number % 2 else None for number in range(8)}
+
+    def fan_out(label):
+        return manager.fan_out(lambda db_name: db_name, db_names=calls[label], label=label)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = dict(zip(calls, executor.map(fan_out, calls)))
+    for label, result in results.items():
+        assert list(manager.timings[label]) == list(result)
+
+
+def test_price_histogram_counts_prices_on_an_edge_like_numpy(db_urls):
+    # 1.70 / 0.1 rounds up to 17, while 1.70 is below the edge 17 * 0.1
+    add_menu_item(db_urls['ubereats'], 'Frikandel', price=170)
+    manager = DataBaseManager(db_urls)
+    edges = np.arange(41) * 0.1
+    histogram = manager.get_price_histogram('ubereats', bins=edges)
+    # the same edges, but not evenly spaced any more, so counted with numpy
+    uneven = manager.get_price_histogram('ubereats', bins=np.append(edges, 100))
+    assert histogram['count'].tolist() == uneven['count'].tolist()[:-1]
+    assert histogram['count'].iloc[16] == 1
+
+
+def test_price_histogram_without_bins_is_empty(db_urls):
+    manager = DataBaseManager(db_urls)
+    for bins in ([], [10]):
+        assert manager.get_price_histogram('ubereats', bins=bins).empty
+
+
+def test_platform_columns_are_normalised(db_urls):
+    manager = DataBaseManager(db_urls)
+    assert manager.get_veg_restaurants('ubereats')['source'].dtype == 'category'
+    assert manager.get_full_veg_restaurants()['source'].dtype == 'category'
+    histograms = manager.create_price_histogram_for_all_db()
+    assert histograms['Platform'].dtype == 'category'
+    assert set(histograms['Platform']) == set(db_urls)
+
+
+def test_tables_are_reflected_on_first_use(db_urls):
+    manager = DataBaseManager(db_urls)
+    assert all(data['engine'] is None for data in manager.db_data.values())
+    manager.run_query(queries.menu_prices, 'takeaway')
+    assert set(manager.get_tables('takeaway')) == {'menuItems'}
+    assert manager.db_data['ubereats']['engine'] is None
+
+
+def test_reflection_cache_is_used_until_the_database_changes(db_urls, tmp_path):
+    cache_dir = str(tmp_path / 'reflection_cache')
+    DataBaseManager(db_urls, reflection_cache_dir=cache_dir).run_query(queries.menu_prices, 'ubereats')
+    tables = DataBaseManager(db_urls, reflection_cache_dir=cache_dir).get_tables('ubereats')
+    assert set(tables.metadata.tables) == {'menu_items'}
+
+    db_file = get_db_file(db_urls['ubereats'])
+    os.utime(db_file, (os.path.getatime(db_file), os.path.getmtime(db_file) + 1))
+    tables = DataBaseManager(db_urls, reflection_cache_dir=cache_dir).get_tables('ubereats')
+    assert not tables.metadata.tables
+
+
+def test_platforms_answer_in_logical_columns_and_units(db_urls):
+    manager = DataBaseManager(db_urls)
+    restaurants = manager.run_query_for_all_db(queries.extract_restaurants)
+    assert len({tuple(df.columns) for df in restaurants.values()}) == 1
+    with sqlite3.connect(get_db_file(db_urls['ubereats'])) as connection:
+        cents = [price for price, in connection.execute('SELECT price FROM menu_items')]
+        review_counts = [int(count.rstrip('+')) for count, in connection.execute('SELECT rating__review_count FROM restaurants')]
+    connection.close()
+    assert restaurants['ubereats']['review_count'].tolist() == review_counts
+    prices = manager.query_prices_per_db('ubereats')
+    assert np.allclose(np.sort(prices), np.sort(cents) / 100)
+
+
+def test_unknown_platform_has_no_schema(db_urls):
+    manager = DataBaseManager(dict(db_urls, justeat=db_urls['takeaway']))
+    with pytest.raises(ValueError):
+        manager.run_query(queries.menu_prices, 'justeat')
+
+
+def test_read_only_engine_refuses_writes(db_urls):
+    manager = DataBaseManager(db_urls)
+    with pytest.raises(OperationalError):
+        with manager.get_engine('ubereats').begin() as connection:
+            connection.execute(text('DELETE FROM menu_items'))
+    with pytest.raises(ValueError):
+        create_sqlite_engine(db_urls['ubereats'], sqlite_mode='exclusive')
+
+
+def test_threads_get_their_own_session(db_urls):
+    manager = DataBaseManager(db_urls, pool_size=2)
+    expected = manager.run_query(queries.menu_prices, 'ubereats')
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        sessions = list(executor.map(lambda _: id(manager.get_session('ubereats')), range(8)))
+        results = list(executor.map(lambda _: manager.run_query(queries.menu_prices, 'ubereats'), range(16)))
+    assert id(manager.get_session('ubereats')) not in sessions
+    assert all(df.equals(expected) for df in results)
+    manager.close()
+
+
+def test_chunks_have_the_same_column_types(db_urls):
+    manager = DataBaseManager(db_urls)
+    chunks = list(manager.iter_query(queries.extract_restaurants, 'ubereats', chunksize=64))
+    assert [len(chunk) for chunk in chunks] == [64, 64, 64, 8]
+    assert all(chunk.dtypes.equals(chunks[0].dtypes) for chunk in chunks)
+    assert chunks[0]['review_count'].dtype == 'Int64'
+    # a chunk of only NULLs keeps the type of the column
+    add_menu_item(db_urls['deliveroo'], 'Frietjes', price=None)
+    last = list(manager.iter_query(queries.menu_prices, 'deliveroo', chunksize=1000))[-1]
+    assert len(last) == 1 and last['price'].isna().all()
+    assert last['price'].dtype == 'float64'
+
+
+def test_arrow_batches_match_the_query_result(db_urls):
+    manager = DataBaseManager(db_urls)
+    batches = list(manager.iter_query(queries.extract_menu_items, 'deliveroo', chunksize=300, as_arrow=True))
+    assert len(batches) == 4
+    assert str(batches[0].schema.field('price').type) == 'double'
+    prices = np.concatenate([batch.column('price').to_numpy() for batch in batches])
+    assert np.allclose(prices, manager.run_query(queries.extract_menu_items, 'deliveroo')['price'])
+
+
+def test_price_histogram_is_counted_by_sqlite(db_urls, monkeypatch):
+    manager = DataBaseManager(db_urls)
+    prices = np.asarray(manager.query_prices_per_db('takeaway'), dtype=float)
+    expected = [((prices >= low) & (prices < low + 5)).sum() for low in range(0, 50, 5)]
+
+    def iter_prices(*args, **kwargs):
+        raise AssertionError('evenly spaced bins were counted in Python')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(manager, 'iter_prices', iter_prices)
+        histogram = manager.get_price_histogram('takeaway', bins=range(0, 55, 5))
+    assert histogram['count'].tolist() == expected
+    assert histogram['Price Range'].iloc[0] == '0-5'
+    # uneven bins stream the prices in chunks
+    uneven = manager.get_price_histogram('takeaway', bins=[0, 5, 20, 50], chunksize=64)
+    assert uneven['count'].tolist() == [expected[0], sum(expected[1:4]), sum(expected[4:])]
+    with pytest.raises(ValueError):
+        manager.run_query(queries.price_histogram, 'takeaway', bin_width=0)
@@ -0,0 +1,53 @@
+import os
+
+import pandas as pd
+
+from utils.dbhandler import DataBaseManager
+from utils.exporter import EXPORTS, IncrementalExporter, write_if_changed
+from test_dbhandler import add_menu_item
+
+
+def test_export_only_recomputes_the_changed_platforms(db_urls, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = DataBaseManager(db_urls)
+    everything = {export_name: list(db_urls) for export_name in EXPORTS}
+    assert IncrementalExporter(manager).export() == everything
+    assert IncrementalExporter(manager).export() == {export_name: [] for export_name in EXPORTS}
+
+    add_menu_item(db_urls['ubereats'], 'Veggie kapsalon', price=1295)
+    recomputed = IncrementalExporter(manager).export()
+    # a new menu item leaves the restaurants per location as they were
+    assert recomputed == {
+        'restaurants_per_location': [],
+        'kapsalons': ['ubereats'],
+        'prices': ['ubereats'],
+        'veg_restaurants': ['ubereats'],
+    }
+    prices = pd.read_csv(EXPORTS['prices']['path'])
+    assert prices['ubereats'].count() == len(manager.query_prices_per_db('ubereats'))
+    assert prices['takeaway'].count() == len(manager.query_prices_per_db('takeaway'))
+
+
+def test_forced_export_recomputes_everything(db_urls, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = DataBaseManager(db_urls)
+    IncrementalExporter(manager).export(['prices'])
+    assert IncrementalExporter(manager).export(['prices'], force=True) == {'prices': list(db_urls)}
+
+
+def test_table_state_follows_appended_rows(db_urls):
+    manager = DataBaseManager(db_urls)
+    state = manager.get_table_state('ubereats')
+    add_menu_item(db_urls['ubereats'], 'Kapsalon XL')
+    new_state = manager.get_table_state('ubereats')
+    assert new_state['menu_items'][1] == state['menu_items'][1] + 1
+    assert new_state['restaurants'] == state['restaurants']
+
+
+def test_unchanged_files_are_not_rewritten(tmp_path):
+    path = str(tmp_path / 'exports' / 'data.csv')
+    assert write_if_changed('a,b\n1,2\n', path)
+    modified = os.stat(path).st_mtime_ns
+    assert not write_if_changed('a,b\n1,2\n', path)
+    assert os.stat(path).st_mtime_ns == modified
+    assert write_if_changed('a,b\n1,3\n', path)
@@ -0,0 +1,54 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from utils.dbhandler import DataBaseManager, get_db_file
+from utils.matching import RestaurantMatcher
+
+
+def get_matcher(db_urls, tmp_path):
+    """Matcher with an ID table of two branches of a chain, each on two platforms."""
+    manager = DataBaseManager(db_urls)
+    matcher = RestaurantMatcher(manager, id_table_path=str(tmp_path / 'restaurant_ids.parquet'))
+    matcher.id_table = pd.DataFrame({
+        'platform': ['ubereats', 'takeaway', 'ubereats', 'takeaway'],
+        'restaurant_id': ['1', 'pizza-hut-gent', '2', 'pizza-hut-leuven'],
+        'name': ['Pizza Hut'] * 4,
+        'lat': [51.05, 51.05, 50.88, 50.88],
+        'lon': [3.72, 3.72, 4.70, 4.70],
+        'entity_id': [0, 0, 1, 1],
+    })
+    matcher.fingerprints = manager.get_fingerprints()
+    return matcher
+
+
+def test_deduplicate_keeps_the_branches_of_a_chain_apart(db_urls, tmp_path):
+    matcher = get_matcher(db_urls, tmp_path)
+    df = matcher.id_table.rename(columns={'platform': 'source'}).drop(columns=['restaurant_id', 'entity_id'])
+    deduplicated = matcher.deduplicate(df)
+    assert sorted(deduplicated['entity_id']) == [0, 1]
+    assert deduplicated['platform_count'].tolist() == [2, 2]
+
+
+def test_deduplicate_needs_the_coordinates(db_urls, tmp_path):
+    matcher = get_matcher(db_urls, tmp_path)
+    with pytest.raises(ValueError):
+        matcher.deduplicate(pd.DataFrame({'source': ['ubereats'], 'name': ['Pizza Hut']}))
+
+
+def test_id_table_is_built_again_after_a_scrape(db_urls, tmp_path):
+    id_table_path = str(tmp_path / 'restaurant_ids.parquet')
+    manager = DataBaseManager(db_urls)
+    id_table = RestaurantMatcher(manager, id_table_path=id_table_path).get_id_table()
+    assert RestaurantMatcher(manager, id_table_path=id_table_path).get_id_table().equals(id_table)
+
+    with sqlite3.connect(get_db_file(db_urls['ubereats'])) as connection:
+        connection.execute('INSERT INTO restaurants (id, title, location__latitude, location__longitude) VALUES (-1, \'New Frituur\', 51.0, 4.0)')
+    connection.close()
+    new_table = RestaurantMatcher(manager, id_table_path=id_table_path).get_id_table()
+    assert len(new_table) == len(id_table) + 1
+    assert 'New Frituur' in set(new_table['name'])
+    # restaurants already in the table keep their ID
+    old_ids = new_table.merge(id_table, on=['platform', 'restaurant_id'], suffixes=('', '_old'))
+    assert (old_ids['entity_id'] == old_ids['entity_id_old']).all()
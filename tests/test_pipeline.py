@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+
+from utils.pipeline import Pipeline
+
+
+def test_steps_run_once_with_the_results_of_their_inputs():
+    calls = []
+    pipeline = Pipeline()
+
+    def step(name, value):
+        def func(*args):
+            calls.append(name)
+            return value + sum(args)
+        return func
+
+    pipeline.add('a', step('a', 1))
+    pipeline.add('b', step('b', 10), inputs=['a'])
+    pipeline.add('c', step('c', 100), inputs=['a'])
+    pipeline.add('d', step('d', 1000), inputs=['b', 'c'])
+    results = pipeline.run()
+    assert results == {'a': 1, 'b': 11, 'c': 101, 'd': 1112}
+    assert sorted(calls) == ['a', 'b', 'c', 'd']
+    assert pipeline.run(['b']) == {'a': 1, 'b': 11}
+    with pytest.raises(ValueError):
+        pipeline.add('e', step('e', 0), inputs=['f'])
+
+
+def test_independent_steps_run_at_the_same_time():
+    barrier = threading.Barrier(2, timeout=10)
+    pipeline = Pipeline(max_workers=2)
+    pipeline.add('left', barrier.wait)
+    pipeline.add('right', barrier.wait)
+    assert sorted(pipeline.run().values()) == [0, 1]
+
+
+def test_main_thread_steps_run_in_order_in_the_calling_thread():
+    order = []
+    pipeline = Pipeline(max_workers=4)
+    pipeline.add('query', lambda: threading.current_thread())
+    for name in ('figure 1', 'figure 2', 'figure 3'):
+        pipeline.add(name, lambda thread, name=name: order.append((name, thread is threading.current_thread())),
+                     inputs=['query'], main_thread=True)
+    pipeline.run()
+    assert [name for name, _ in order] == ['figure 1', 'figure 2', 'figure 3']
+    # the query ran on the pool, not in the thread of the figures
+    assert not any(same_thread for _, same_thread in order)
+    assert threading.main_thread() is threading.current_thread()
+
+
+def test_steps_with_current_outputs_are_skipped(tmp_path):
+    calls = []
+    version = {'data': '1'}
+    output = tmp_path / 'export.csv'
+
+    def get_pipeline():
+        pipeline = Pipeline(state_path=str(tmp_path / 'state.json'))
+        pipeline.add('query', lambda: calls.append('query') or 'rows', fingerprint=lambda: version['data'])
+        pipeline.add('export', lambda rows: calls.append('export') or output.write_text(rows), inputs=['query'], outputs=[str(output)])
+        return pipeline
+
+    get_pipeline().run(['export'])
+    # the inputs of a skipped step are not computed either
+    assert get_pipeline().run(['export']) == {'export': [str(output)]}
+    assert calls == ['query', 'export']
+    version['data'] = '2'
+    get_pipeline().run(['export'])
+    assert calls == ['query', 'export'] * 2
+    output.unlink()
+    get_pipeline().run(['export'])
+    get_pipeline().run(['export'], force=True)
+    assert calls == ['query', 'export'] * 4
@@ -0,0 +1,107 @@
+import geopandas as gpd
+import pytest
+import matplotlib
+import numpy as np
+import pandas as pd
+import shapely
+
+from utils import plotmaker
+from utils.plotmaker import MAP_FIGURES, MapMaker, make_map_job, render_maps, render_static_layers, scatter_map_lod
+from utils.tiles import TileCache
+
+matplotlib.use('Agg')
+
+
+COLORS = {'ubereats': 'navy', 'deliveroo': 'maroon', 'takeaway': 'lightgreen'}
+
+
+def get_points(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'lat': rng.uniform(50.7, 51.3, count),
+        'lon': rng.uniform(3.5, 5.0, count),
+        'source': rng.choice(list(COLORS), count),
+    })
+
+
+def write_map_data(tmp_path):
+    """CSV file per platform with the columns of the map exports, and a GeoJSON file with two regions."""
+    file_paths = {}
+    for seed, platform in enumerate(COLORS):
+        path = tmp_path / f'{platform}_data.csv'
+        get_points(30, seed).drop(columns='source').assign(rest_count=np.arange(30), avg_pr=12.5).to_csv(path, index=False)
+        file_paths[platform] = str(path)
+    border_path = tmp_path / 'regions.geojson'
+    gpd.GeoDataFrame({'id': ['W', 'E'], 'name': ['West', 'East']},
+                     geometry=[shapely.box(3.4, 50.6, 4.2, 51.4), shapely.box(4.2, 50.6, 5.1, 51.4)],
+                     crs='EPSG:4326').to_file(border_path, driver='GeoJSON')
+    return file_paths, str(border_path)
+
+
+def get_marker_count(fig):
+    return sum(len(trace.lat) for trace in fig.data)
+
+
+def test_levels_of_detail_stay_within_the_budget():
+    points = get_points(6000)
+    fig = scatter_map_lod(points, 'source', COLORS, point_budget=3000)
+    assert get_marker_count(fig) <= 3000
+    assert fig.layout.sliders[0].steps[-1].label != 'all'
+
+
+def test_raw_points_replace_levels_that_barely_bin():
+    points = get_points(800)
+    fig = scatter_map_lod(points, 'source', COLORS)
+    labels = [step.label for step in fig.layout.sliders[0].steps]
+    assert labels[-1] == 'all'
+    assert get_marker_count(fig) < 2 * len(points)
+    assert len(fig.layout.meta['lod_zooms']) == len(labels)
+
+
+def test_static_layers_are_rendered_once_for_all_platforms(tmp_path):
+    file_paths, border_path = write_map_data(tmp_path)
+    maker = MapMaker(file_paths, tile_cache=TileCache(cache_dir=str(tmp_path / 'tiles'), offline=True))
+    for platform in file_paths:
+        maker.create_individual_map(platform, border_path, output_directory=str(tmp_path / 'maps'))
+    assert len(maker.backgrounds) == 1
+    assert sorted(path.name for path in (tmp_path / 'maps').iterdir()) == sorted(f'{platform}_distribution.jpg' for platform in file_paths)
+    # the combined map has the same figure size and layers, so it reuses the background
+    maker.create_combined_map(border_path, output_file=str(tmp_path / 'maps' / 'combined.jpg'))
+    assert len(maker.backgrounds) == 1
+    maker.get_map_background(**MAP_FIGURES['kapsalon'])
+    assert len(maker.backgrounds) == 2
+
+
+def test_map_workers_reuse_the_static_layers_of_the_parent(tmp_path, monkeypatch):
+    file_paths, border_path = write_map_data(tmp_path)
+    tile_cache = TileCache(cache_dir=str(tmp_path / 'tiles'), offline=True)
+    jobs = [make_map_job('individual', file_paths, platform, border_path, str(tmp_path / 'maps'), tile_cache) for platform in file_paths]
+    static_layers = render_static_layers(jobs)
+    assert len(static_layers) == 1
+
+    monkeypatch.setattr(plotmaker, '_worker_map_makers', {})
+    monkeypatch.setattr(plotmaker, '_worker_static_layers', {})
+
+    def render_background(*args, **kwargs):
+        raise AssertionError('a map worker rendered a background')
+
+    monkeypatch.setattr(MapMaker, 'render_background', render_background)
+    monkeypatch.setattr(MapMaker, 'load_borders', render_background)
+    plotmaker.init_map_worker(static_layers)
+    plotmaker.render_map_job(jobs[0])
+    assert (tmp_path / 'maps' / f'{jobs[0]["platform"]}_distribution.jpg').exists()
+    with pytest.raises(ValueError):
+        plotmaker.render_map_job(dict(jobs[0], map_type='heatmap'))
+
+
+def test_render_maps_in_a_process_pool(tmp_path):
+    file_paths, border_path = write_map_data(tmp_path)
+    tile_cache = TileCache(cache_dir=str(tmp_path / 'tiles'), offline=True)
+    jobs = [
+        make_map_job('combined', file_paths, border_path=border_path, output=str(tmp_path / 'maps' / 'combined.jpg'), tile_cache=tile_cache),
+        make_map_job('individual', file_paths, 'takeaway', border_path, str(tmp_path / 'maps'), tile_cache),
+    ]
+    timings = render_maps(jobs, max_workers=2)
+    assert set(timings) == {'combined', 'individual_takeaway'}
+    assert (tmp_path / 'maps' / 'combined.jpg').exists()
+    assert (tmp_path / 'maps' / 'takeaway_distribution.jpg').exists()
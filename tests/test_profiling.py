@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from utils import queries
+from utils.dbhandler import DataBaseManager
+from utils.profiling import Profiler, get_profiler, profiling, span
+
+
+def test_spans_do_nothing_without_a_run():
+    with span('stage', rows=1) as attributes:
+        attributes['done'] = True
+    assert get_profiler() is None
+    with pytest.raises(ValueError):
+        Profiler('perf')
+
+
+def test_queries_are_recorded_under_their_stage(db_urls, tmp_path):
+    manager = DataBaseManager(db_urls)
+    with profiling(str(tmp_path / 'profile'), name='test') as profiler:
+        with span('question'):
+            manager.run_query_for_all_db(queries.menu_prices)
+    with open(tmp_path / 'profile' / 'timings.json') as f:
+        report = json.load(f)
+    # reflection runs statements too, the query itself runs in the 'sql' span of run_query
+    statements = [item for item in report['spans'] if item['path'][-2:] == ['sql', 'sql execute']]
+    assert len(statements) == len(db_urls)
+    # the threads of fan_out put their spans under the stage that started them
+    assert all(item['path'][:2] == ['test', 'question'] for item in statements)
+    assert all(item['attributes']['statement'].startswith('SELECT') for item in statements)
+    assert report['stages']['question']['count'] == 1
+    assert profiler.folded_stacks() == (tmp_path / 'profile' / 'stacks.folded').read_text().splitlines()
+
+
+def test_folded_stacks_hold_the_self_time():
+    profiler = Profiler()
+    profiler.record(('run',), 0, 3.0, {})
+    profiler.record(('run', 'maps'), 0, 1.0, {})
+    profiler.record(('run', 'maps'), 1, 0.5, {})
+    profiler.add_spans([{'name': 'savefig', 'path': ['savefig'], 'start': 0, 'seconds': 0.25, 'attributes': {}}], parent=('run', 'maps'))
+    assert profiler.folded_stacks() == ['run 1500000', 'run;maps 1250000', 'run;maps;savefig 250000']
+
+
+def test_cprofile_mode_writes_the_python_profile(tmp_path):
+    with profiling(str(tmp_path / 'profile'), mode='cprofile'):
+        sorted(range(1000), key=lambda number: -number)
+    assert (tmp_path / 'profile' / 'profile.prof').exists()
+    with open(tmp_path / 'profile' / 'timings.json') as f:
+        assert json.load(f)['functions']
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.dbhandler import DataBaseManager
+from utils.ranking import bayesian_score, get_score, top_n
+from utils.store import AnalyticsStore, build_store
+
+
+def test_bayesian_score_needs_many_reviews_to_beat_the_mean():
+    assert bayesian_score(5.0, 3, 4.2, 50) < bayesian_score(4.7, 900, 4.2, 50)
+    assert bayesian_score(1.0, 0, 4.2, 50) == 4.2
+    assert get_score('bayesian') is bayesian_score
+    with pytest.raises(ValueError):
+        get_score('stars')
+
+
+def test_top_n_breaks_ties_and_puts_missing_scores_last():
+    df = pd.DataFrame({'group': ['a', 'a', 'a', 'b', 'b'], 'id': [3, 1, 2, 5, 4], 'score': [1.0, 1.0, np.nan, 2.0, 3.0]})
+    ranked = top_n(df, 'score', 2, group='group', tie_column='id')
+    assert ranked[['group', 'id', 'rank']].values.tolist() == [['a', 1, 1], ['a', 3, 2], ['b', 4, 1], ['b', 5, 2]]
+    assert top_n(df, 'score', 3, tie_column='id')['id'].tolist() == [4, 5, 1]
+
+
+def test_ranking_per_category_comes_out_of_one_query(db_urls):
+    manager = DataBaseManager(db_urls)
+    for db_name in db_urls:
+        ranked = manager.get_ranked_restaurants(db_name, limit=3, score='bayesian')
+        assert ranked.groupby('category', observed=True)['rank'].apply(list).map(lambda ranks: ranks == list(range(1, len(ranks) + 1))).all()
+        assert (ranked.groupby('category', observed=True)['score'].diff().dropna() <= 0).all()
+        everything = manager.get_ranked_restaurants(db_name, limit=1000, score='bayesian')
+        assert len(ranked) == everything.groupby('category', observed=True).head(3).shape[0]
+
+
+def test_store_ranks_like_the_databases(db_urls, tmp_path):
+    manager = DataBaseManager(db_urls)
+    build_store(manager, str(tmp_path / 'store'))
+    store = AnalyticsStore(str(tmp_path / 'store'))
+    for params in ({'score': 'bayesian'}, {'category': 'Pizza', 'per_category': False}, {'dish': 'veg', 'min_reviews': 100}):
+        for db_name in db_urls:
+            expected = manager.get_ranked_restaurants(db_name, limit=5, **params)
+            result = store.get_ranked_restaurants(db_name, limit=5, **params)
+            assert len(expected)
+            assert result['id'].tolist() == expected['id'].astype(str).tolist()
+            assert np.allclose(result['score'].astype(float), expected['score'].astype(float))
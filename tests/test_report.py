@@ -0,0 +1,39 @@
+import base64
+
+import plotly.express as px
+import pytest
+from plotly.offline import get_plotlyjs
+
+from utils.report import Report
+
+
+# 1x1 transparent PNG
+PNG = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII=')
+
+
+def get_report(tmp_path):
+    image_path = tmp_path / 'maps' / 'map.png'
+    image_path.parent.mkdir()
+    image_path.write_bytes(PNG)
+    report = Report(title='Test report')
+    report.add_figure(px.bar(x=['a', 'b'], y=[1, 2]), 'Bars')
+    report.add_figure(px.line(x=[1, 2], y=[3, 4]), 'Line')
+    report.add_image(str(image_path), 'Map')
+    return report
+
+
+def test_report_is_self_contained(tmp_path):
+    path = tmp_path / 'out' / 'report.html'
+    get_report(tmp_path).write(str(path))
+    page = path.read_text(encoding='utf-8')
+    assert f'src="data:image/png;base64,{base64.b64encode(PNG).decode()}"' in page
+    assert 'maps/map.png' not in page
+    # plotly.js once for both figures
+    assert page.count(get_plotlyjs()) == 1
+    assert page.count('id="figure-') == 2
+
+
+def test_export_images_writes_every_figure(tmp_path):
+    pytest.importorskip('kaleido')
+    paths = get_report(tmp_path).export_images(str(tmp_path / 'images'))
+    assert [path.rsplit('/', 1)[-1] for path in paths] == ['00_Bars.png', '01_Line.png']
@@ -0,0 +1,50 @@
+import threading
+
+import pandas as pd
+
+from utils.dbhandler import ResultCache
+
+
+def make_df(number):
+    return pd.DataFrame({'key': [number] * 100, 'value': [float(value) for value in range(100)]})
+
+
+def test_result_cache_round_trip(tmp_path):
+    cache = ResultCache(str(tmp_path), memory_items=0)
+    assert cache.get('missing') is None
+    cache.put('key', make_df(1))
+    pd.testing.assert_frame_equal(cache.get('key'), make_df(1))
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_result_cache_eviction_keeps_size(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=20000, memory_items=0)
+    for number in range(20):
+        cache.put(str(number), make_df(number))
+    assert sum(path.stat().st_size for path in tmp_path.iterdir()) <= 20000
+    assert cache.get('19') is not None
+
+
+def test_result_cache_concurrent_put_get_evict(tmp_path):
+    # two caches on one directory, like two processes, and threads sharing each of them
+    caches = [ResultCache(str(tmp_path), max_bytes=20000, memory_items=0) for _ in range(2)]
+    errors = []
+
+    def work(thread_number):
+        cache = caches[thread_number % 2]
+        try:
+            for number in range(40):
+                key = str((thread_number * 7 + number) % 15)
+                cache.put(key, make_df(int(key)))
+                df = cache.get(str(number % 15))
+                if df is not None:
+                    pd.testing.assert_frame_equal(df, make_df(number % 15))
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=work, args=(thread_number,)) for thread_number in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
@@ -0,0 +1,49 @@
+import pandas as pd
+
+from utils.search import MenuSearchIndex, tokenize, tokenize_series
+
+
+NAMES = ['Bœuf bourguignon', 'Œuf mayonnaise', 'Crème brûlée', 'Straße Döner', 'Smørrebrød', 'Kapsalon kip']
+
+
+def make_index():
+    items = pd.DataFrame({
+        'item_name': NAMES,
+        'description': [None, 'Met œufs', '', 'Pikant', 'Deens', 'Friet, kip en kaas'],
+        'source': 'ubereats',
+        'restaurant_id': range(len(NAMES)),
+        'name': [f'Restaurant {number}' for number in range(len(NAMES))],
+        'price': 10.0,
+        'lat': 51.0,
+        'lon': 4.0,
+    })
+    return MenuSearchIndex(items)
+
+
+def found(index, term, match):
+    return [NAMES[row] for row in index.lookup(term, fields=('item_name',), match=match)]
+
+
+def test_index_and_terms_are_tokenized_the_same():
+    texts = pd.Series(NAMES + ['Café–bar', None])
+    assert tokenize_series(texts).tolist() == [tokenize(text) for text in NAMES + ['Café–bar', '']]
+    assert tokenize('Bœuf bourguignon') == ['boeuf', 'bourguignon']
+    assert tokenize('Straße') == ['strasse']
+    assert tokenize('Café–bar') == ['cafe', 'bar']
+
+
+def test_search_non_ascii_dish_names():
+    index = make_index()
+    assert found(index, 'bœuf', 'token') == ['Bœuf bourguignon']
+    assert found(index, 'boeuf', 'token') == ['Bœuf bourguignon']
+    assert found(index, 'œuf', 'token') == ['Œuf mayonnaise']
+    assert found(index, 'creme brulee', 'token') == ['Crème brûlée']
+    assert found(index, 'strasse', 'prefix') == ['Straße Döner']
+    assert found(index, 'smorrebrod', 'token') == ['Smørrebrød']
+    assert found(index, 'ÖNER', 'substring') == ['Straße Döner']
+
+
+def test_search_descriptions():
+    index = make_index()
+    assert index.lookup('oeufs', match='token').tolist() == [1]
+    assert index.lookup('kip', match='token').tolist() == [5]
@@ -0,0 +1,87 @@
+import asyncio
+import io
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from utils.dbhandler import DataBaseManager
+from utils.service import ENDPOINTS, PARAMETER_TYPES, QueryService, get_query_params
+
+
+@pytest.fixture
+def service_url(db_urls):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    service = QueryService(DataBaseManager(db_urls), chunk_rows=7)
+    threading.Thread(target=lambda: asyncio.run(service.serve(port=port)), daemon=True).start()
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f'{url}/stats')
+            break
+        except OSError:
+            time.sleep(0.05)
+    return url
+
+
+def get(url):
+    return urllib.request.urlopen(url).read()
+
+
+def test_streamed_formats_match_json(service_url):
+    target = f'{service_url}/analyses/ranked_restaurants?limit=3&platform=takeaway,ubereats,takeaway'
+    arrow = pa.ipc.open_stream(get(f'{target}&format=arrow')).read_pandas()
+    # the streamed run is kept, the other formats are sent from memory
+    streamed = pd.read_json(io.BytesIO(get(f'{target}&format=ndjson')), lines=True, dtype={'id': str})
+    expected = pd.DataFrame(json.loads(get(target)))
+    stats = json.loads(get(f'{service_url}/stats'))
+    assert (stats['executions'], stats['streams'], stats['cache_hits']) == (1, 1, 2)
+    assert sorted(expected['platform'].unique()) == ['takeaway', 'ubereats']
+    for df in (streamed, arrow):
+        pd.testing.assert_frame_equal(df.reset_index(drop=True), expected, check_dtype=False, check_exact=False)
+
+
+def test_identical_streams_share_one_run(service_url):
+    target = f'{service_url}/analyses/ranked_restaurants?format=ndjson'
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        bodies = list(executor.map(get, [target] * 6))
+    assert len(set(bodies)) == 1 and len(bodies[0].splitlines()) > 7
+    stats = json.loads(get(f'{service_url}/stats'))
+    assert stats['executions'] == 1
+    assert stats['coalesced'] + stats['cache_hits'] == 5
+
+
+def test_empty_arrow_stream_has_columns(service_url):
+    table = pa.ipc.open_stream(get(f'{service_url}/analyses/ranked_restaurants?category=nothing&format=arrow')).read_all()
+    assert table.num_rows == 0
+    assert table.column_names == ['category', 'id', 'name', 'rating', 'review_count', 'score', 'rank', 'platform']
+
+
+@pytest.mark.parametrize('query', ['score=nope&format=ndjson', 'platform=foo', 'format=xml', 'bogus=1', 'limit=abc'])
+def test_bad_request_is_bad_request(service_url, query):
+    with pytest.raises(urllib.error.HTTPError) as error:
+        get(f'{service_url}/analyses/ranked_restaurants?{query}')
+    assert error.value.code == 400
+    assert json.loads(error.value.read())['error']
+
+
+def test_price_histogram_has_labels_and_empty_bins(service_url, db_urls):
+    histogram = pd.DataFrame(json.loads(get(f'{service_url}/analyses/price_histogram?platform=ubereats&bin_width=2.5&bin_count=40')))
+    expected = DataBaseManager(db_urls).get_price_histogram('ubereats', bins=[number * 2.5 for number in range(41)])
+    assert histogram['Price Range'].tolist() == expected['Price Range'].tolist()
+    assert histogram['count'].tolist() == expected['count'].tolist()
+    assert (histogram['count'] == 0).any()
+
+
+def test_every_parameter_has_a_type():
+    for logical_query in ENDPOINTS.values():
+        assert set(get_query_params(logical_query)) <= set(PARAMETER_TYPES)
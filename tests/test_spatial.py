@@ -0,0 +1,64 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+from utils.benchmark import LAT_RANGE, LON_RANGE
+from utils.dbhandler import DataBaseManager
+from utils.spatial import SpatialAggregator, assign_to_polygons, hex_cells, hex_polygons
+
+
+def write_regions(tmp_path):
+    """GeoJSON with a west and an east region that split the synthetic market in two."""
+    middle = sum(LON_RANGE) / 2
+    regions = gpd.GeoDataFrame({
+        'id': ['W', 'E'],
+        'name': ['West', 'East'],
+        'geometry': [
+            shapely.box(LON_RANGE[0] - 1, LAT_RANGE[0] - 1, middle, LAT_RANGE[1] + 1),
+            shapely.box(middle, LAT_RANGE[0] - 1, LON_RANGE[1] + 1, LAT_RANGE[1] + 1),
+        ],
+    }, crs='EPSG:4326')
+    path = tmp_path / 'regions.geojson'
+    regions.to_file(path, driver='GeoJSON')
+    return str(path)
+
+
+def test_points_go_to_the_first_polygon_containing_them():
+    polygons = np.array([shapely.box(0, 0, 2, 2), shapely.box(1, 1, 3, 3)])
+    points = shapely.points([(0.5, 0.5), (1.5, 1.5), (2.5, 2.5), (5, 5)])
+    assert assign_to_polygons(points, polygons).tolist() == [0, 0, 1, -1]
+
+
+def test_points_lie_in_their_hexagon():
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(-20000, 20000, 500), rng.uniform(-20000, 20000, 500)
+    q, r = hex_cells(x, y, 5000)
+    hexagons = hex_polygons(q, r, 5000)
+    assert shapely.covers(hexagons, shapely.points(x, y)).all()
+
+
+def test_every_restaurant_lands_in_one_grid_cell(db_urls):
+    manager = DataBaseManager(db_urls)
+    for shape in ('hex', 'square'):
+        df = SpatialAggregator(manager).aggregate_by_grid(cell_size=10000, shape=shape)
+        counts = df.groupby('platform')['restaurant_count'].sum()
+        for db_name in db_urls:
+            assert counts[db_name] == len(manager.get_restaurants(db_name).dropna(subset=['lat', 'lon']))
+        assert not df.duplicated(['platform', 'cell_x', 'cell_y']).any()
+
+
+def test_unsupported_grid_shape(db_urls):
+    with pytest.raises(ValueError):
+        SpatialAggregator(DataBaseManager(db_urls)).aggregate_by_grid(shape='triangle')
+
+
+def test_restaurants_per_region(db_urls, tmp_path):
+    manager = DataBaseManager(db_urls)
+    df = SpatialAggregator(manager, border_path=write_regions(tmp_path)).aggregate_by_region()
+    assert len(df) == 2 * len(db_urls)
+    assert df.crs == 'EPSG:3857'
+    counts = df.groupby('platform')['restaurant_count'].sum()
+    for db_name in db_urls:
+        assert counts[db_name] == len(manager.get_restaurants(db_name).dropna(subset=['lat', 'lon']))
+    assert (df['density'] == df['restaurant_count'] / df['area_km2']).all()
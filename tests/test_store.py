@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from utils.dbhandler import DataBaseManager
+from utils.store import AnalyticsStore, build_store, is_store_current
+from test_dbhandler import add_menu_item
+
+
+def get_sorted(df):
+    """Rows in a fixed order, with the ids as strings like in the store."""
+    if 'id' in df.columns:
+        df = df.astype({'id': str})
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def test_store_answers_like_the_databases(db_urls, tmp_path):
+    manager = DataBaseManager(db_urls)
+    store_dir = str(tmp_path / 'store')
+    build_store(manager, store_dir)
+    store = AnalyticsStore(store_dir)
+    for db_name in db_urls:
+        assert np.allclose(np.sort(store.query_prices_per_db(db_name)), np.sort(manager.query_prices_per_db(db_name)))
+        assert store.get_price_histogram(db_name).equals(manager.get_price_histogram(db_name))
+        for answer in ('rest_per_loc_query', 'get_kapsalons', 'get_veg_restaurants'):
+            expected = get_sorted(getattr(manager, answer)(db_name))
+            result = get_sorted(getattr(store, answer)(db_name))
+            pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_categorical=False, rtol=1e-6)
+
+
+def test_store_is_stale_after_a_scrape(db_urls, tmp_path):
+    manager = DataBaseManager(db_urls)
+    store_dir = str(tmp_path / 'store')
+    assert not is_store_current(manager, store_dir)
+    build_store(manager, store_dir)
+    assert is_store_current(manager, store_dir)
+    assert AnalyticsStore(store_dir).get_fingerprints() == manager.get_fingerprints()
+    add_menu_item(db_urls['deliveroo'], 'Veggie kapsalon')
+    assert not is_store_current(manager, store_dir)
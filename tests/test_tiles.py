@@ -0,0 +1,58 @@
+import io
+import os
+import sqlite3
+
+import numpy as np
+from PIL import Image
+
+from utils.tiles import BELGIUM_BOUNDS, TileCache, lonlat_to_mercator, mercator_to_tile, tile_bounds
+
+
+def get_png(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (256, 256), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def write_tile(tile_cache, column, row, zoom, color):
+    path = tile_cache.get_path(column, row, zoom)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(get_png(color))
+
+
+def test_points_lie_in_their_tile():
+    for lon, lat in ((BELGIUM_BOUNDS[0], BELGIUM_BOUNDS[1]), (4.35, 50.85), (BELGIUM_BOUNDS[2], BELGIUM_BOUNDS[3])):
+        x, y = lonlat_to_mercator(lon, lat)
+        for zoom in (0, 7, 12):
+            west, south, east, north = tile_bounds(*mercator_to_tile(x, y, zoom), zoom)
+            assert west <= x < east and south < y <= north
+
+
+def test_offline_image_is_made_of_cached_tiles(tmp_path):
+    tile_cache = TileCache(cache_dir=str(tmp_path), offline=True)
+    zoom = 8
+    west, south = lonlat_to_mercator(BELGIUM_BOUNDS[0], BELGIUM_BOUNDS[1])
+    east, north = lonlat_to_mercator(BELGIUM_BOUNDS[2], BELGIUM_BOUNDS[3])
+    first_column, first_row, last_column, last_row = tile_cache.get_tile_range((west, south, east, north), zoom)
+    write_tile(tile_cache, first_column, first_row, zoom, (255, 0, 0))
+
+    image, extent = tile_cache.get_image((west, south, east, north), zoom=zoom)
+    assert image.shape == ((last_row - first_row + 1) * 256, (last_column - first_column + 1) * 256, 3)
+    assert (image[0, 0] == [255, 0, 0]).all()
+    # tiles that are not cached stay blank
+    assert (image[-1, -1] == 255).all()
+    assert extent[0] <= west and extent[1] >= east and extent[2] <= south and extent[3] >= north
+
+
+def test_mbtiles_rows_count_from_the_south(tmp_path):
+    mbtiles_path = str(tmp_path / 'belgium.mbtiles')
+    with sqlite3.connect(mbtiles_path) as connection:
+        connection.execute('CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)')
+        connection.execute('INSERT INTO tiles VALUES (2, 1, 3, ?)', (get_png((0, 0, 255)),))
+    connection.close()
+    tile_cache = TileCache(cache_dir=str(tmp_path), offline=True, mbtiles_path=mbtiles_path)
+    assert tile_cache.get_tile(1, 0, 2) is not None
+    assert tile_cache.get_tile(1, 3, 2) is None
+    tile = np.asarray(Image.open(io.BytesIO(tile_cache.get_tile(1, 0, 2))))
+    assert (tile[0, 0] == [0, 0, 255]).all()
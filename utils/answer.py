@@ -1,9 +1,33 @@
 
-from utils.dbhandler import DataBaseManager
-from utils.plotmaker import PlotMaker,MapMaker
+import json
+import os
+
+from utils.dbhandler import DataBaseManager, ResultCache, get_db_file, get_db_fingerprint
+from utils.plotmaker import PlotMaker,make_map_job,render_maps
+from utils.store import AnalyticsStore, build_store, is_store_current
+from utils.exporter import IncrementalExporter
+from utils.tiles import TileCache
+from utils.matching import RestaurantMatcher
+from utils.report import Report
+from utils.profiling import profiling, timed
+from utils.pipeline import Pipeline, file_fingerprint
+from utils import borders as border_cache
 
 class Answerer:
-    def __init__(self) -> None:
+    def __init__(self, store_dir=None, report_path=None, profile_dir=None, profile_mode=None) -> None:
+        """
+        Args:
+            store_dir (str): Optional directory of the Parquet analytics store. When given the
+                questions are answered from the store, which is (re)built from the databases
+                whenever one of them changed. Otherwise they query the databases directly.
+            report_path (str): Optional HTML file. When given no figure is opened, all the
+                figures and maps of answer_all_mvp are written to this one report instead.
+            profile_dir (str): Optional directory. When given answer_all_mvp is profiled and
+                the time spent per stage (queries, reflection, map layers, savefig, ...) is
+                written there as timings.json and stacks.folded, see utils/profiling.py.
+            profile_mode (str): None, 'cprofile' or 'tracemalloc', to also profile the
+                Python functions or the memory of the run.
+        """
         self.db_urls = {
         'ubereats': 'sqlite:///databases/ubereats.db',
         'deliveroo': 'sqlite:///databases/deliveroo.db',
@@ -19,63 +43,179 @@ class Answerer:
             'takeaway': 'vizualizations_data/takeaway_data.csv', 
             'deliveroo': 'vizualizations_data/deliveroo_data.csv'}
         self.border_path = 'vizualizations_data/belgium-with-regions_.geojson'
-        self.manager = DataBaseManager(self.db_urls)
+        self.manager = DataBaseManager(self.db_urls, reflection_cache_dir='databases/reflection_cache', result_cache=ResultCache('databases/result_cache'), search_index_path='databases/search_index.pkl')
+        self.analyses = self.manager
+        if store_dir is not None:
+            if not is_store_current(self.manager, store_dir):
+                build_store(self.manager, store_dir)
+            self.analyses = AnalyticsStore(store_dir)
+        self.exporter = IncrementalExporter(self.manager, self.analyses)
+        self.tile_cache = TileCache('tile_cache')
+        self.matcher = RestaurantMatcher(self.analyses)
+        self.report_path = report_path
+        self.report = Report() if report_path is not None else None
+        self.profile_dir = profile_dir
+        self.profile_mode = profile_mode
 
 
+    @timed()
     def answer_quest_1(self):
+        self.show_price_distribution(self.analyses.create_price_histogram_for_all_db())
+
+    def show_price_distribution(self, df):
         print("What is the price distribution of menu items?")
-        df = self.manager.create_prices_df_for_all_db()
-        ploter = PlotMaker(df,'Takeawy')
-        ploter.price_distribution()
+        ploter = PlotMaker(df,'Takeawy',report=self.report)
+        ploter.plot_price_histogram()
 
+    def get_distribution_map_jobs(self):
+        jobs = [make_map_job('combined', self.file_paths, border_path=self.border_path,
+                             output='output_maps/combined_distribution.jpg', tile_cache=self.tile_cache)]
+        jobs += [make_map_job('individual', self.file_paths, platform, border_path=self.border_path,
+                              output='output_maps/', tile_cache=self.tile_cache)
+                 for platform in self.file_paths]
+        return jobs
+
+    @timed()
     def answer_quest_2(self):
         print('What is the distribution of restaurants per location')
-        self.manager.create_prices_df_for_all_db()
-        ploter = MapMaker(file_paths=self.file_paths)
-        ploter.create_combined_map(self.border_path)
-        ploter.create_individual_maps(self.border_path)
+        jobs = self.get_distribution_map_jobs()
+        render_maps(jobs)
+        self.add_maps_to_report(jobs)
 
+    @timed()
     def answer_quest_3(self):
+        self.show_top_pizza(self.analyses.fan_out(self.analyses.get_top10_Pizza_restaurants))
+
+    def show_top_pizza(self, dfs):
         print('Which are the top 10 pizza restaurants by rating?')
-        df_uber = self.manager.get_top10_Pizza_restaurants('ubereats')
-        df_takeaway = self.manager.get_top10_Pizza_restaurants('takeaway')
-        df_deliveroo = self.manager.get_top10_Pizza_restaurants('deliveroo')
-        ploter = PlotMaker(df_uber,'UberEats')
+        df_uber, df_takeaway, df_deliveroo = dfs['ubereats'], dfs['takeaway'], dfs['deliveroo']
+        ploter = PlotMaker(df_uber,'UberEats',report=self.report)
         ploter.create_top_ten_pizza_plot()
         ploter.change_df(df_takeaway,'Takeaway')
         ploter.create_top_ten_pizza_plot()
         ploter.change_df(df_deliveroo,'Deliveroo')
         ploter.create_top_ten_pizza_plot()
 
+    def get_kapsalon_map_jobs(self):
+        return [make_map_job('kapsalon', self.file_paths_kaps, platform, output='output_maps', tile_cache=self.tile_cache)
+                for platform in self.file_paths_kaps]
+
+    @timed()
     def answer_quest_4(self):
         print('Map locations offering kapsalons and their average price.')
-        self.manager.save_to_csv_kapsalon_dfs()
-        kaps_maker = MapMaker(file_paths=self.file_paths_kaps)
-        kaps_maker.create_kapsalon_map_for_platform('ubereats')
-        kaps_maker.create_kapsalon_map_for_platform('takeaway')
-        kaps_maker.create_kapsalon_map_for_platform('deliveroo')
+        self.exporter.export(['kapsalons'])
+        jobs = self.get_kapsalon_map_jobs()
+        render_maps(jobs)
+        self.add_maps_to_report(jobs)
+
+    def get_map_path(self, job):
+        """File a map job of make_map_job writes."""
+        match job['map_type']:
+            case 'combined':
+                return job['output']
+            case 'individual':
+                return os.path.join(job['output'], f"{job['platform']}_distribution.jpg")
+            case 'kapsalon':
+                return os.path.join(job['output'], f"{job['platform']}_kapsalons_map.jpg")
 
+    def add_maps_to_report(self, jobs):
+        if self.report is None:
+            return
+        for job in jobs:
+            self.report.add_image(self.get_map_path(job), job['name'].replace('_', ' ').capitalize())
+
+    @timed()
     def answer_quest_5(self):
+        self.show_top_categories(self.analyses.fan_out(self.analyses.get_top_categories))
+
+    def show_top_categories(self, dfs):
         print('Comparation of top 5 categories for diferent delivery serveces.')
-        df_uber = self.manager.get_top_categories('ubereats')
-        df_takeaway = self.manager.get_top_categories('takeaway')
-        df_deliveroo = self.manager.get_top_categories('deliveroo')
-        ploter = PlotMaker(df_uber,'Ubereats')
+        df_uber, df_takeaway, df_deliveroo = dfs['ubereats'], dfs['takeaway'], dfs['deliveroo']
+        ploter = PlotMaker(df_uber,'Ubereats',report=self.report)
         ploter.plot_top_categories()
         ploter.change_df(df_takeaway,'Takeaway')      
         ploter.plot_top_categories()
         ploter.change_df(df_deliveroo,'Deliveroo')
         ploter.plot_top_categories()
 
+    @timed()
     def answer_aditional_q_4(self):
-        df= self.manager.get_full_veg_restaurants()
-        ploter = PlotMaker(df,'FullVegs')
+        # the map reads every platform listing from the export
+        self.exporter.export(['veg_restaurants'])
+        df= self.analyses.get_full_veg_restaurants(matcher=self.matcher)
+        ploter = PlotMaker(df,'FullVegs',report=self.report)
         print(df.head())
         ploter.plot_veg_restaurants()
 
     def answer_all_mvp(self):
-        self.answer_quest_1()
-        self.answer_quest_2()
-        self.answer_quest_3()
-        self.answer_quest_4()
-        self.answer_quest_5()
\ No newline at end of file
+        with profiling(self.profile_dir, self.profile_mode, name='answer_all_mvp'):
+            self.answer_quest_1()
+            self.answer_quest_2()
+            self.answer_quest_3()
+            self.answer_quest_4()
+            self.answer_quest_5()
+            if self.report is not None:
+                self.report.write(self.report_path)
+
+    def get_db_state(self):
+        return json.dumps({db_name: get_db_fingerprint(get_db_file(url)) for db_name, url in self.db_urls.items()})
+
+    def build_pipeline(self, state_path='vizualizations_data/pipeline_state.json', max_workers=None):
+        """
+        The questions of answer_all_mvp as a Pipeline.
+
+        Every query, CSV export, the border cache and the two sets of maps is a step that
+        runs once, at the same time as the steps it does not depend on. The figures are
+        made in this thread, in the order of the questions. The maps, the kapsalon CSVs
+        and the border cache are skipped when the databases and files they are made from
+        did not change since the last run.
+
+        Args:
+            state_path (str): JSON file with the state of the last run.
+            max_workers (int): Number of steps running at the same time.
+
+        Returns:
+            Pipeline: The pipeline, see answer_all_pipeline.
+        """
+        pipeline = Pipeline(state_path=state_path, max_workers=max_workers)
+        distribution_jobs = self.get_distribution_map_jobs()
+        kapsalon_jobs = self.get_kapsalon_map_jobs()
+        cache_dir = border_cache.get_cache_dir(self.border_path)
+
+        # data
+        pipeline.add('price_histogram', self.analyses.create_price_histogram_for_all_db, fingerprint=self.get_db_state)
+        pipeline.add('top_pizza', lambda: self.analyses.fan_out(self.analyses.get_top10_Pizza_restaurants), fingerprint=self.get_db_state)
+        pipeline.add('top_categories', lambda: self.analyses.fan_out(self.analyses.get_top_categories), fingerprint=self.get_db_state)
+        pipeline.add('kapsalon_csvs', lambda: self.exporter.export(['kapsalons']),
+                     outputs=self.file_paths_kaps.values(), fingerprint=self.get_db_state)
+        pipeline.add('borders', lambda: border_cache.load_borders(self.border_path, cache_dir=cache_dir),
+                     outputs=[border_cache.get_level_path(self.border_path, cache_dir, tolerance) for tolerance in border_cache.BORDER_TOLERANCES],
+                     fingerprint=lambda: file_fingerprint(self.border_path))
+        # maps, each set on a process pool of its own
+        pipeline.add('distribution_maps', lambda borders: render_maps(distribution_jobs), inputs=['borders'],
+                     outputs=[self.get_map_path(job) for job in distribution_jobs],
+                     fingerprint=lambda: file_fingerprint(*self.file_paths.values()))
+        pipeline.add('kapsalon_maps', lambda csvs: render_maps(kapsalon_jobs), inputs=['kapsalon_csvs'],
+                     outputs=[self.get_map_path(job) for job in kapsalon_jobs])
+        # figures
+        pipeline.add('quest_1', self.show_price_distribution, inputs=['price_histogram'], main_thread=True)
+        pipeline.add('quest_2', lambda maps: self.add_maps_to_report(distribution_jobs), inputs=['distribution_maps'], main_thread=True)
+        pipeline.add('quest_3', self.show_top_pizza, inputs=['top_pizza'], main_thread=True)
+        pipeline.add('quest_4', lambda maps: self.add_maps_to_report(kapsalon_jobs), inputs=['kapsalon_maps'], main_thread=True)
+        pipeline.add('quest_5', self.show_top_categories, inputs=['top_categories'], main_thread=True)
+        if self.report is not None:
+            pipeline.add('report', lambda *quests: self.report.write(self.report_path),
+                         inputs=['quest_1', 'quest_2', 'quest_3', 'quest_4', 'quest_5'], main_thread=True)
+        return pipeline
+
+    def answer_all_pipeline(self, force=False, max_workers=None):
+        """
+        Answer the questions of answer_all_mvp with build_pipeline: the independent
+        queries and maps at the same time, and without redoing the maps that are current.
+
+        Args:
+            force (bool): Also redo the steps that are up to date.
+            max_workers (int): Number of steps running at the same time.
+        """
+        with profiling(self.profile_dir, self.profile_mode, name='answer_all_pipeline'):
+            return self.build_pipeline(max_workers=max_workers).run(force=force)
\ No newline at end of file
@@ -0,0 +1,364 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from utils.platforms import PLATFORM_SCHEMAS
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BORDER_FILE = 'vizualizations_data/belgium-with-regions_.geojson'
+SCALES = (10000, 100000, 1000000)
+
+# Vocabulary of the synthetic data. The dishes contain the 'kapsalon' and 'veg' the
+# analyses search for, 'Pizza' is the category of the top 10 question.
+NAME_PREFIXES = ['Pizzeria', 'Frituur', 'Sushi', 'Burger', 'Kebab', 'Bistro', 'Wok', 'Taverne', 'Snackbar', 'Brasserie']
+NAME_WORDS = ['Roma', 'Napoli', 'Centrum', 'Markt', 'Station', 'Kerk', 'Zon', 'Leeuw', 'Haven', 'Molen', 'Tokyo', 'Istanbul']
+CATEGORIES = ['Pizza', 'Burgers', 'Sushi', 'Asian', 'Street food', 'Snacks', 'Turkish', 'Italian', 'Vegetarian', 'Desserts', 'Belgian', 'Healthy']
+DISHES = ['Kapsalon kip', 'Kapsalon vegetarisch', 'Pizza Margherita', 'Pizza Hawai', 'Veggie burger', 'Vegan bowl',
+          'Frietjes', 'Durum', 'Sushi box', 'Loempia', 'Tiramisu', 'Cheeseburger', 'Stoofvlees', 'Pad thai']
+# Flanders and Brussels, where the scraped data is
+LAT_RANGE = (50.7, 51.4)
+LON_RANGE = (2.6, 5.9)
+
+
+def generate_market(restaurant_count, seed=0):
+    """
+    Restaurants of a synthetic market, twice as many as every platform lists.
+
+    Every platform lists restaurant_count of them, so about half of the restaurants of a
+    platform are also on another one, which gives the matcher work.
+    """
+    rng = np.random.default_rng(seed)
+    market_size = 2 * restaurant_count
+    prefixes = rng.choice(NAME_PREFIXES, market_size)
+    words = rng.choice(NAME_WORDS, market_size)
+    return pd.DataFrame({
+        'name': [f'{prefix} {word} {number}' for number, (prefix, word) in enumerate(zip(prefixes, words))],
+        'lat': rng.uniform(*LAT_RANGE, market_size),
+        'lon': rng.uniform(*LON_RANGE, market_size),
+        'rating': rng.uniform(3, 5, market_size).round(1),
+        'review_count': rng.integers(0, 1000, market_size),
+        'category': rng.choice(CATEGORIES, market_size),
+    })
+
+
+def generate_platform_tables(market, db_name, restaurant_count, menu_items_per_restaurant=5, seed=0):
+    """
+    Tables of one platform in logical names, with the units and formats of that platform.
+
+    Returns:
+        dict: DataFrame per logical table of PLATFORM_SCHEMAS.
+    """
+    config = PLATFORM_SCHEMAS[db_name]
+    rng = np.random.default_rng([seed, len(db_name), sum(map(ord, db_name))])
+    listed = market.iloc[np.sort(rng.choice(len(market), restaurant_count, replace=False))].reset_index(drop=True)
+    restaurant_ids = np.arange(restaurant_count)
+    review_count = listed['review_count']
+    if config['review_count_suffix']:
+        review_count = review_count.astype(str) + config['review_count_suffix']
+    category = listed['category']
+    if config['category_match'] == 'contains':
+        category = category.str.lower().str.replace(' ', '-')
+    location_count = max(20, restaurant_count // 100)
+    item_count = restaurant_count * menu_items_per_restaurant
+    price = rng.uniform(2, 40, item_count).round(2)
+    if config['price_divisor'] != 1:
+        price = (price * config['price_divisor']).round().astype(np.int64)
+    return {
+        'restaurants': pd.DataFrame({
+            'id': restaurant_ids,
+            'name': listed['name'],
+            'rating': (listed['rating'] + rng.choice([-0.1, 0, 0.1], restaurant_count)).clip(1, 5).round(1),
+            'review_count': review_count,
+            # a listing is a few meters from where the other platforms put the restaurant
+            'lat': listed['lat'] + rng.normal(0, 0.0001, restaurant_count),
+            'lon': listed['lon'] + rng.normal(0, 0.0001, restaurant_count),
+        }),
+        'locations': pd.DataFrame({
+            'id': np.arange(location_count),
+            'name': [f'Location {number}' for number in range(location_count)],
+            'lat': rng.uniform(*LAT_RANGE, location_count),
+            'lon': rng.uniform(*LON_RANGE, location_count),
+        }),
+        'locations_to_restaurants': pd.DataFrame({
+            'restaurant_id': restaurant_ids,
+            'location_id': rng.integers(0, location_count, restaurant_count),
+        }),
+        'categories': pd.DataFrame({'restaurant_id': restaurant_ids, 'category': category}),
+        'menu_items': pd.DataFrame({
+            'restaurant_id': np.repeat(restaurant_ids, menu_items_per_restaurant),
+            'name': rng.choice(DISHES, item_count),
+            'description': 'Synthetic menu item',
+            'price': price,
+        }),
+    }
+
+
+def write_platform_database(tables, db_name, db_file):
+    """
+    Write the logical tables of generate_platform_tables to a SQLite file, under the
+    table and column names of the platform in PLATFORM_SCHEMAS.
+    """
+    config = PLATFORM_SCHEMAS[db_name]
+    physical_tables = {}
+    for logical_table, df in tables.items():
+        spec = config['tables'][logical_table]
+        df = df[list(spec['columns'])].rename(columns=spec['columns'])
+        if spec['table'] in physical_tables:
+            # deliveroo keeps the category on the restaurant row, both frames have one row per restaurant
+            existing = physical_tables[spec['table']]
+            df = existing.join(df.drop(columns=[col for col in df.columns if col in existing.columns]))
+        physical_tables[spec['table']] = df
+    tmp_file = f'{db_file}.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    connection = sqlite3.connect(tmp_file)
+    with connection:
+        for physical_table, df in physical_tables.items():
+            df.to_sql(physical_table, connection, index=False, chunksize=100000)
+    connection.close()
+    os.replace(tmp_file, db_file)
+
+
+def generate_databases(db_dir, restaurant_count, menu_items_per_restaurant=5, seed=0):
+    """
+    Synthetic ubereats, takeaway and deliveroo databases with the schemas of PLATFORM_SCHEMAS.
+
+    The databases are kept with a generated.json describing them, and only generated
+    again when they were made with other parameters.
+
+    Args:
+        db_dir (str): Directory of the database files.
+        restaurant_count (int): Number of restaurants per platform.
+        menu_items_per_restaurant (int): Number of menu items per restaurant.
+        seed (int): Seed of the random data, the same seed gives the same databases.
+
+    Returns:
+        float: Seconds spent generating, 0 when the databases were reused.
+    """
+    params = {'restaurant_count': restaurant_count, 'menu_items_per_restaurant': menu_items_per_restaurant,
+              'seed': seed, 'platforms': sorted(PLATFORM_SCHEMAS)}
+    params_path = os.path.join(db_dir, 'generated.json')
+    if os.path.exists(params_path):
+        with open(params_path) as f:
+            if json.load(f) == params:
+                return 0.0
+    start = time.perf_counter()
+    os.makedirs(db_dir, exist_ok=True)
+    market = generate_market(restaurant_count, seed)
+    for db_name in PLATFORM_SCHEMAS:
+        tables = generate_platform_tables(market, db_name, restaurant_count, menu_items_per_restaurant, seed)
+        write_platform_database(tables, db_name, os.path.join(db_dir, f'{db_name}.db'))
+    with open(params_path, 'w') as f:
+        json.dump(params, f)
+    seconds = time.perf_counter() - start
+    print(f"Generated {len(PLATFORM_SCHEMAS)} databases with {restaurant_count} restaurants each in {seconds:.1f}s")
+    return seconds
+
+
+def reset_work_dir(work_dir):
+    """
+    Remove everything a previous run left in work_dir except the generated databases, so
+    every run starts with cold caches, and put the border file back.
+    """
+    for entry in os.listdir(work_dir):
+        if entry != 'databases':
+            path = os.path.join(work_dir, entry)
+            shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+    db_dir = os.path.join(work_dir, 'databases')
+    for entry in os.listdir(db_dir):
+        path = os.path.join(db_dir, entry)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif not (entry.endswith('.db') or entry == 'generated.json'):
+            os.remove(path)
+    for directory in ('vizualizations_data/kapsalons_data', 'price_destribution_data'):
+        os.makedirs(os.path.join(work_dir, directory), exist_ok=True)
+    shutil.copy(os.path.join(REPO_DIR, BORDER_FILE), os.path.join(work_dir, BORDER_FILE))
+
+
+def get_questions():
+    """Names of the answer_* methods of Answerer, in the order they are defined."""
+    from utils.answer import Answerer
+    return [name for name in vars(Answerer) if name.startswith('answer_') and name != 'answer_all_mvp']
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(func, trace_memory):
+    """Seconds func takes and the peak of the traced memory in MB while it runs."""
+    if trace_memory:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    peak_memory_mb = round(tracemalloc.get_traced_memory()[1] / 1e6, 2) if trace_memory else None
+    return {'seconds': round(seconds, 4), 'peak_memory_mb': peak_memory_mb}
+
+
+def run_scale(work_dir, restaurant_count, store=False, trace_memory=True, menu_items_per_restaurant=5, seed=0):
+    """
+    Time every question of Answerer on synthetic databases of one size, with cold caches.
+
+    Runs in work_dir, because Answerer reads and writes relative paths. No figure is
+    opened: they all go to a report that is not written, and the maps are rendered with
+    offline tiles only so the timings do not depend on the network.
+
+    Args:
+        work_dir (str): Directory of the databases and of everything the run writes.
+        restaurant_count (int): Number of restaurants per platform.
+        store (bool): Answer from the Parquet analytics store instead of the databases.
+        trace_memory (bool): Record the peak memory of every question with tracemalloc.
+            It slows Python allocations down, only compare results that used the same setting.
+        menu_items_per_restaurant (int): Number of menu items per restaurant.
+        seed (int): Seed of the synthetic data.
+
+    Returns:
+        dict: Timings of the setup and of every question.
+    """
+    from utils.answer import Answerer
+    generate_seconds = generate_databases(os.path.join(work_dir, 'databases'), restaurant_count, menu_items_per_restaurant, seed)
+    reset_work_dir(work_dir)
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        answerer = None
+
+        def setup():
+            nonlocal answerer
+            answerer = Answerer(store_dir='databases/store' if store else None, report_path='report.html')
+            answerer.tile_cache.offline = True
+            # the pre-exported CSVs the distribution maps are drawn from
+            answerer.exporter.export(['restaurants_per_location'])
+
+        result = {'restaurants': restaurant_count, 'generate_seconds': round(generate_seconds, 2),
+                  'setup': measure(setup, trace_memory), 'questions': {}}
+        for question in get_questions():
+            print(f"--- {question} with {restaurant_count} restaurants per platform")
+            result['questions'][question] = measure(getattr(answerer, question), trace_memory)
+        answerer.manager.close()
+    finally:
+        os.chdir(cwd)
+    return result
+
+
+def run_benchmark(scales=SCALES, data_dir='benchmarks/data', results_path=None, store=False, trace_memory=True,
+                  menu_items_per_restaurant=5, seed=0):
+    """
+    Run the benchmark at every scale and write the results as JSON.
+
+    Args:
+        scales (list): Numbers of restaurants per platform.
+        data_dir (str): Directory with one work directory per scale. The generated
+            databases are kept there between runs.
+        results_path (str): JSON file of the results. Default is
+            benchmarks/results/<commit>.json.
+        store, trace_memory, menu_items_per_restaurant, seed: See run_scale.
+
+    Returns:
+        dict: The results.
+    """
+    commit = get_commit()
+    if trace_memory:
+        tracemalloc.start()
+    results = {
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'store': store,
+        'trace_memory': trace_memory,
+        'menu_items_per_restaurant': menu_items_per_restaurant,
+        'seed': seed,
+        'scales': [],
+    }
+    try:
+        for restaurant_count in scales:
+            work_dir = os.path.abspath(os.path.join(data_dir, str(restaurant_count)))
+            results['scales'].append(run_scale(work_dir, restaurant_count, store, trace_memory, menu_items_per_restaurant, seed))
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    if results_path is None:
+        results_path = os.path.join('benchmarks', 'results', f"{commit or 'results'}.json")
+    os.makedirs(os.path.dirname(results_path) or '.', exist_ok=True)
+    with open(results_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark results written to {results_path}")
+    return results
+
+
+def flatten_results(results):
+    rows = []
+    for scale in results['scales']:
+        for step, measured in [('setup', scale['setup']), *scale['questions'].items()]:
+            rows.append({'restaurants': scale['restaurants'], 'step': step, **measured})
+    return pd.DataFrame(rows)
+
+
+def compare_results(baseline_path, results_path, tolerance=0.2):
+    """
+    Compare two benchmark result files, for example of two commits.
+
+    Args:
+        baseline_path (str): Results of the reference run.
+        results_path (str): Results of the new run.
+        tolerance (float): Relative slowdown or memory increase above which a step is
+            marked as a regression.
+
+    Returns:
+        pd.DataFrame: Seconds and peak memory of both runs per scale and step, their
+        ratios and a regression column.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(results_path) as f:
+        results = json.load(f)
+    if baseline['trace_memory'] != results['trace_memory'] or baseline['store'] != results['store']:
+        print("Warning: the runs used different settings, their timings are not comparable")
+    df = flatten_results(baseline).merge(flatten_results(results), on=['restaurants', 'step'], suffixes=('_baseline', ''))
+    df['time_ratio'] = df['seconds'] / df['seconds_baseline']
+    df['memory_ratio'] = df['peak_memory_mb'] / df['peak_memory_mb_baseline']
+    df['regression'] = (df['time_ratio'] > 1 + tolerance) | (df['memory_ratio'] > 1 + tolerance)
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(df.round(3).to_string(index=False))
+    print(f"{df['regression'].sum()} regressions of more than {tolerance:.0%}")
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the questions on synthetic platform databases.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='Generate the databases and time every question.')
+    run_parser.add_argument('--scales', type=int, nargs='+', default=list(SCALES))
+    run_parser.add_argument('--data-dir', default='benchmarks/data')
+    run_parser.add_argument('--output', default=None)
+    run_parser.add_argument('--store', action='store_true', help='Answer from the Parquet analytics store.')
+    run_parser.add_argument('--no-trace-memory', dest='trace_memory', action='store_false')
+    run_parser.add_argument('--menu-items', type=int, default=5)
+    run_parser.add_argument('--seed', type=int, default=0)
+    compare_parser = subparsers.add_parser('compare', help='Compare two result files.')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('results')
+    compare_parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    match args.command:
+        case 'run':
+            run_benchmark(args.scales, args.data_dir, args.output, args.store, args.trace_memory, args.menu_items, args.seed)
+        case 'compare':
+            compare_results(args.baseline, args.results, args.tolerance)
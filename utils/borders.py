@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+
+import geopandas as gpd
+import shapely
+
+from utils.dbhandler import get_db_fingerprint
+
+
+# Simplification tolerances in EPSG:3857 meters. 0 is the full detail geometry.
+BORDER_TOLERANCES = (0, 50, 150, 500, 1500)
+MANIFEST_FILE = 'manifest.json'
+
+
+def get_cache_dir(border_path):
+    return os.path.join(os.path.dirname(border_path), 'borders_cache')
+
+
+def get_level_path(border_path, cache_dir, tolerance):
+    stem = os.path.splitext(os.path.basename(border_path))[0]
+    return os.path.join(cache_dir, f'{stem}_{tolerance}m.parquet')
+
+
+def is_border_cache_current(border_path, cache_dir):
+    """True when cache_dir holds the levels of the current version of border_path."""
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    sources = manifest.get('sources', {})
+    return sources.get(os.path.basename(border_path)) == get_db_fingerprint(border_path)
+
+
+def build_border_cache(border_path, cache_dir=None, tolerances=BORDER_TOLERANCES):
+    """
+    Project the region borders to EPSG:3857 once and store them as GeoParquet,
+    simplified at each of the tolerances.
+
+    The regions are simplified together as a coverage, so neighbouring regions keep
+    sharing the same edge and no gaps or overlaps appear between them.
+
+    Args:
+        border_path (str): Shapefile or GeoJSON file with the region borders.
+        cache_dir (str): Directory of the cache. Default is borders_cache next to border_path.
+        tolerances (tuple): Simplification tolerances in meters.
+    """
+    cache_dir = cache_dir or get_cache_dir(border_path)
+    borders = gpd.read_file(border_path)
+    if borders.crs is None:
+        borders.set_crs(epsg=4326, inplace=True)
+    borders = borders.to_crs(epsg=3857)
+    os.makedirs(cache_dir, exist_ok=True)
+    for tolerance in tolerances:
+        level = borders.copy()
+        if tolerance > 0:
+            level['geometry'] = shapely.coverage_simplify(borders.geometry.values, tolerance)
+        # written aside and moved in place, so map workers building the cache together do not clash
+        level_path = get_level_path(border_path, cache_dir, tolerance)
+        tmp_path = f'{level_path}.{os.getpid()}.tmp'
+        level.to_parquet(tmp_path)
+        os.replace(tmp_path, level_path)
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    manifest = {'sources': {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    manifest['sources'][os.path.basename(border_path)] = get_db_fingerprint(border_path)
+    tmp_path = f'{manifest_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    print(f"Border cache of {border_path} written to {cache_dir}")
+
+
+def pick_tolerance(pixel_size, tolerances=BORDER_TOLERANCES):
+    """Coarsest tolerance that stays below the size of a pixel, so the simplification is invisible."""
+    return max(tolerance for tolerance in tolerances if tolerance <= pixel_size)
+
+
+def load_borders(border_path, pixel_size=0, cache_dir=None):
+    """
+    Region borders in EPSG:3857, at the level of detail of the output resolution.
+
+    The cache is (re)built first when border_path changed since it was written.
+
+    Args:
+        border_path (str): Shapefile or GeoJSON file with the region borders.
+        pixel_size (float): Size of an output pixel in meters. Default is 0, full detail.
+        cache_dir (str): Directory of the cache. Default is borders_cache next to border_path.
+
+    Returns:
+        gpd.GeoDataFrame: The region borders.
+    """
+    cache_dir = cache_dir or get_cache_dir(border_path)
+    if not is_border_cache_current(border_path, cache_dir):
+        build_border_cache(border_path, cache_dir)
+    return gpd.read_parquet(get_level_path(border_path, cache_dir, pick_tolerance(pixel_size)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the projected and simplified border cache.')
+    parser.add_argument('border_path', nargs='?', default='vizualizations_data/belgium-with-regions_.geojson')
+    parser.add_argument('--cache-dir', default=None)
+    args = parser.parse_args()
+    build_border_cache(args.border_path, args.cache_dir)
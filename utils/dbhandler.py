@@ -1,437 +1,814 @@
-from sqlalchemy.ext.automap import automap_base
-from sqlalchemy import create_engine,inspect,func,desc, cast,distinct, not_
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import text
+from sqlalchemy import create_engine,inspect,event,make_url
+from sqlalchemy.orm import sessionmaker,scoped_session
 
-from sqlalchemy import Table, MetaData, String, Integer,Float
+from sqlalchemy import Table, MetaData, text, Boolean, Integer, Float, Numeric, String
 import pandas as pd
+import numpy as np
+from utils.platforms import PlatformSchema
+from utils import queries
+from utils.search import MenuSearchIndex
+from utils.dtypes import normalize_dtypes
+from utils.profiling import span, current_path, instrument_engine
+import os
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from collections import OrderedDict
+import threading
+import hashlib
+import sqlite3
 db_urls = {
         'ubereats': 'sqlite:///databases/ubereats.db',
         'deliveroo': 'sqlite:///databases/deliveroo.db',
         'takeaway': 'sqlite:///databases/takeaway.db'
     }
+PRICE_BINS = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
+
+
+
+def get_db_file(url):
+    """Path of the SQLite file behind a url, also for 'file:' URI urls. None for other databases."""
+    url = make_url(url)
+    if not url.drivername.startswith('sqlite') or not url.database:
+        return None
+    return url.database.removeprefix('file:')
+
+
+def create_sqlite_engine(db_url, sqlite_mode='ro', pool_size=5):
+    """
+    Create an engine that many threads can read from at the same time.
+
+    Args:
+        db_url (str): SQLAlchemy url of the database.
+        sqlite_mode (str): 'ro' opens the file read-only, 'immutable' also skips all locking
+            (only for files nothing writes to while we read), 'wal' opens it read-write in
+            WAL journal mode so readers do not block on a writer, None keeps the default.
+        pool_size (int): Number of pooled connections kept open per database.
+
+    Returns:
+        Engine: SQLAlchemy engine with a connection pool.
+    """
+    url = make_url(db_url)
+    db_file = get_db_file(url)
+    if db_file is None or db_file == ':memory:':
+        return instrument_engine(create_engine(url, echo=False))
+    match sqlite_mode:
+        case 'ro':
+            url = url.set(database=f'file:{db_file}', query={'mode': 'ro', 'uri': 'true'})
+        case 'immutable':
+            url = url.set(database=f'file:{db_file}', query={'mode': 'ro', 'immutable': '1', 'uri': 'true'})
+        case 'wal' | None:
+            pass
+        case _:
+            raise ValueError(f"Unsupported sqlite mode: {sqlite_mode}")
+    # pooled connections are handed to whichever thread checks them out
+    engine = create_engine(url, echo=False, pool_size=pool_size, max_overflow=pool_size,
+                           connect_args={'check_same_thread': False})
+    if sqlite_mode == 'wal':
+        @event.listens_for(engine, 'connect')
+        def set_wal_mode(dbapi_connection, connection_record):
+            dbapi_connection.execute('PRAGMA journal_mode=WAL')
+    return instrument_engine(engine)
+
+
+class LazyTables(dict):
+    """
+    Dictionary of the tables of one database that reflects a table the first time it is looked up.
+
+    When cache_path is given the reflected metadata is pickled there together with the
+    mtime of the database file, and reused as long as the file has not changed. Tables
+    reflected since the last save are written by save_cache, which DataBaseManager calls
+    once per query rather than once per table.
+    """
+    def __init__(self, engine, cache_path=None) -> None:
+        super().__init__()
+        self.engine = engine
+        self.cache_path = cache_path
+        self.db_mtime = self.get_db_mtime()
+        self.metadata = self.load_cache()
+        self.dirty = False
+        self.names = None
+        self.triggers = None
+        self.lock = threading.Lock()
+
+    def get_db_mtime(self):
+        db_file = get_db_file(self.engine.url)
+        if db_file and os.path.exists(db_file):
+            return os.path.getmtime(db_file)
+        return None
+
+    def load_cache(self):
+        if self.cache_path is None or self.db_mtime is None or not os.path.exists(self.cache_path):
+            return MetaData()
+        with open(self.cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['mtime'] != self.db_mtime:
+            return MetaData()
+        return cached['metadata']
+
+    def save_cache(self):
+        """Pickle the metadata when tables were reflected since it was last saved or loaded."""
+        with self.lock:
+            if not self.dirty or self.cache_path is None or self.db_mtime is None:
+                return
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            tmp_path = f'{self.cache_path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'mtime': self.db_mtime, 'metadata': self.metadata}, f)
+            os.replace(tmp_path, self.cache_path)
+            self.dirty = False
+
+    def __missing__(self, tabel):
+        with self.lock:
+            if tabel in self.keys():
+                return dict.__getitem__(self, tabel)
+            if tabel not in self.metadata.tables:
+                with span('reflect', table=tabel):
+                    Table(f'{tabel}', self.metadata, autoload_with=self.engine)
+                self.dirty = True
+            self[tabel] = self.metadata.tables[tabel]
+            return dict.__getitem__(self, tabel)
+
+    def table_names(self):
+        """Names of all tables in the database, looked up once."""
+        with self.lock:
+            if self.names is None:
+                self.names = set(inspect(self.engine).get_table_names())
+            return self.names
+
+    def trigger_names(self):
+        """Names of all triggers in the database, looked up once."""
+        with self.lock:
+            if self.triggers is None:
+                with self.engine.connect() as connection:
+                    self.triggers = set(connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).scalars())
+            return self.triggers
+
+
+def count_in_bins(values, edges):
+    """Number of values per bin, bins are closed on the left like pd.cut(..., right=False)."""
+    if len(edges) < 2:
+        return np.zeros(0, dtype=np.int64)
+    bin_index = np.searchsorted(edges, values, side='right') - 1
+    bin_index = bin_index[(bin_index >= 0) & (bin_index < len(edges) - 1)]
+    return np.bincount(bin_index, minlength=len(edges) - 1)
+
+
+def get_bin_labels(edges):
+    return [f'{low:g}-{high:g}' for low, high in zip(edges[:-1], edges[1:])]
+
+
+def get_db_fingerprint(db_file, use_hash=False):
+    """
+    Identify the current state of a database file by its size and mtime,
+    and optionally by a sha256 of its content (slower, but robust to copies and touched files).
+    """
+    stat = os.stat(db_file)
+    fingerprint = f'{stat.st_size}:{stat.st_mtime_ns}'
+    if use_hash:
+        digest = hashlib.sha256()
+        with open(db_file, 'rb') as f:
+            for block in iter(partial(f.read, 1 << 20), b''):
+                digest.update(block)
+        fingerprint += f':{digest.hexdigest()}'
+    return fingerprint
+
+
+def get_column_kinds(query):
+    """Kind of every column of a select from its SQL type: 'integer', 'float', 'boolean', 'string' or None when unknown."""
+    kinds = {}
+    for column in query.selected_columns:
+        match column.type:
+            case Boolean():
+                kinds[column.key] = 'boolean'
+            case Integer():
+                kinds[column.key] = 'integer'
+            case Float() | Numeric():
+                kinds[column.key] = 'float'
+            case String():
+                kinds[column.key] = 'string'
+            case _:
+                kinds[column.key] = None
+    return kinds
+
+
+# pandas dtype per column kind, nullable so that every chunk of a column has the same dtype
+PANDAS_DTYPES = {'integer': 'Int64', 'float': 'float64', 'boolean': 'boolean', 'string': 'object'}
+
+
+class ResultCache:
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024, memory_items=64, file_format='parquet', use_hash=False) -> None:
+        """
+        Cache of query results, kept in memory (LRU) and on disk as Parquet or Feather files.
+
+        Entries are keyed by the compiled SQL, its parameters and the fingerprint of the
+        database file, so a result is recomputed as soon as the database changes.
+
+        Args:
+            cache_dir (str): Directory for the cached result files.
+            max_bytes (int): Size of the disk cache, the least recently used files are removed beyond it.
+            memory_items (int): Number of results kept in memory.
+            file_format (str): 'parquet' or 'feather'.
+            use_hash (bool): Also hash the database content for the fingerprint instead of only size and mtime.
+        """
+        if file_format not in ('parquet', 'feather'):
+            raise ValueError(f"Unsupported cache format: {file_format}")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.file_format = file_format
+        self.use_hash = use_hash
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # reads, touches and evictions of the files, so no thread removes a file another one is reading
+        self.file_lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, sql, params, db_file):
+        fingerprint = get_db_fingerprint(db_file, self.use_hash) if db_file else ''
+        key_source = f'{sql}|{sorted(params.items())!r}|{fingerprint}'
+        return hashlib.sha256(key_source.encode()).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.{self.file_format}')
+
+    def get(self, key):
+        """Cached DataFrame for key, or None."""
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key].copy()
+        path = self.get_path(key)
+        try:
+            with self.file_lock:
+                df = self.read(path)
+                os.utime(path)  # mark as recently used for the eviction
+        except FileNotFoundError:
+            # never cached, or removed by another process sharing the directory
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+            self.remember(key, df)
+        return df.copy()
+
+    def read(self, path):
+        match self.file_format:
+            case 'parquet':
+                return pd.read_parquet(path)
+            case 'feather':
+                return pd.read_feather(path)
+
+    def put(self, key, df):
+        path = self.get_path(key)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        match self.file_format:
+            case 'parquet':
+                df.to_parquet(tmp_path, index=False)
+            case 'feather':
+                df.reset_index(drop=True).to_feather(tmp_path)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.remember(key, df.copy())
+        self.evict()
+
+    def remember(self, key, df):
+        self.memory[key] = df
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def evict(self):
+        """
+        Remove the least recently used files until the disk cache fits in max_bytes.
+
+        Files that disappear meanwhile, removed by another process sharing the
+        directory, are skipped.
+        """
+        with self.file_lock:
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(f'.{self.file_format}'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+        with self.file_lock:
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(f'.{self.file_format}'):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'memory_items': len(self.memory)}
+
+
+class PlatformAnalyses():
+    """
+    Cross-platform aggregates, shared by DataBaseManager and utils.store.AnalyticsStore.
+    Subclasses provide fan_out, get_fingerprints and the per-platform methods (rest_per_loc_query,
+    query_prices_per_db, get_price_histogram, get_kapsalons, get_veg_restaurants, ...).
+    The CSV files under vizualizations_data/ are written by utils.exporter only.
+    """
 
+    def create_prices_df_for_all_db(self):
+        prices_dict = self.fan_out(self.query_prices_per_db)
+        prices_df = pd.DataFrame({key: pd.Series(value) for key, value in prices_dict.items()})
+        return prices_df
 
+    def create_price_histogram_for_all_db(self, bins=PRICE_BINS):
+        """Price bin counts of every platform in long format, with a 'Platform' column."""
+        histograms = self.fan_out(self.get_price_histogram, bins=bins)
+        return normalize_dtypes(pd.concat([df.assign(Platform=db_name) for db_name, df in histograms.items()], ignore_index=True))[0]
 
+    def get_full_kapsalons_df(self):
+        kapsalons_list = list(self.fan_out(self.get_kapsalons).values())
+        kapsalons_df = pd.concat(kapsalons_list, ignore_index=True)
+        return kapsalons_df
 
+    def save_kapsalons_to_csv(self, file_name='vizualizations_data/kapsalons_data/kapsalons.csv'):
+        df = self.get_full_kapsalons_df()
+        df.to_csv(file_name, index=False)
+        print(f"Kapsalons saved to {file_name}")
 
-
-class DataBaseManager():
-    def __init__(self,db_urls) -> None:
+    def get_full_veg_restaurants(self, matcher=None):
+        """
+        Vegetarian restaurants of all platforms.
+
+        Args:
+            matcher (RestaurantMatcher): Optional, keep one row per restaurant listed on
+                several platforms.
+        """
+        veg_list = list(self.fan_out(self.get_veg_restaurants).values())
+        # the categories of the platforms differ, so the concatenated columns are normalised again
+        veg_full_df = normalize_dtypes(pd.concat(veg_list, ignore_index=True))[0]
+        if matcher is not None:
+            return normalize_dtypes(matcher.deduplicate(veg_full_df, name_column='Restaurant_Name'))[0]
+        return veg_full_df
+
+
+class DataBaseManager(PlatformAnalyses):
+    def __init__(self,db_urls,reflection_cache_dir=None,max_workers=None,sqlite_mode='ro',pool_size=5,result_cache=None,search_index_path=None) -> None:
+        """
+        Nothing is reflected here: engines, sessions and tables are created per database
+        the first time a query needs them. Sessions are thread-local and share the pooled
+        connections of their engine, so the manager can be used from many threads.
+
+        Args:
+            db_urls (dict): Dictionary with database names as keys and SQLAlchemy urls as values.
+            reflection_cache_dir (str): Optional directory for pickled reflection caches, one per database.
+            max_workers (int): Number of threads used by fan_out. Default is one per database.
+            sqlite_mode (str): How the SQLite files are opened, see create_sqlite_engine. Default is read-only.
+            pool_size (int): Number of pooled connections per database.
+            result_cache (ResultCache): Optional cache for the results of run_query.
+            search_index_path (str): Optional file the dish search index is saved to and loaded from.
+        """
         self.db_data = {}
         self.db_urls = db_urls
-        for db_name, db_url in db_urls.items():
-            self.db_data[db_name] = {'engine': None, 'session': None, 'tables': {}}
-            engine = create_engine(db_url, echo=False)
-            inspector = inspect(engine)
-            self.db_data[db_name]['engine'] = engine
-            Session = sessionmaker(bind=engine)
-            self.db_data[db_name]['session'] = Session()
-            Base = automap_base()
-            Base.prepare(autoload_with=engine)
-            tabel_list = inspector.get_table_names()
-            match db_name:
-                case 'ubereats':
-                    metadata = MetaData()
-                    for tabel in tabel_list:
-                        self.db_data[db_name]['tables'][tabel] =   Table(f'{tabel}', metadata, autoload_with=engine)
-                case _:
-                    base_tabel_list = Base.classes.keys()
-                    for tabel in base_tabel_list:
-                        self.db_data[db_name]['tables'][tabel] = Base.classes[f'{tabel}']
-                    metadata = MetaData()
-                    many_to_many_list = [x for x in tabel_list if x not in base_tabel_list]
-                    for tabel in many_to_many_list:
-                        self.db_data[db_name]['tables'][tabel] = Table(f'{tabel}',metadata,autoload_with=engine)
+        self.reflection_cache_dir = reflection_cache_dir
+        self.max_workers = max_workers or len(db_urls)
+        self.sqlite_mode = sqlite_mode
+        self.pool_size = pool_size
+        self.result_cache = result_cache
+        self.search_index_path = search_index_path
+        self.search_index = None
+        self.timings = {}
+        self.memory_saved = {}
+        self.lock = threading.Lock()
+        for db_name in db_urls.keys():
+            self.db_data[db_name] = {'engine': None, 'session': None, 'tables': None}
+
+    def get_engine(self,db_name):
+        with self.lock:
+            if self.db_data[db_name]['engine'] is None:
+                self.db_data[db_name]['engine'] = create_sqlite_engine(self.db_urls[db_name], sqlite_mode=self.sqlite_mode, pool_size=self.pool_size)
+            return self.db_data[db_name]['engine']
 
     def get_session(self,db_name):
-        return self.db_data[db_name]['session']
-    
+        """Session of the calling thread. Closing it returns its connection to the pool."""
+        if self.db_data[db_name]['session'] is None:
+            engine = self.get_engine(db_name)
+            with self.lock:
+                if self.db_data[db_name]['session'] is None:
+                    self.db_data[db_name]['session'] = scoped_session(sessionmaker(bind=engine))
+        return self.db_data[db_name]['session']()
+
     def get_tables(self,db_name):
+        if self.db_data[db_name]['tables'] is None:
+            engine = self.get_engine(db_name)
+            cache_path = None
+            if self.reflection_cache_dir is not None:
+                cache_path = os.path.join(self.reflection_cache_dir, f'{db_name}.pkl')
+            with self.lock:
+                if self.db_data[db_name]['tables'] is None:
+                    self.db_data[db_name]['tables'] = LazyTables(engine, cache_path=cache_path)
         return self.db_data[db_name]['tables']
-    
 
-    def rest_per_loc_query(self,db_name = 'ubereats'):
-        session = self.get_session(db_name)
+    def close(self):
+        """Close the sessions of all threads and the pooled connections of every database."""
+        for data in self.db_data.values():
+            if data['session'] is not None:
+                data['session'].remove()
+            if data['engine'] is not None:
+                data['engine'].dispose()
+
+    def reset_tables(self,db_name):
+        """Forget the reflected tables of a database, after its schema was changed."""
+        with self.lock:
+            self.db_data[db_name]['tables'] = None
+            if self.reflection_cache_dir is not None:
+                cache_path = os.path.join(self.reflection_cache_dir, f'{db_name}.pkl')
+                if os.path.exists(cache_path):
+                    os.remove(cache_path)
+
+    def get_schema(self,db_name):
+        return PlatformSchema(db_name, self.get_tables(db_name))
+
+    def build_query(self,logical_query,db_name,**params):
+        """The select of a logical query for one platform, saving the tables it reflected to the reflection cache."""
         tables = self.get_tables(db_name)
-        locations = tables['locations']
-        locations_to_restaurants = tables['locations_to_restaurants']
-        match db_name:
-            case 'ubereats':
-                query = session.query(
-                    locations.c.id.label('id'),
-                    locations.c.name.label('location_name'),
-                    locations.c.latitude.label('lat'),
-                    locations.c.longitude.label('lon'),
-                    func.count(locations_to_restaurants.c.restaurant_id).label('restaurant_count')).outerjoin(locations_to_restaurants,locations.c.id == locations_to_restaurants.c.location_id).group_by(locations.c.id).order_by(desc('restaurant_count'))
-            case 'takeaway':
-                query = session.query(
-                    locations.ID.label('id'),
-                    locations.name.label('location_name'),
-                    locations.latitude.label('lat'),
-                    locations.longitude.label('lon'),
-                    func.count(locations_to_restaurants.c.restaurant_id).label('restaurant_count')).outerjoin(locations_to_restaurants,locations.ID == locations_to_restaurants.c.location_id).group_by(locations.ID).order_by(desc('restaurant_count'))
-            case 'deliveroo':
-                query = session.query(
-                    locations.id.label('id'),
-                    locations.name.label('location_name'),
-                    locations.latitude.label('lat'),
-                    locations.longitude.label('lon'),
-                    func.count(locations_to_restaurants.c.restaurant_id).label('restaurant_count')).outerjoin(locations_to_restaurants,locations.id == locations_to_restaurants.c.location_id).group_by(locations.id).order_by(desc('restaurant_count'))
-        res = query.all()
-        df = pd.DataFrame(res,columns=['id','name','lat','lon','rest_count'])
-        session.close()
-        return df
+        query = logical_query(PlatformSchema(db_name, tables), **params)
+        tables.save_cache()
+        return query
+
+    def run_query(self,logical_query,db_name,use_cache=True,**params):
+        """
+        Compile a logical query from utils/queries.py for one platform and run it.
+
+        Args:
+            logical_query (callable): Function taking a PlatformSchema (and params) and returning a select.
+            db_name (str): Name of the platform database.
+            use_cache (bool): Look up and store the result in the result cache, if there is one.
+
+        Returns:
+            pd.DataFrame: Query result with the labels of the logical query as columns, in
+            the compact dtypes of utils/dtypes.py.
+        """
+        with span(logical_query.__name__, db=db_name) as attributes:
+            query = self.build_query(logical_query, db_name, **params)
+            use_cache = use_cache and self.result_cache is not None
+            if use_cache:
+                with span('cache lookup'):
+                    compiled = query.compile(dialect=self.get_engine(db_name).dialect)
+                    key = self.result_cache.make_key(str(compiled), compiled.params, get_db_file(self.db_urls[db_name]))
+                    df = self.result_cache.get(key)
+                if df is not None:
+                    attributes.update(cached=True, rows=len(df))
+                    return normalize_dtypes(df)[0]
+            session = self.get_session(db_name)
+            with span('sql'):
+                res = session.execute(query)
+                rows = res.all()
+            with span('dataframe'):
+                df = pd.DataFrame(rows, columns=list(res.keys()))
+                session.close()
+                df, saved = normalize_dtypes(df)
+            self.memory_saved[(logical_query.__name__, db_name)] = saved
+            attributes.update(cached=False, rows=len(df))
+            if use_cache:
+                with span('cache store'):
+                    self.result_cache.put(key, df)
+            return df
+
+    def report_memory_saved(self):
+        """Print the memory the compact dtypes saved on the last result of every query and platform, returns the total in bytes."""
+        for (query_name, db_name), saved in sorted(self.memory_saved.items()):
+            print(f"{query_name} on {db_name}: {saved / 1e6:.2f} MB saved")
+        total = sum(self.memory_saved.values())
+        print(f"Compact dtypes saved {total / 1e6:.2f} MB")
+        return total
+
+    def iter_query(self,logical_query,db_name,chunksize=100000,as_arrow=False,**params):
+        """
+        Run a logical query and yield its result in chunks, without holding all rows in memory.
+
+        Rows are fetched chunksize at a time with a server side cursor. Every chunk has the
+        same column types, taken from the SQL types of the query: nullable Int64, float64,
+        boolean or object. Columns of unknown type are left to pandas.
+
+        Args:
+            logical_query (callable): Function taking a PlatformSchema (and params) and returning a select.
+            db_name (str): Name of the platform database.
+            chunksize (int): Number of rows per chunk.
+            as_arrow (bool): Yield pyarrow RecordBatches built straight from the rows instead of DataFrames.
+
+        Yields:
+            pd.DataFrame or pa.RecordBatch: The next chunksize rows, or fewer for the last one.
+        """
+        query = self.build_query(logical_query, db_name, **params)
+        kinds = get_column_kinds(query)
+        if as_arrow:
+            import pyarrow as pa
+            arrow_types = {'integer': pa.int64(), 'float': pa.float64(), 'boolean': pa.bool_(), 'string': pa.string()}
+        session = self.get_session(db_name)
+        try:
+            result = session.execute(query.execution_options(yield_per=chunksize))
+            columns = list(result.keys())
+            for rows in result.partitions():
+                if as_arrow:
+                    values = list(zip(*rows))
+                    yield pa.RecordBatch.from_arrays(
+                        [pa.array(values[number], type=arrow_types.get(kinds.get(column))) for number, column in enumerate(columns)],
+                        names=columns)
+                else:
+                    chunk = pd.DataFrame.from_records(rows, columns=columns)
+                    yield chunk.astype({column: PANDAS_DTYPES[kinds[column]] for column in columns if kinds.get(column)})
+        finally:
+            session.close()
+
+    def fan_out(self,func,db_names=None,label=None,**params):
+        """
+        Call func(db_name, **params) for several databases concurrently.
+
+        Every database is a separate SQLite file with its own engine and session, so the
+        platforms do not share any state and the wall-clock time is that of the slowest one.
+        The time spent per platform is printed, and kept in self.timings[label] until the
+        next call with the same label. Each call times into a dict of its own, so calls
+        running at the same time (like those of the HTTP service) do not mix their timings.
+
+        Args:
+            func (callable): Function taking the database name as first argument.
+            db_names (list): Databases to run on. Default is all databases.
+            label (str): Name used in the timing output. Default is the name of func.
+
+        Returns:
+            dict: Result of func per database, in the order of db_names.
+        """
+        if db_names is None:
+            db_names = list(self.db_data.keys())
+
+        label = label or getattr(func, '__name__', 'query')
+
+        def timed(db_name, parent):
+            start = time.perf_counter()
+            with span(f'{label} on {db_name}', parent=parent):
+                result = func(db_name, **params)
+            return result, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with span(f'fan out {label}'), ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {db_name: executor.submit(timed, db_name, current_path()) for db_name in db_names}
+            results = {}
+            timings = {}
+            for db_name, future in futures.items():
+                results[db_name], timings[db_name] = future.result()
+        wall_time = time.perf_counter() - start
+        with self.lock:
+            self.timings[label] = timings
+        for db_name in db_names:
+            print(f"{label} on {db_name}: {timings[db_name]:.3f}s")
+        print(f"{label} on {len(db_names)} databases: {wall_time:.3f}s")
+        return results
+
+    def run_query_for_all_db(self,logical_query,**params):
+        """Run the same logical query on every database, returns a dict of DataFrames per platform."""
+        return self.fan_out(partial(self.run_query, logical_query), label=logical_query.__name__, **params)
 
-    
+    def rest_per_loc_query(self,db_name = 'ubereats'):
+        return self.run_query(queries.restaurants_per_location, db_name)
 
     def get_top10_Pizza_restaurants(self,db_name):
-        session = self.get_session(db_name)
-        tables = self.get_tables(db_name)
-        restaurants = tables['restaurants']
-        print(type(restaurants))
-        match db_name:
-            case 'ubereats':
-                adjust_rating = (
-                        (restaurants.c.rating__rating_value * 0.3) + 
-                        (restaurants.c.rating__review_count * 0.7)
-                        ).label('weighted_score')
-                restaurant_to_categories = tables['restaurant_to_categories']
-                query = session.query(cast(restaurants.c.id, String).label('id'),
-                                      restaurants.c.title.label('name'),
-                                      restaurants.c.rating__rating_value.label('rating'),
-                                      func.cast(func.replace(restaurants.c.rating__review_count, '+', ''),Integer).label('review_count'),
-                                      adjust_rating 
-                                      ).outerjoin(restaurant_to_categories,restaurants.c.id == restaurant_to_categories.c.restaurant_id).where(restaurant_to_categories.c.category == 'Pizza').order_by(desc(adjust_rating)).limit(10)
-            case 'takeaway':
-                adjust_rating = ((restaurants.ratings*0.3)
-                                 + (restaurants.ratingsNumber * 0.7)).label('weighted_score')
-                rest_categories = tables['categories_restaurants']
-                query = session.query(restaurants.primarySlug.label('id'),
-                                      restaurants.name,
-                                      restaurants.ratings.label('rating'),
-                                      restaurants.ratingsNumber.label('review_count'),
-                                      adjust_rating
-                                      ).distinct().outerjoin(rest_categories,rest_categories.restaurant_id == restaurants.primarySlug).filter(rest_categories.category_id.like('%pizza%')).where().order_by(desc('weighted_score')).limit(10)
-            case 'deliveroo':
-               
-               adjust_rating = (
-                   (restaurants.rating*0.3)+
-                   (func.cast(func.replace(restaurants.rating_number, '+', ''),Integer)*0.7)
-               ).label('weighted_score')
-               query = session.query(
-                   restaurants.id,
-                   restaurants.name,
-                   restaurants.rating,
-                  func.cast(
-                    func.replace(restaurants.rating_number, '+', ''),
-                    Integer
-                ),
-                adjust_rating
-                   ).where(  
-                       restaurants.category == 'Pizza' 
-                       ).order_by(
-                           desc(adjust_rating),
-                           ).limit(10)
-        
-        res = query.all()
-        df = pd.DataFrame(res,columns=['id','name','rating','review_count','weight_score'])
+        df = self.run_query(queries.top_restaurants_in_category, db_name, category='Pizza', limit=10)
         print(df)
-        session.close()
         return df
 
-  
-
-
-    def save_to_csv_dfs_for_rpl(self):
-        df_uber = self.rest_per_loc_query().head()
-        df_uber.to_csv('vizualizations_data/ubereats_data.csv')
-        df_takeaway = self.rest_per_loc_query(db_name='takeaway').head()
-        df_takeaway.to_csv('vizualizations_data/takeaway_data.csv')
-        df_deliveroo = self.rest_per_loc_query(db_name='deliveroo').head()
-        df_deliveroo.to_csv('vizualizations_data/deliveroo_data.csv')
-
-    
     def query_prices_per_db(self, db_name='ubereats'):
-        session = self.get_session(db_name)
-        tables = self.get_tables(db_name)
-        match db_name:
-            case 'ubereats':
-                menu_items = tables['menu_items']
-                query = session.query(menu_items.c.price)
-            case 'takeaway':
-                menu_items = tables['menuItems']
-                query = session.query(menu_items.price)
-            case 'deliveroo':
-                menu_items = tables['menu_items']
-                query = session.query(menu_items.price)
-            case _:
-                raise ValueError(f"Unsupported database: {db_name}")
-        
-        prices = [row.price for row in query.all()]
-        session.close()
-        return prices
-
-    def create_prices_df_for_all_db(self):
-        prices_dict = {}
-        prices_dict['ubereats'] = self.query_prices_per_db(db_name='ubereats')
-        prices_dict['takeaway'] = self.query_prices_per_db(db_name='takeaway')
-        prices_dict['deliveroo'] = self.query_prices_per_db(db_name='deliveroo')
-        
-        prices_df = pd.DataFrame({key: pd.Series(value) for key, value in prices_dict.items()})
-        return prices_df
-    
-    def save_prices_to_csv(self, file_name='price_destribution_data/prices.csv'):
-        df = self.create_prices_df_for_all_db()
-        df.to_csv(file_name, index=False)
-        print(f"Prices saved to {file_name}")
-
-    def get_top_categories(self,db_name):
-        session = self.get_session(db_name)
-        tables = self.get_tables(db_name)
-        restaurants = tables['restaurants']
-        match db_name:
-            case 'ubereats':
-                restaurant_to_categories = tables['restaurant_to_categories']
-                query = session.query(
-                    restaurant_to_categories.c.category,
-                    func.avg(restaurants.c.rating__rating_value).label('avg_rating'),
-                    func.avg(restaurants.c.rating__review_count).label('avg_number_of_ratings')
-                    ).join(restaurants, restaurants.c.id == restaurant_to_categories.c.restaurant_id).group_by(restaurant_to_categories.c.category).having(func.avg(restaurants.c.rating__review_count)>100).order_by(func.avg(restaurants.c.rating__rating_value).desc())
-            case 'takeaway':
-                rest_categories = tables['categories_restaurants']
-                query = session.query(
-                     rest_categories.category_id.label('category'),
-                     func.avg(restaurants.ratings).label('avg_rating'),
-                     func.avg(restaurants.ratingsNumber).label('avg_number_of_ratings')).join(restaurants, restaurants.primarySlug == rest_categories.restaurant_id).group_by(rest_categories.category_id).having(func.avg(restaurants.ratingsNumber)>100).order_by(func.avg(restaurants.ratings).desc())
-
-            case 'deliveroo':
-                query = session.query(restaurants.category,
-                                     func.avg(restaurants.rating).label('avg_rating'),
-                                     func.avg(restaurants.rating_number).label('avg_number_of_ratings')).group_by(restaurants.category).having(func.avg(restaurants.rating_number)>100).order_by(func.avg(restaurants.rating).desc())
-        
-        df=pd.read_sql(query.statement,query.session.bind)
-        df['adjustedRating'] = df['avg_rating']*0.3 + df['avg_number_of_ratings']*0.7
-        sorted_df = df.sort_values(by='adjustedRating',ascending=False)
-        session.close()
-        return sorted_df
-        
-
-
-    
-
+        """Prices of all menu items of a platform, in euros."""
+        return self.run_query(queries.menu_prices, db_name)['price'].tolist()
+
+    def iter_prices(self, db_name, chunksize=100000):
+        """Yield the menu item prices of a platform in euros, as numpy arrays of at most chunksize prices."""
+        for chunk in self.iter_query(queries.menu_prices, db_name, chunksize=chunksize):
+            yield chunk['price'].to_numpy()
+
+    def get_price_histogram(self, db_name, bins=PRICE_BINS, chunksize=100000):
+        """
+        Count the menu items of a platform per price range without loading the prices.
+
+        Bins are closed on the left, like pd.cut(..., right=False). Evenly spaced bins are
+        counted by SQLite, for any other bin edges the prices are streamed in chunks and
+        counted with numpy. Both compare the prices with the same edges, so a price on an
+        edge is counted in the same bin either way. Less than two edges give no bins.
+
+        Args:
+            db_name (str): Name of the platform database.
+            bins (list): Increasing bin edges in euros.
+            chunksize (int): Number of prices per chunk for uneven bins.
+
+        Returns:
+            pd.DataFrame: 'Price Range' label and 'count' per bin.
+        """
+        edges = np.asarray(bins, dtype=float)
+        widths = np.diff(edges)
+        counts = np.zeros(len(widths), dtype=np.int64)
+        if len(widths) == 0:
+            return pd.DataFrame({'Price Range': get_bin_labels(edges), 'count': counts})
+        # only when the edges are exactly those queries.price_histogram computes from start and width
+        if np.array_equal(edges, edges[0] + np.arange(len(edges)) * widths[0]):
+            df = self.run_query(queries.price_histogram, db_name, start=edges[0], bin_width=widths[0], bin_count=len(widths))
+            counts[df['bin'].to_numpy()] = df['count'].to_numpy()
+        else:
+            for prices in self.iter_prices(db_name, chunksize=chunksize):
+                counts += count_in_bins(prices, edges)
+        return pd.DataFrame({'Price Range': get_bin_labels(edges), 'count': counts})
+
+    def get_top_categories(self, db_name, score='weighted'):
+        return self.run_query(queries.top_categories, db_name, score=score)
+
+    def get_ranked_restaurants(self, db_name, limit=10, score='weighted', **params):
+        """The limit best restaurants of every category by score, see queries.ranked_restaurants."""
+        return self.run_query(queries.ranked_restaurants, db_name, limit=limit, score=score, **params)
 
     def get_kapsalons(self,db_name):
-        session = self.get_session(db_name)
-        tables = self.get_tables(db_name)
-        restaurants = tables['restaurants']
-        locations = tables['locations']
-        locations_to_restaurants = tables['locations_to_restaurants']
-        match db_name:
-            case 'ubereats':
-                menu_item = tables['menu_items']
-                query = session.query(
-                    restaurants.c.title.label('restaurant_name'),
-                    (func.avg(menu_item.c.price) / 100).label('avg_price'),  
-                    func.min(locations.c.latitude).label('latitude'),
-                    func.min(locations.c.longitude).label('longitude')
-                    ).select_from(menu_item). \
-                    join(restaurants, restaurants.c.id == menu_item.c.restaurant_id). \
-                    join(locations_to_restaurants, locations_to_restaurants.c.restaurant_id == restaurants.c.id). \
-                    join(locations, locations.c.id == locations_to_restaurants.c.location_id). \
-                    filter(menu_item.c.name.like('%kapsalon%')). \
-                    group_by(restaurants.c.title)
-            case 'takeaway':
-                menu_item = tables['menuItems']
-                query = session.query(
-                    restaurants.name.label('restaurant_name'),
-                    func.avg(menu_item.price).label('avg_price'),  
-                    func.min(locations.latitude).label('latitude'),
-                    func.min(locations.longitude).label('longitude')
-                    ).select_from(menu_item). \
-                    join(restaurants, restaurants.primarySlug == menu_item.primarySlug). \
-                    join(locations_to_restaurants, locations_to_restaurants.c.restaurant_id == restaurants.primarySlug). \
-                    join(locations, locations.ID == locations_to_restaurants.c.location_id). \
-                    filter(menu_item.name.like('%kapsalon%')). \
-                    group_by(restaurants.name)
-            case 'deliveroo':
-                menu_item = tables['menu_items']
-                query = session.query(restaurants.name.label('restaurant_name'),
-                    func.avg(menu_item.price).label('avg_price'),  
-                    func.min(locations.latitude).label('latitude'),
-                    func.min(locations.longitude).label('longitude')
-                    ).select_from(menu_item). \
-                    join(restaurants, restaurants.id == menu_item.restaurant_id). \
-                    join(locations_to_restaurants, locations_to_restaurants.c.restaurant_id == restaurants.id). \
-                    join(locations, locations.id == locations_to_restaurants.c.location_id). \
-                    filter(menu_item.name.like('%kapsalon%')). \
-                    group_by(restaurants.name)
-        res = query.all()
-        df = pd.DataFrame(res,columns=['name','avg_pr','lat','lon'])
-        session.close()
-        return df
-    
-    def get_full_kapsalons_df(self):
-            kapsalons_list = []
-            for db_name in self.db_data.keys():
-             kapsalons_list.append( self.get_kapsalons(db_name=db_name))
-            kapsalons_df = pd.concat(kapsalons_list, ignore_index=True)
-            return kapsalons_df
-            
-    def save_to_csv_kapsalon_dfs(self):
-            for db_name in self.db_data.keys():
-              df = self.get_kapsalons(db_name=db_name)
-              df.to_csv(f'vizualizations_data/kapsalons_data/kapsalons_{db_name}.csv')
-            
+        return self.run_query(queries.dish_prices, db_name, dish='kapsalon')
     
-    def save_kapsalons_to_csv(self, file_name='vizualizations_data/kapsalons_data/kapsalons.csv'):
-        df = self.get_full_kapsalons_df()
-        df.to_csv(file_name, index=False)
-        print(f"Kapsalons saved to {file_name}")
-    def get_top_restaurants_by_price_to_rating(self, db_name, limit=10):
-        session = self.get_session(db_name)
-        tables = self.get_tables(db_name)
-        restaurants = tables['restaurants']
-        match db_name:
-            case 'ubereats':
-                menu_items = tables['menu_items']
-                adjust_rating = (
-                    (cast(restaurants.c.rating__rating_value, Float) * 0.3) +
-                    (cast(restaurants.c.rating__review_count, Float) * 0.7)
-                    ).label('weighted_score')
-            
-                query = session.query(
-                    cast(restaurants.c.id,String).label('id'),
-                    restaurants.c.title.label('name'),
-                    (func.avg(cast(menu_items.c.price, Float))/100).label('average_price'),
-                    func.avg(adjust_rating).label('average_rating'),
-                    ((func.avg(cast(menu_items.c.price, Float)) / func.avg(adjust_rating))/100).label('price_to_rating_ratio')
-                    ).join(menu_items, restaurants.c.id == menu_items.c.restaurant_id).filter(
-                        func.coalesce(cast(menu_items.c.price, Float), 0) > 0,
-                        func.coalesce(cast(restaurants.c.rating__rating_value, Float), 0) > 0
-                        )\
-                            .group_by(restaurants.c.id, restaurants.c.title)\
-                                .order_by((func.avg(cast(menu_items.c.price, Float)) / func.avg(adjust_rating)).asc())\
-                                    .limit(limit)
-            
-            case 'takeaway':
-               menu_items = tables['menuItems']
-               adjust_rating = (
-                   (cast(restaurants.ratings, Float) * 0.3) +
-                   (cast(restaurants.ratingsNumber, Float) * 0.7)
-                   ).label('weighted_score')
-               query = session.query(restaurants.primarySlug.label('id'),
-                   restaurants.name.label('name'),
-                   func.avg(cast(menu_items.price, Float)).label('average_price'),
-                   func.avg(adjust_rating).label('average_rating'),
-                   (func.avg(cast(menu_items.price, Float)) / func.avg(adjust_rating)).label('price_to_rating_ratio')
-                   ).join(menu_items, restaurants.primarySlug == menu_items.primarySlug)\
-                    .filter(
-                        func.coalesce(cast(menu_items.price, Float), 0) > 0,
-                        func.coalesce(cast(restaurants.ratings, Float), 0) > 0
-                        )\
-                            .group_by(restaurants.primarySlug, restaurants.name)\
-                                .order_by((func.avg(cast(menu_items.price, Float)) / func.avg(adjust_rating)).asc())\
-                                    .limit(limit)
-            
-
-            case 'deliveroo':
-                menu_items = tables['menu_items']
-                adjust_rating = (
-                    (cast(restaurants.rating, Float) * 0.3) +
-                    (cast(func.replace(restaurants.rating_number, '+', ''), Float) * 0.7)).label('weighted_score')
-                query = session.query(
-                    restaurants.id.label('id'),
-                    restaurants.name.label('name'),
-                    func.avg(cast(menu_items.price, Float)).label('average_price'),
-                    func.avg(adjust_rating).label('average_rating'),
-                    (func.avg(cast(menu_items.price, Float)) / func.avg(adjust_rating)).label('price_to_rating_ratio')
-                    ).join(menu_items, restaurants.id == menu_items.restaurant_id)\
-                        .filter(
-                            func.coalesce(cast(menu_items.price, Float), 0) > 0,
-                            func.coalesce(cast(restaurants.rating, Float), 0) > 0
-                            )\
-                                .group_by(restaurants.id, restaurants.name)\
-                                    .order_by((func.avg(cast(menu_items.price, Float)) / func.avg(adjust_rating)).asc())\
-                                        .limit(limit)
-            case _:
-                raise ValueError(f"Database '{db_name}' not supported.")
-            
-        res = query.all()
-        df = pd.DataFrame(res, columns=['id', 'name', 'average_price', 'average_rating', 'price_to_rating_ratio'])
-        session.close()
-        print(df.head)
+    def get_top_restaurants_by_price_to_rating(self, db_name, limit=10, score='weighted'):
+        df = self.run_query(queries.price_to_rating, db_name, limit=limit, score=score)
+        print(df.head())
         return df
     
     def get_veg_restaurants(self,db_name):
-        session = self.get_session(db_name)
-        tables = self.get_tables(db_name)
-        Restaurant = tables['restaurants']
-        match db_name:
-            case 'takeaway':
-                MenuItem=tables['menuItems']
-                query = session.query(
-                distinct(Restaurant.name).label('Restaurant_Name'),
-                Restaurant.latitude.label('lat'),
-                Restaurant.longitude.label('lon'),
-                ).join(MenuItem, Restaurant.primarySlug == MenuItem.primarySlug
-                ).filter(MenuItem.name.like('%veg%'))
-
-                takeaway_veg=pd.read_sql(query.statement,query.session.bind)
-                takeaway_veg['lon']= takeaway_veg['lon'].astype('float64')
-                takeaway_veg['lat']= takeaway_veg['lat'].astype('float64')
-                takeaway_veg['source']='takeaway'
-
-                return takeaway_veg
-
-            case 'ubereats':
-                MenuItem=tables['menu_items']
-                query = session.query(
-                distinct(Restaurant.c.title).label('Restaurant_Name'),
-                Restaurant.c.location__latitude.label('lat'),
-                Restaurant.c.location__longitude.label('lon')
-                ).join(MenuItem, Restaurant.c.id == MenuItem.c.restaurant_id
-                ).filter(MenuItem.c.name.like('%veg%'))
-
-                ubereats_veg=pd.read_sql(query.statement,query.session.bind)
-                ubereats_veg['lat'] = ubereats_veg['lat'].astype('float64')
-                ubereats_veg['lon'] = ubereats_veg['lon'].astype('float64')
-                ubereats_veg['source']='ubereats'
-
-                return ubereats_veg
-
-            case 'deliveroo':
-                MenuItem=tables['menu_items']
-                query = session.query(
-                distinct(Restaurant.name).label('Restaurant_Name'),
-                Restaurant.latitude.label('lat'),
-                Restaurant.longitude.label('lon'),
-                ).join(MenuItem, Restaurant.id == MenuItem.restaurant_id
-                ).filter(MenuItem.name.like('%veg%'))
-
-                deliveroo_veg=pd.read_sql(query.statement,query.session.bind)
-                deliveroo_veg['lat']= deliveroo_veg['lat'].astype('float64')
-                deliveroo_veg['lon']= deliveroo_veg['lon'].astype('float64')
-                deliveroo_veg['source']='deliveroo'
-
-                return deliveroo_veg
+        df = self.run_query(queries.restaurants_with_dish, db_name, dish='veg')
+        df['source'] = db_name
+        return normalize_dtypes(df)[0]
             
-    def get_full_veg_restaurants(self):
-        veg_list = []
-        for db_name in self.db_data.keys():
-            veg_list.append( self.get_veg_restaurants(db_name=db_name))
-        veg_full_df = pd.concat(veg_list, ignore_index=True)
-        veg_full_df.to_csv(f'vizualizations_data/veg_restaurants.csv')
-
-
-
-
-
-
-
-
-
-
-
-
-
+    def get_restaurants(self, db_name):
+        """Every restaurant of a platform with its rating, number of reviews and coordinates."""
+        return self.run_query(queries.extract_restaurants, db_name)
+
+    def get_table_state(self, db_name):
+        """
+        Min and max rowid of every table of a platform, to tell which tables a scrape changed.
+
+        Both are read from the end of the rowid b-tree, so this does not scan the tables.
+        Appended rows and rows deleted from either end show, rows updated in place or
+        deleted from the middle do not: export(force=True) picks those up.
+        """
+        tabels = sorted({table['table'] for table in self.get_schema(db_name).config['tables'].values()})
+        state = {}
+        with self.get_engine(db_name).connect() as connection:
+            for tabel in tabels:
+                # separate subqueries, SQLite only optimises a min or max that is alone in its query
+                min_rowid, max_rowid = connection.execute(text(f'SELECT (SELECT min(rowid) FROM "{tabel}"), (SELECT max(rowid) FROM "{tabel}")')).one()
+                state[tabel] = [min_rowid, max_rowid]
+        return state
+
+    def get_menu_items_for_search(self):
+        """Menu items of all platforms with their restaurant, with the platform in a 'source' column."""
+        # the full menus are too big for the result cache, the search index is saved instead
+        items = self.fan_out(partial(self.run_query, queries.menu_items_with_restaurant, use_cache=False), label='menu_items_with_restaurant')
+        return normalize_dtypes(pd.concat([df.assign(source=db_name) for db_name, df in items.items()], ignore_index=True))[0]
+
+    def get_fingerprints(self):
+        """Fingerprint of every platform database, see get_db_fingerprint."""
+        return {db_name: get_db_fingerprint(get_db_file(db_url)) for db_name, db_url in self.db_urls.items()}
+
+    def get_search_index(self):
+        """
+        Dish search index over the menus of all platforms.
+
+        Built on first use and kept in memory. With search_index_path it is also saved,
+        and loaded again as long as none of the databases changed.
+        """
+        if self.search_index is None:
+            fingerprints = self.get_fingerprints()
+            if self.search_index_path is not None and os.path.exists(self.search_index_path):
+                self.search_index = MenuSearchIndex.load(self.search_index_path, fingerprints)
+            if self.search_index is None:
+                self.search_index = MenuSearchIndex(self.get_menu_items_for_search())
+                if self.search_index_path is not None:
+                    self.search_index.save(self.search_index_path, fingerprints)
+        return self.search_index
+
+    def search_dishes(self, term, platforms=None, aggregate='restaurants', fields=None, match='substring'):
+        """
+        Look up a dish in the menu item names and descriptions of all platforms.
+
+        Search is case and accent insensitive ('creme brulee' finds 'Crème brûlée').
+        See MenuSearchIndex.search for the arguments and result shapes, the default
+        gives one row per restaurant with name, avg_pr, lat, lon and source.
+        """
+        return self.get_search_index().search(term, platforms=platforms, aggregate=aggregate, fields=fields, match=match)
+
+    def explain_queries(self, db_name):
+        """
+        Run EXPLAIN QUERY PLAN on every analysis query of a platform.
+
+        Returns:
+            pd.DataFrame: One row per plan step with the query name, the step detail and
+            whether the step is a full scan of a table of the database. Scans of
+            subqueries and co-routines (SCAN anon_1, SCAN (subquery-2)) are not, they
+            read rows the plan already produced.
+        """
+        engine = self.get_engine(db_name)
+        table_names = self.get_tables(db_name).table_names()
+        rows = []
+        with engine.connect() as connection:
+            for logical_query, params in queries.ANALYSIS_QUERIES:
+                compiled = self.build_query(logical_query, db_name, **params).compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True})
+                for step in connection.execute(text(f'EXPLAIN QUERY PLAN {compiled}')):
+                    detail = step.detail
+                    words = detail.split()
+                    full_scan = words[0] == 'SCAN' and len(words) > 1 and words[1] in table_names and ' USING ' not in detail and 'VIRTUAL TABLE' not in detail
+                    rows.append({'query': logical_query.__name__, 'detail': detail, 'full_scan': full_scan})
+        return pd.DataFrame(rows, columns=['query', 'detail', 'full_scan'])
+
+    def get_missing_indexes(self, db_name):
+        """
+        CREATE statements for the indexes of utils.platforms.ANALYSIS_INDEXES the database
+        does not have yet, and for the FTS index and its sync triggers when one is missing.
+        """
+        schema = self.get_schema(db_name)
+        inspector = inspect(self.get_engine(db_name))
+        statements = []
+        for index_name, tabel, cols, statement in schema.index_statements():
+            existing = [index['column_names'] for index in inspector.get_indexes(tabel)]
+            if cols not in existing and statement not in statements:
+                statements.append(statement)
+        if not schema.has_menu_fts():
+            statements.extend(schema.fts_statements())
+        return statements
+
+    def build_indexes(self, db_name, output_path=None):
+        """
+        Create the missing indexes and the FTS5 trigram index on menu item names.
+
+        The database is opened read-write for this. With output_path the indexes are
+        built in a copy of the database instead and the original file is left alone.
+        Triggers keep the FTS index in sync with later writes to the menu items. It is
+        rebuilt on every call anyway, to catch up on writes made while they were missing.
+
+        Args:
+            db_name (str): Name of the platform database.
+            output_path (str): Optional path of the optimised copy.
+
+        Returns:
+            list: The statements that were executed.
+        """
+        statements = self.get_missing_indexes(db_name)
+        rebuild = self.get_schema(db_name).fts_rebuild_statement()
+        if rebuild not in statements:
+            statements.append(rebuild)
+        db_file = get_db_file(self.db_urls[db_name])
+        if output_path is not None:
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            source = sqlite3.connect(f'file:{db_file}?mode=ro', uri=True)
+            target = sqlite3.connect(output_path)
+            source.backup(target)
+            source.close()
+        else:
+            target = sqlite3.connect(db_file)
+        with target:
+            for statement in statements:
+                print(statement)
+                target.execute(statement)
+            target.execute('ANALYZE')
+        target.close()
+        if output_path is None:
+            self.reset_tables(db_name)
+        return statements
+
+    def advise_indexes(self, db_name, apply=False, output_path=None):
+        """
+        Report the full table scans of the analysis queries and the indexes that would avoid them.
+
+        Args:
+            db_name (str): Name of the platform database.
+            apply (bool): Also build the missing indexes, see build_indexes.
+            output_path (str): Build them in a copy of the database at this path.
+
+        Returns:
+            pd.DataFrame: The query plans, as returned by explain_queries.
+        """
+        plan = self.explain_queries(db_name)
+        for query_name, steps in plan[plan['full_scan']].groupby('query', sort=False):
+            print(f"{db_name} {query_name}: {', '.join(steps['detail'])}")
+        missing = self.get_missing_indexes(db_name)
+        print(f"{db_name}: {len(missing)} missing indexes")
+        for statement in missing:
+            print(f"  {statement}")
+        if apply and missing:
+            self.build_indexes(db_name, output_path=output_path)
+        return plan
@@ -0,0 +1,55 @@
+import pandas as pd
+
+
+# Compact dtype of the columns that come back in the results, by column name.
+# Platform names, categories and colors repeat a handful of values, coordinates need
+# no more than float32 (about half a meter in Belgium) and neither do prices in euros.
+RESULT_DTYPES = {
+    'platform': 'category',
+    'Platform': 'category',
+    'source': 'category',
+    'category': 'category',
+    'color': 'category',
+    'lat': 'float32',
+    'lon': 'float32',
+    'review_count': 'Int32',
+    'price': 'float32',
+    'avg_pr': 'float32',
+    'average_price': 'float32',
+}
+
+
+def convert_column(series, dtype):
+    if series.dtype == dtype:
+        return series
+    match dtype:
+        case 'category':
+            return series.astype('category')
+        case 'Int32':
+            if series.dtype == object:
+                # review counts like '500+'
+                series = series.astype('string').str.rstrip('+')
+            return pd.to_numeric(series, errors='coerce').astype('Int32')
+        case _:
+            return pd.to_numeric(series, errors='coerce').astype(dtype)
+
+
+def normalize_dtypes(df, dtypes=RESULT_DTYPES):
+    """
+    Convert the known columns of a result to their compact dtype, in place.
+
+    Args:
+        df (pd.DataFrame): Result, columns that are not in dtypes are left alone.
+        dtypes (dict): Dtype per column name.
+
+    Returns:
+        tuple: The DataFrame and the number of bytes saved.
+    """
+    columns = [column for column in df.columns if column in dtypes]
+    if not columns:
+        return df, 0
+    before = df[columns].memory_usage(index=False, deep=True).sum()
+    for column in columns:
+        df[column] = convert_column(df[column], dtypes[column])
+    after = df[columns].memory_usage(index=False, deep=True).sum()
+    return df, int(before - after)
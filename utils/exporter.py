@@ -0,0 +1,158 @@
+import json
+import os
+
+import pandas as pd
+
+from utils.dbhandler import get_db_file, get_db_fingerprint
+from utils.platforms import PLATFORM_SCHEMAS
+
+
+# CSV exports under vizualizations_data/ and the logical tables they are computed from.
+# 'per_platform' exports write one file per platform, the others one file with
+# all platforms, as a column per platform ('wide') or rows with a 'source' column ('long').
+EXPORTS = {
+    'restaurants_per_location': {
+        'tables': ['locations', 'locations_to_restaurants'],
+        'path': 'vizualizations_data/{db_name}_data.csv',
+        'layout': 'per_platform',
+    },
+    'kapsalons': {
+        'tables': ['restaurants', 'menu_items', 'locations', 'locations_to_restaurants'],
+        'path': 'vizualizations_data/kapsalons_data/kapsalons_{db_name}.csv',
+        'layout': 'per_platform',
+    },
+    'prices': {
+        'tables': ['menu_items'],
+        'path': 'price_destribution_data/prices.csv',
+        'layout': 'wide',
+    },
+    'veg_restaurants': {
+        'tables': ['restaurants', 'menu_items'],
+        'path': 'vizualizations_data/veg_restaurants.csv',
+        'layout': 'long',
+    },
+}
+
+
+def write_if_changed(content, path):
+    """Write content to path unless the file already holds exactly that. Returns True when written."""
+    if os.path.exists(path):
+        with open(path, encoding='utf-8', newline='') as f:
+            if f.read() == content:
+                return False
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(content)
+    return True
+
+
+class IncrementalExporter:
+    def __init__(self, manager, analyses=None, state_path='vizualizations_data/export_state.json') -> None:
+        """
+        Refresh the CSV exports for the platforms whose databases changed since the last export.
+
+        A database whose file fingerprint did not change is skipped right away. Otherwise
+        the min and max rowid of each of its tables tell which tables a scrape
+        touched, and only the exports that read one of those tables are recomputed.
+        Files whose content would not change are not rewritten.
+
+        Args:
+            manager (DataBaseManager): Manager of the platform databases.
+            analyses (PlatformAnalyses): What computes the exports, the manager or an
+                AnalyticsStore. Default is the manager.
+            state_path (str): JSON file with the database state at the last export.
+        """
+        self.manager = manager
+        self.analyses = analyses or manager
+        self.state_path = state_path
+        self.state = self.load_state()
+        self.compute = {
+            'restaurants_per_location': self.analyses.rest_per_loc_query,
+            'kapsalons': self.analyses.get_kapsalons,
+            'prices': lambda db_name: pd.Series(self.analyses.query_prices_per_db(db_name), dtype='float64'),
+            'veg_restaurants': self.analyses.get_veg_restaurants,
+        }
+
+    def load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        with open(self.state_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+
+    def get_platform_state(self, export_name, db_name):
+        """Current state of a database, reusing the saved table state when the file did not change."""
+        fingerprint = get_db_fingerprint(get_db_file(self.manager.db_urls[db_name]))
+        old_state = self.state.get(export_name, {}).get(db_name)
+        if old_state is not None and old_state['fingerprint'] == fingerprint:
+            return old_state
+        return {'fingerprint': fingerprint, 'tables': self.manager.get_table_state(db_name)}
+
+    def needs_refresh(self, export_name, db_name, new_state):
+        old_state = self.state.get(export_name, {}).get(db_name)
+        if old_state is None:
+            return True
+        if old_state['fingerprint'] == new_state['fingerprint']:
+            return False
+        tables = PLATFORM_SCHEMAS[db_name]['tables']
+        for logical_table in EXPORTS[export_name]['tables']:
+            physical_table = tables[logical_table]['table']
+            if old_state['tables'].get(physical_table) != new_state['tables'].get(physical_table):
+                return True
+        return False
+
+    def export(self, names=None, force=False):
+        """
+        Bring the CSV exports up to date.
+
+        Args:
+            names (list): Exports to refresh, keys of EXPORTS. Default is all of them.
+            force (bool): Recompute everything, also the platforms whose tables look unchanged.
+
+        Returns:
+            dict: Per export, the platforms that were recomputed.
+        """
+        recomputed = {}
+        for export_name in names or EXPORTS.keys():
+            spec = EXPORTS[export_name]
+            db_names = list(self.manager.db_urls.keys())
+            states = {db_name: self.get_platform_state(export_name, db_name) for db_name in db_names}
+            if spec['layout'] == 'per_platform':
+                paths = {db_name: spec['path'].format(db_name=db_name) for db_name in db_names}
+                changed = [db_name for db_name in db_names
+                           if force or not os.path.exists(paths[db_name]) or self.needs_refresh(export_name, db_name, states[db_name])]
+                if changed:
+                    for db_name, df in self.analyses.fan_out(self.compute[export_name], db_names=changed).items():
+                        write_if_changed(df.to_csv(index=False), paths[db_name])
+            else:
+                path = spec['path']
+                changed = [db_name for db_name in db_names
+                           if force or not os.path.exists(path) or self.needs_refresh(export_name, db_name, states[db_name])]
+                if changed:
+                    new_parts = self.analyses.fan_out(self.compute[export_name], db_names=changed)
+                    self.write_combined(spec, path, db_names, new_parts)
+            self.state[export_name] = states
+            recomputed[export_name] = changed
+            print(f"{export_name}: recomputed {changed or 'nothing'}")
+        self.save_state()
+        return recomputed
+
+    def write_combined(self, spec, path, db_names, new_parts):
+        """Merge the recomputed platforms into the existing file of an export with all platforms."""
+        match spec['layout']:
+            case 'wide':
+                old = pd.read_csv(path) if os.path.exists(path) else pd.DataFrame()
+                columns = {db_name: new_parts[db_name] if db_name in new_parts else old[db_name].dropna()
+                           for db_name in db_names}
+                df = pd.DataFrame({db_name: column.reset_index(drop=True) for db_name, column in columns.items()})
+                write_if_changed(df.to_csv(index=False), path)
+            case 'long':
+                old = pd.read_csv(path, index_col=0) if os.path.exists(path) else pd.DataFrame(columns=['source'])
+                parts = [new_parts[db_name] if db_name in new_parts else old[old['source'] == db_name]
+                         for db_name in db_names]
+                df = pd.concat(parts, ignore_index=True)
+                write_if_changed(df.to_csv(), path)
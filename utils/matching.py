@@ -0,0 +1,217 @@
+import difflib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.search import tokenize
+
+
+# Words that say nothing about which restaurant it is, left out of the name comparison
+NAME_STOPWORDS = {'restaurant', 'resto', 'the', 'de', 'het', 'la', 'le', 'les', 'bv', 'bvba', 'nv', 'srl', 'sprl'}
+METERS_PER_DEGREE = 111320
+
+
+def normalize_name(name):
+    """Accent folded, lower case tokens of a restaurant name, without stopwords and sorted."""
+    tokens = [token for token in tokenize(name if isinstance(name, str) else '') if token not in NAME_STOPWORDS]
+    return ' '.join(sorted(tokens))
+
+
+def name_similarity(name_a, name_b):
+    """Similarity between 0 and 1 of two normalised names."""
+    if not name_a or not name_b:
+        return 0.0
+    return difflib.SequenceMatcher(None, name_a, name_b).ratio()
+
+
+def to_meters(lat, lon):
+    """Local equirectangular projection, accurate to a few meters over the distances that are compared."""
+    y = lat * METERS_PER_DEGREE
+    x = lon * METERS_PER_DEGREE * np.cos(np.radians(lat))
+    return x, y
+
+
+class RestaurantMatcher:
+    def __init__(self, analyses, id_table_path='databases/restaurant_ids.parquet', max_distance=100, min_similarity=0.85) -> None:
+        """
+        Find the restaurants that are listed on several platforms and give them one ID.
+
+        Candidates are only compared when they are at most max_distance meters apart: the
+        restaurants are put in a grid with cells of that size, and only restaurants of
+        different platforms in the same or a neighbouring cell are compared. The work grows
+        with the number of restaurants, not with its square. Candidates with similar
+        normalised names are then merged, most similar first, with at most one restaurant
+        per platform in an entity.
+
+        Args:
+            analyses (PlatformAnalyses): Where the restaurants come from, a DataBaseManager
+                or an AnalyticsStore.
+            id_table_path (str): Parquet file with the cross-platform IDs. IDs already in
+                it are kept when the table is rebuilt. The fingerprints of the databases it
+                was built from are saved next to it, in a JSON file of the same name.
+            max_distance (float): Largest distance in meters between two listings of the
+                same restaurant.
+            min_similarity (float): Smallest name similarity of two listings of the same
+                restaurant, between 0 and 1.
+        """
+        self.analyses = analyses
+        self.id_table_path = id_table_path
+        self.max_distance = max_distance
+        self.min_similarity = min_similarity
+        self.id_table = None
+        self.fingerprints = None
+
+    def get_restaurants(self, db_names=None):
+        frames = self.analyses.fan_out(self.analyses.get_restaurants, db_names=db_names)
+        restaurants = pd.concat([df[['restaurant_id', 'name', 'lat', 'lon']].assign(platform=db_name)
+                                 for db_name, df in frames.items()], ignore_index=True)
+        restaurants['restaurant_id'] = restaurants['restaurant_id'].astype(str)
+        return restaurants
+
+    def get_candidates(self, restaurants):
+        """
+        Pairs of restaurants of different platforms close enough to be the same one.
+
+        Returns:
+            pd.DataFrame: Positions a and b in restaurants and their distance in meters.
+        """
+        located = restaurants.dropna(subset=['lat', 'lon'])
+        x, y = to_meters(located['lat'].to_numpy(dtype=float), located['lon'].to_numpy(dtype=float))
+        cells = pd.DataFrame({
+            'position': located.index.to_numpy(),
+            'cell_x': np.floor(x / self.max_distance).astype(np.int64),
+            'cell_y': np.floor(y / self.max_distance).astype(np.int64),
+        })
+        pairs = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                shifted = cells.assign(cell_x=cells['cell_x'] + dx, cell_y=cells['cell_y'] + dy)
+                pairs.append(shifted.merge(cells, on=['cell_x', 'cell_y'], suffixes=('_a', '_b'))[['position_a', 'position_b']])
+        pairs = pd.concat(pairs, ignore_index=True).rename(columns={'position_a': 'a', 'position_b': 'b'})
+        platforms = restaurants['platform'].to_numpy()
+        pairs = pairs[(pairs['a'] < pairs['b']) & (platforms[pairs['a']] != platforms[pairs['b']])]
+        xs = pd.Series(x, index=located.index)
+        ys = pd.Series(y, index=located.index)
+        distance = np.hypot(xs[pairs['a']].to_numpy() - xs[pairs['b']].to_numpy(),
+                            ys[pairs['a']].to_numpy() - ys[pairs['b']].to_numpy())
+        return pairs.assign(distance=distance)[distance <= self.max_distance].reset_index(drop=True)
+
+    def cluster(self, restaurants, pairs):
+        """Entity of every restaurant, as the position of one of its members."""
+        parent = np.arange(len(restaurants))
+        platforms = {position: {platform} for position, platform in enumerate(restaurants['platform'])}
+
+        def find(position):
+            while parent[position] != position:
+                parent[position] = parent[parent[position]]
+                position = parent[position]
+            return position
+
+        for a, b in pairs.sort_values(['similarity', 'distance'], ascending=[False, True])[['a', 'b']].itertuples(index=False):
+            root_a, root_b = find(a), find(b)
+            if root_a == root_b or platforms[root_a] & platforms[root_b]:
+                continue
+            parent[root_b] = root_a
+            platforms[root_a] |= platforms.pop(root_b)
+        return np.array([find(position) for position in range(len(restaurants))])
+
+    def assign_ids(self, restaurants, roots, old_table):
+        """Entity IDs per root, keeping the IDs of the previous table where possible."""
+        old_ids = {}
+        if old_table is not None:
+            old_ids = dict(zip(zip(old_table['platform'], old_table['restaurant_id']), old_table['entity_id']))
+        member_ids = pd.Series([old_ids.get(key) for key in zip(restaurants['platform'], restaurants['restaurant_id'])],
+                               dtype='float64')
+        next_id = int(old_table['entity_id'].max()) + 1 if old_table is not None and len(old_table) else 0
+        entity_ids = {}
+        used = set()
+        for root, old_id in member_ids.groupby(roots).min().items():
+            if pd.isna(old_id) or old_id in used:
+                old_id = next_id
+                next_id += 1
+            entity_ids[root] = int(old_id)
+            used.add(old_id)
+        return np.array([entity_ids[root] for root in roots], dtype=np.int64)
+
+    def match(self, db_names=None):
+        """
+        Build the cross-platform ID table and save it to id_table_path.
+
+        Run it again after a scrape: restaurants already in the table keep their ID.
+
+        Returns:
+            pd.DataFrame: platform, restaurant_id, name, lat, lon and entity_id per restaurant.
+        """
+        fingerprints = self.analyses.get_fingerprints()
+        restaurants = self.get_restaurants(db_names)
+        pairs = self.get_candidates(restaurants)
+        names = restaurants['name'].map(normalize_name).to_numpy()
+        pairs['similarity'] = [name_similarity(names[a], names[b]) for a, b in zip(pairs['a'], pairs['b'])]
+        pairs = pairs[pairs['similarity'] >= self.min_similarity]
+        roots = self.cluster(restaurants, pairs)
+        old_table = pd.read_parquet(self.id_table_path) if os.path.exists(self.id_table_path) else None
+        restaurants['entity_id'] = self.assign_ids(restaurants, roots, old_table)
+        os.makedirs(os.path.dirname(self.id_table_path) or '.', exist_ok=True)
+        restaurants.to_parquet(self.id_table_path, index=False)
+        with open(self.get_manifest_path(), 'w') as f:
+            json.dump({'fingerprints': fingerprints}, f, indent=2)
+        self.id_table = restaurants
+        self.fingerprints = fingerprints
+        print(f"{len(restaurants)} restaurants are {restaurants['entity_id'].nunique()} distinct restaurants")
+        return restaurants
+
+    def get_manifest_path(self):
+        return os.path.splitext(self.id_table_path)[0] + '.json'
+
+    def load_saved_fingerprints(self):
+        """Fingerprints of the databases the saved ID table was built from, None without one."""
+        if not os.path.exists(self.id_table_path) or not os.path.exists(self.get_manifest_path()):
+            return None
+        with open(self.get_manifest_path()) as f:
+            return json.load(f)['fingerprints']
+
+    def get_id_table(self):
+        """
+        The ID table, read from id_table_path, or built again when there is none yet or a
+        database changed since it was built, so a scrape does not leave its new
+        restaurants without an ID.
+        """
+        fingerprints = self.analyses.get_fingerprints()
+        if self.id_table is None or self.fingerprints != fingerprints:
+            if self.load_saved_fingerprints() == fingerprints:
+                self.id_table = pd.read_parquet(self.id_table_path)
+                self.fingerprints = fingerprints
+            else:
+                self.match()
+        return self.id_table
+
+    def deduplicate(self, df, name_column='name', source_column='source'):
+        """
+        Keep one row per restaurant of a DataFrame that concatenates several platforms.
+
+        Rows are matched to the ID table on their platform, restaurant name, lat and lon,
+        which must be the restaurant coordinates and not those of a scraped location. The
+        name alone would give every branch of a chain the same ID. Rows that are not in the
+        ID table are all kept.
+
+        Returns:
+            pd.DataFrame: The first row of each restaurant, with its entity_id and the
+            number of platforms it was found on in platform_count.
+        """
+        keys = [source_column, name_column, 'lat', 'lon']
+        missing = [key for key in keys if key not in df.columns]
+        if missing:
+            raise ValueError(f"Cannot match restaurants without the columns: {', '.join(missing)}")
+        ids = self.get_id_table().rename(columns={'platform': source_column, 'name': name_column})
+        ids = ids.drop_duplicates(subset=keys)[keys + ['entity_id']]
+        # same dtypes on both sides, coordinates may have been made float32 by normalize_dtypes
+        ids = ids.astype({'lat': df['lat'].dtype, 'lon': df['lon'].dtype})
+        df = df.merge(ids, on=keys, how='left')
+        unmatched = df['entity_id'].isna()
+        # rows without an ID get one of their own, below the IDs of the table
+        df.loc[unmatched, 'entity_id'] = -1 - np.arange(unmatched.sum())
+        df['entity_id'] = df['entity_id'].astype('int64')
+        df['platform_count'] = df.groupby('entity_id')[source_column].transform('nunique')
+        return df.drop_duplicates(subset='entity_id').reset_index(drop=True)
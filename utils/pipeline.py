@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from utils.dbhandler import get_db_fingerprint
+from utils.profiling import span, current_path
+
+
+def file_fingerprint(*paths):
+    """Fingerprint of the current version of some input files, missing files included."""
+    return json.dumps({path: get_db_fingerprint(path) if os.path.exists(path) else None for path in paths})
+
+
+class Pipeline:
+    def __init__(self, state_path=None, max_workers=None) -> None:
+        """
+        Run steps that depend on each other, each one once, independent steps at the same time.
+
+        A step is a function called with the results of its inputs. Steps run on a thread
+        pool as soon as their inputs are done, except the main thread steps (the ones that
+        draw, show or report figures), which run one after the other in the calling thread,
+        in the order they were added.
+
+        A step with outputs (the files it writes) is skipped when all of them exist and
+        neither its own fingerprint nor that of any of its inputs changed since it last
+        ran. Its inputs are then not computed either, unless another step needs them.
+
+        Args:
+            state_path (str): JSON file with the fingerprints of the last run of the steps
+                with outputs. Without it nothing is skipped.
+            max_workers (int): Number of steps running at the same time.
+        """
+        self.state_path = state_path
+        self.max_workers = max_workers
+        self.steps = {}
+        self.state = self.load_state()
+
+    def load_state(self):
+        if self.state_path is None or not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def save_state(self):
+        if self.state_path is None:
+            return
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        with open(self.state_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+
+    def add(self, name, func, inputs=(), outputs=(), fingerprint=None, main_thread=False):
+        """
+        Add a step. Its inputs must have been added before, so there are no cycles.
+
+        Args:
+            name (str): Name of the step.
+            func (callable): Called with the results of the inputs, in the order of inputs.
+                The result of a skipped step is its list of outputs.
+            inputs (list): Names of the steps this one needs.
+            outputs (list): Files the step writes, makes it skippable.
+            fingerprint (callable): Returns a string identifying the version of what the
+                step reads outside the pipeline, like the database files. Called once per run.
+            main_thread (bool): Run in the calling thread, in the order of adding.
+        """
+        for input_name in inputs:
+            if input_name not in self.steps:
+                raise ValueError(f"Unknown input of {name}: {input_name}")
+        self.steps[name] = {'func': func, 'inputs': list(inputs), 'outputs': list(outputs),
+                            'fingerprint': fingerprint, 'main_thread': main_thread}
+
+    def get_keys(self):
+        """Fingerprint of every step together with those of all the steps it depends on."""
+        keys = {}
+        fingerprints = {}
+        for name, step in self.steps.items():
+            fingerprint = step['fingerprint']
+            if fingerprint is not None and fingerprint not in fingerprints:
+                # steps often share a fingerprint function, like that of the databases
+                fingerprints[fingerprint] = fingerprint()
+            parts = [name, fingerprints.get(fingerprint, '')] + [keys[input_name] for input_name in step['inputs']]
+            keys[name] = hashlib.sha256('\0'.join(parts).encode()).hexdigest()
+        return keys
+
+    def is_current(self, name, key):
+        step = self.steps[name]
+        return bool(step['outputs']) and self.state.get(name) == key and all(os.path.exists(path) for path in step['outputs'])
+
+    def plan(self, targets, keys, force=False):
+        """Steps to run for targets, in the order they were added."""
+        to_run = {}
+
+        def visit(name):
+            if name in to_run:
+                return
+            to_run[name] = force or not self.is_current(name, keys[name])
+            if to_run[name]:
+                for input_name in self.steps[name]['inputs']:
+                    visit(input_name)
+
+        for target in targets:
+            visit(target)
+        for name, run in to_run.items():
+            if not run:
+                print(f"{name}: up to date")
+        return [name for name in self.steps if to_run.get(name)]
+
+    def run_step(self, name, args, parent=None):
+        with span(name, parent=parent):
+            start = time.perf_counter()
+            result = self.steps[name]['func'](*args)
+        print(f"{name}: {time.perf_counter() - start:.3f}s")
+        return result
+
+    def run(self, targets=None, force=False):
+        """
+        Run the steps needed for targets.
+
+        Args:
+            targets (list): Steps to bring up to date. Default is all steps.
+            force (bool): Run every step needed for targets, also the up to date ones.
+
+        Returns:
+            dict: Result per step that ran or was skipped.
+        """
+        keys = self.get_keys()
+        pending = self.plan(targets or list(self.steps), keys, force)
+        results = {name: step['outputs'] for name, step in self.steps.items() if name not in pending and step['outputs']}
+        running = {}
+        start = time.perf_counter()
+
+        def finish(name, result):
+            results[name] = result
+            if self.steps[name]['outputs']:
+                self.state[name] = keys[name]
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while pending or running:
+                    ready = [name for name in pending if all(input_name in results for input_name in self.steps[name]['inputs'])]
+                    for name in ready:
+                        if not self.steps[name]['main_thread']:
+                            args = [results[input_name] for input_name in self.steps[name]['inputs']]
+                            running[executor.submit(self.run_step, name, args, current_path())] = name
+                            pending.remove(name)
+                    main_steps = [name for name in pending if self.steps[name]['main_thread']]
+                    if main_steps and main_steps[0] in ready:
+                        name = main_steps[0]
+                        pending.remove(name)
+                        finish(name, self.run_step(name, [results[input_name] for input_name in self.steps[name]['inputs']]))
+                        continue
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(running.pop(future), future.result())
+        finally:
+            self.save_state()
+        print(f"Pipeline: {time.perf_counter() - start:.3f}s")
+        return results
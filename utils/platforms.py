@@ -0,0 +1,231 @@
+from sqlalchemy import func, cast, select, table, column, literal, literal_column, Integer, Float, String
+
+
+# Logical table -> physical table and logical column -> physical column, per platform.
+# Adding a platform means adding an entry here, the queries in utils/queries.py only
+# ever use the logical names.
+PLATFORM_SCHEMAS = {
+    'ubereats': {
+        'tables': {
+            'restaurants': {'table': 'restaurants', 'columns': {
+                'id': 'id', 'name': 'title', 'rating': 'rating__rating_value',
+                'review_count': 'rating__review_count',
+                'lat': 'location__latitude', 'lon': 'location__longitude'}},
+            'locations': {'table': 'locations', 'columns': {
+                'id': 'id', 'name': 'name', 'lat': 'latitude', 'lon': 'longitude'}},
+            'locations_to_restaurants': {'table': 'locations_to_restaurants', 'columns': {
+                'restaurant_id': 'restaurant_id', 'location_id': 'location_id'}},
+            'categories': {'table': 'restaurant_to_categories', 'columns': {
+                'restaurant_id': 'restaurant_id', 'category': 'category'}},
+            'menu_items': {'table': 'menu_items', 'columns': {
+                'restaurant_id': 'restaurant_id', 'name': 'name', 'description': 'description',
+                'price': 'price'}},
+        },
+        'price_divisor': 100,  # prices are stored in cents
+        'review_count_suffix': '+',
+        'category_match': 'exact',
+    },
+    'takeaway': {
+        'tables': {
+            'restaurants': {'table': 'restaurants', 'columns': {
+                'id': 'primarySlug', 'name': 'name', 'rating': 'ratings',
+                'review_count': 'ratingsNumber', 'lat': 'latitude', 'lon': 'longitude'}},
+            'locations': {'table': 'locations', 'columns': {
+                'id': 'ID', 'name': 'name', 'lat': 'latitude', 'lon': 'longitude'}},
+            'locations_to_restaurants': {'table': 'locations_to_restaurants', 'columns': {
+                'restaurant_id': 'restaurant_id', 'location_id': 'location_id'}},
+            'categories': {'table': 'categories_restaurants', 'columns': {
+                'restaurant_id': 'restaurant_id', 'category': 'category_id'}},
+            'menu_items': {'table': 'menuItems', 'columns': {
+                'restaurant_id': 'primarySlug', 'name': 'name', 'description': 'description',
+                'price': 'price'}},
+        },
+        'price_divisor': 1,
+        'review_count_suffix': None,
+        'category_match': 'contains',  # category ids are lower case slugs
+    },
+    'deliveroo': {
+        'tables': {
+            'restaurants': {'table': 'restaurants', 'columns': {
+                'id': 'id', 'name': 'name', 'rating': 'rating',
+                'review_count': 'rating_number', 'lat': 'latitude', 'lon': 'longitude'}},
+            'locations': {'table': 'locations', 'columns': {
+                'id': 'id', 'name': 'name', 'lat': 'latitude', 'lon': 'longitude'}},
+            'locations_to_restaurants': {'table': 'locations_to_restaurants', 'columns': {
+                'restaurant_id': 'restaurant_id', 'location_id': 'location_id'}},
+            # deliveroo keeps a single category on the restaurant itself
+            'categories': {'table': 'restaurants', 'columns': {
+                'restaurant_id': 'id', 'category': 'category'}},
+            'menu_items': {'table': 'menu_items', 'columns': {
+                'restaurant_id': 'restaurant_id', 'name': 'name', 'description': 'description',
+                'price': 'price'}},
+        },
+        'price_divisor': 1,
+        'review_count_suffix': '+',
+        'category_match': 'exact',
+    },
+}
+
+
+# Indexes on the join and filter columns of the analysis queries, in logical names.
+# The substring searches on menu item names use an FTS5 trigram index instead,
+# see PlatformSchema.fts_statements.
+ANALYSIS_INDEXES = [
+    ('locations_to_restaurants', ('restaurant_id', 'location_id')),
+    ('locations_to_restaurants', ('location_id', 'restaurant_id')),
+    ('menu_items', ('restaurant_id', 'price')),
+    ('menu_items', ('price',)),
+    ('categories', ('restaurant_id', 'category')),
+    ('categories', ('category', 'restaurant_id')),
+]
+
+
+class PlatformSchema:
+    def __init__(self, db_name, tables, config=None) -> None:
+        """
+        Translate logical table and column names into the tables of one platform database.
+
+        Args:
+            db_name (str): Name of the platform, used to look up its config in PLATFORM_SCHEMAS.
+            tables (dict): Table lookup of the database, as returned by DataBaseManager.get_tables.
+            config (dict): Optional schema config overriding the entry in PLATFORM_SCHEMAS.
+        """
+        if config is None:
+            if db_name not in PLATFORM_SCHEMAS:
+                raise ValueError(f"Unsupported database: {db_name}")
+            config = PLATFORM_SCHEMAS[db_name]
+        self.db_name = db_name
+        self.config = config
+        self.tables = tables
+
+    def table(self, logical_table):
+        return self.tables[self.config['tables'][logical_table]['table']]
+
+    def col(self, logical_table, logical_col):
+        physical_col = self.config['tables'][logical_table]['columns'][logical_col]
+        return self.table(logical_table).c[physical_col]
+
+    def optional_col(self, logical_table, logical_col):
+        """Like col, but NULL when the platform does not have the column."""
+        physical_col = self.config['tables'][logical_table]['columns'].get(logical_col)
+        table = self.table(logical_table)
+        if physical_col is None or physical_col not in table.c:
+            return literal(None)
+        return table.c[physical_col]
+
+    def shares_table(self, logical_table, other_table):
+        tables = self.config['tables']
+        return tables[logical_table]['table'] == tables[other_table]['table']
+
+    def price(self):
+        """Menu item price in euros."""
+        return cast(self.col('menu_items', 'price'), Float) / self.config['price_divisor']
+
+    def rating(self):
+        return cast(self.col('restaurants', 'rating'), Float)
+
+    def review_count(self):
+        """Number of reviews as an integer, without the '+' some platforms append."""
+        review_count = self.col('restaurants', 'review_count')
+        if self.config['review_count_suffix']:
+            review_count = func.replace(review_count, self.config['review_count_suffix'], '')
+        return cast(review_count, Integer)
+
+    def restaurant_id(self):
+        return cast(self.col('restaurants', 'id'), String)
+
+    def category_filter(self, category):
+        column = self.col('categories', 'category')
+        match self.config['category_match']:
+            case 'exact':
+                return column == category
+            case 'contains':
+                return column.like(f'%{category}%')
+            case match_type:
+                raise ValueError(f"Unsupported category match: {match_type}")
+
+    def menu_fts_name(self):
+        return f"{self.config['tables']['menu_items']['table']}_fts"
+
+    def menu_fts_triggers(self):
+        """Names of the triggers that keep the FTS index in sync with the menu items table."""
+        fts_name = self.menu_fts_name()
+        return [f'{fts_name}_insert', f'{fts_name}_delete', f'{fts_name}_update']
+
+    def has_menu_fts(self):
+        """True when the database has the FTS index and the triggers keeping it current."""
+        return self.menu_fts_name() in self.tables.table_names() and \
+            set(self.menu_fts_triggers()) <= self.tables.trigger_names()
+
+    def menu_name_like(self, term):
+        """
+        Filter on menu items whose name contains term.
+
+        Uses the FTS5 trigram index built by DataBaseManager.build_indexes when the
+        database has one that is kept in sync with the menu items, a LIKE scan over all
+        menu items otherwise. An index without the sync triggers (built by an older
+        version) can miss the rows written after it, so it is not used.
+        """
+        name = self.col('menu_items', 'name')
+        fts_name = self.menu_fts_name()
+        if not self.has_menu_fts():
+            return name.like(f'%{term}%')
+        fts = table(fts_name, column(name.name))
+        menu_table = self.config['tables']['menu_items']['table']
+        matches = select(literal_column('rowid')).select_from(fts).where(fts.c[name.name].like(f'%{term}%'))
+        return literal_column(f'"{menu_table}".rowid').in_(matches)
+
+    def index_statements(self):
+        """(index name, table, columns, CREATE INDEX statement) for each of ANALYSIS_INDEXES on this platform."""
+        statements = []
+        for logical_table, logical_cols in ANALYSIS_INDEXES:
+            physical_table = self.config['tables'][logical_table]['table']
+            physical_cols = [self.config['tables'][logical_table]['columns'][col] for col in logical_cols]
+            index_name = f"ix_{physical_table}_{'_'.join(physical_cols)}"
+            cols = ', '.join(f'"{col}"' for col in physical_cols)
+            statements.append((index_name, physical_table, physical_cols,
+                               f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{physical_table}" ({cols})'))
+        return statements
+
+    def fts_statements(self):
+        """
+        Statements creating the FTS5 trigram index over the menu item names, the triggers
+        that update it on every write to the menu items, and filling it.
+        """
+        menu_table = self.config['tables']['menu_items']['table']
+        name = self.config['tables']['menu_items']['columns']['name']
+        fts_name = self.menu_fts_name()
+        insert_trigger, delete_trigger, update_trigger = self.menu_fts_triggers()
+        add_new = f'INSERT INTO "{fts_name}"(rowid, "{name}") VALUES (new.rowid, new."{name}");'
+        remove_old = f'INSERT INTO "{fts_name}"("{fts_name}", rowid, "{name}") VALUES (\'delete\', old.rowid, old."{name}");'
+        return [
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS "{fts_name}" USING fts5("{name}", content=\'{menu_table}\', tokenize=\'trigram\')',
+            f'CREATE TRIGGER IF NOT EXISTS "{insert_trigger}" AFTER INSERT ON "{menu_table}" BEGIN {add_new} END',
+            f'CREATE TRIGGER IF NOT EXISTS "{delete_trigger}" AFTER DELETE ON "{menu_table}" BEGIN {remove_old} END',
+            f'CREATE TRIGGER IF NOT EXISTS "{update_trigger}" AFTER UPDATE ON "{menu_table}" BEGIN {remove_old} {add_new} END',
+            self.fts_rebuild_statement(),
+        ]
+
+    def fts_rebuild_statement(self):
+        """Statement filling the FTS index again from all menu items."""
+        fts_name = self.menu_fts_name()
+        return f'INSERT INTO "{fts_name}"("{fts_name}") VALUES (\'rebuild\')'
+
+    def join_categories(self, query):
+        """Join the categories table onto a query selecting from restaurants."""
+        if self.shares_table('categories', 'restaurants'):
+            return query
+        return query.join(self.table('categories'),
+                          self.col('categories', 'restaurant_id') == self.col('restaurants', 'id'))
+
+    def join_menu_items(self, query):
+        """Join the menu items onto a query selecting from restaurants."""
+        return query.join(self.table('menu_items'),
+                          self.col('menu_items', 'restaurant_id') == self.col('restaurants', 'id'))
+
+    def join_locations(self, query):
+        """Join the scraped locations onto a query selecting from restaurants."""
+        return query.join(self.table('locations_to_restaurants'),
+                          self.col('locations_to_restaurants', 'restaurant_id') == self.col('restaurants', 'id')). \
+            join(self.table('locations'),
+                 self.col('locations', 'id') == self.col('locations_to_restaurants', 'location_id'))
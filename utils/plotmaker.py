@@ -1,24 +1,42 @@
 import pandas as pd
 import geopandas as gpd
+import matplotlib
 import matplotlib.pyplot as plt
 import contextily as ctx
 import numpy as np
 import plotly.express as px
 import os
+import time
 import plotly.graph_objects as go
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+from utils import borders as border_cache
+from utils.dtypes import normalize_dtypes
+from utils.profiling import span, timed, current_path, collect_spans, get_profiler
+
+
+# Size of the figure of each map type and whether its static layers include the region borders
+MAP_FIGURES = {
+    'combined': {'figsize': (12, 8), 'with_borders': True},
+    'individual': {'figsize': (12, 8), 'with_borders': True},
+    'kapsalon': {'figsize': (14, 10), 'with_borders': False},
+}
 
 
 class MapMaker:
-    def __init__(self, file_paths):
+    def __init__(self, file_paths, tile_cache=None, report=None):
         """
         Initialize the PlotMaker class with file paths for the data and borders.
 
         Args:
             file_paths (dict): Dictionary containing platform names as keys and CSV file paths as values.
-            borders_path (str): Path to the GeoJSON or shapefile containing region boundaries.
+            tile_cache (TileCache): Optional local tile store for the basemaps. Without it the
+                tiles are fetched from OpenStreetMap by contextily on every map.
+            report (Report): Optional report the plotly figures are added to instead of being shown.
         """
         self.file_paths = file_paths
+        self.tile_cache = tile_cache
+        self.report = report
         self.borders_path = None
         self.platform_colors = {
             'ubereats': 'blue',
@@ -27,13 +45,28 @@ class MapMaker:
         }
         self.df_all = self.load_data()
         self.gdf_all = self.create_geodataframe()
-        self.borders = None
+        self.border_levels = {}
+        self.extents = {}
+        self.backgrounds = {}
+        self.ranges = {}
 
     def set_borders(self,border_path):
+        """Use the region borders of border_path, they are loaded when a map first needs them."""
         self.borders_path = border_path
-        self.borders = self.load_borders()
-        
+        self.border_levels = {}
+        self.extents = {}
+
+    def get_static_layers(self):
+        """Extents and rendered backgrounds of the maps made so far, for add_static_layers of another MapMaker."""
+        return {'extents': dict(self.extents), 'backgrounds': dict(self.backgrounds)}
+
+    def add_static_layers(self, static_layers):
+        """Reuse the extents and backgrounds of a MapMaker on the same data and borders, like in a map worker."""
+        self.extents.update(static_layers['extents'])
+        self.backgrounds.update(static_layers['backgrounds'])
 
+
+    @timed('load map data')
     def load_data(self):
         """
         Load data from CSV files and combine it into one DataFrame.
@@ -48,9 +81,11 @@ class MapMaker:
             df['color'] = self.platform_colors[platform]
             dfs.append(df)
 
-        df_all = pd.concat(dfs, ignore_index=True)
+        df_all, saved = normalize_dtypes(pd.concat(dfs, ignore_index=True))
+        print(f"Map data: {saved / 1e6:.2f} MB saved by compact dtypes")
         return df_all
 
+    @timed('reproject points')
     def create_geodataframe(self):
         """
         Convert the DataFrame to a GeoDataFrame and set CRS to WGS84.
@@ -65,17 +100,131 @@ class MapMaker:
         )
         return gdf.to_crs(epsg=3857)
 
-    def load_borders(self):
+    def add_basemap(self, ax):
+        """Add the OpenStreetMap basemap, from the tile cache when there is one."""
+        if self.tile_cache is not None:
+            self.tile_cache.add_basemap(ax)
+        else:
+            ctx.add_basemap(ax, source=ctx.providers.OpenStreetMap.Mapnik)
+
+    def get_range(self, column):
+        """Min and max of a column over all platforms, computed once for the color and size scales."""
+        if column not in self.ranges:
+            self.ranges[column] = (self.gdf_all[column].min(), self.gdf_all[column].max())
+        return self.ranges[column]
+
+    def get_extent(self, with_borders=False, margin=0.05):
         """
-        Load the region boundaries from a shapefile or GeoJSON file.
+        Extent shared by the maps of all platforms, so their static layers are the same.
+
+        Args:
+            with_borders (bool): Also cover the region borders.
+            margin (float): Margin added on each side, as a fraction of the width and height,
+                like the default margins of matplotlib.
+
+        Returns:
+            tuple: West, south, east, north in EPSG:3857 meters.
+        """
+        key = (with_borders, margin)
+        if key not in self.extents:
+            xmin, ymin, xmax, ymax = self.gdf_all.total_bounds
+            if with_borders:
+                bxmin, bymin, bxmax, bymax = self.load_borders().total_bounds
+                xmin, ymin, xmax, ymax = min(xmin, bxmin), min(ymin, bymin), max(xmax, bxmax), max(ymax, bymax)
+            dx = (xmax - xmin) * margin
+            dy = (ymax - ymin) * margin
+            self.extents[key] = (float(xmin - dx), float(ymin - dy), float(xmax + dx), float(ymax + dy))
+        return self.extents[key]
+
+    @timed('render background')
+    def render_background(self, extent, width, dpi, with_borders):
+        """
+        Rasterise the static layers of a map: the basemap and optionally the region borders.
+
+        Args:
+            extent (tuple): West, south, east, north in EPSG:3857 meters.
+            width (float): Width of the image in inches, the height follows from the extent.
+            dpi (int): Resolution of the image.
+            with_borders (bool): Draw the region borders over the basemap.
+
+        Returns:
+            np.ndarray: RGB image covering exactly the extent.
+        """
+        xmin, ymin, xmax, ymax = extent
+        fig = plt.figure(figsize=(width, width * (ymax - ymin) / (xmax - xmin)), dpi=dpi)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.set_axis_off()
+        if with_borders:
+            self.load_borders(pixel_size=(xmax - xmin) / (width * dpi)).plot(ax=ax, facecolor='none', edgecolor='black', linewidth=0.5, zorder=2)
+        ax.set_xlim(xmin, xmax)
+        ax.set_ylim(ymin, ymax)
+        with span('basemap'):
+            self.add_basemap(ax)
+        ax.set_aspect('auto')
+        ax.set_xlim(xmin, xmax)
+        ax.set_ylim(ymin, ymax)
+        fig.canvas.draw()
+        image = np.asarray(fig.canvas.buffer_rgba())[:, :, :3].copy()
+        plt.close(fig)
+        return image
+
+    def get_background(self, extent, width, dpi=150, with_borders=False):
+        """Static layers of a map, rendered once per extent, size and layers and then reused."""
+        key = (extent, width, dpi, with_borders)
+        if key not in self.backgrounds:
+            self.backgrounds[key] = self.render_background(extent, width, dpi, with_borders)
+        return self.backgrounds[key]
+
+    def get_map_background(self, figsize, with_borders=False, background_dpi=150):
+        """
+        Extent and static layers of a map, see create_map_axes.
+
+        Returns:
+            tuple: The extent and the RGB image of the basemap and borders.
+        """
+        extent = self.get_extent(with_borders=with_borders)
+        return extent, self.get_background(extent, figsize[0], background_dpi, with_borders)
+
+    def create_map_axes(self, figsize, with_borders=False, background_dpi=150):
+        """
+        Figure with the cached static layers already drawn, ready for the scatter layer of a platform.
+
+        Args:
+            figsize (tuple): Size of the figure in inches.
+            with_borders (bool): Include the region borders.
+            background_dpi (int): Resolution of the static layers. The basemap tiles hold no
+                more detail than this, and a larger image makes every savefig slower.
+
+        Returns:
+            tuple: The figure and its axis.
+        """
+        extent, background = self.get_map_background(figsize, with_borders, background_dpi)
+        xmin, ymin, xmax, ymax = extent
+        fig, ax = plt.subplots(figsize=figsize)
+        ax.imshow(background, extent=(xmin, xmax, ymin, ymax), zorder=0)
+        ax.set_xlim(xmin, xmax)
+        ax.set_ylim(ymin, ymax)
+        ax.set_autoscale_on(False)
+        return fig, ax
+
+    def load_borders(self, pixel_size=0):
+        """
+        Load the region boundaries, projected and simplified for the given output resolution.
+
+        The boundaries come from a GeoParquet cache next to the shapefile or GeoJSON file,
+        built by utils.borders the first time and whenever the file changes.
+
+        Args:
+            pixel_size (float): Size of an output pixel in meters. Default is 0, full detail.
 
         Returns:
             gpd.GeoDataFrame: GeoDataFrame with region boundaries.
         """
-        borders = gpd.read_file(self.borders_path)
-        if borders.crs is None:
-            borders.set_crs(epsg=4326, inplace=True)
-        return borders.to_crs(epsg=3857)
+        tolerance = border_cache.pick_tolerance(pixel_size)
+        if tolerance not in self.border_levels:
+            with span('load borders', tolerance=tolerance):
+                self.border_levels[tolerance] = border_cache.load_borders(self.borders_path, pixel_size)
+        return self.border_levels[tolerance]
     
     def create_kapsalon_map_for_platform(self, platform_name, output_directory="output_maps"):
         """
@@ -86,11 +235,11 @@ class MapMaker:
             output_directory (str): Directory to save the map .jpg file. Default is 'output_maps'.
         """
         gdf_platform = self.gdf_all[self.gdf_all['platform'] == platform_name]
-        self.norm = plt.Normalize(self.gdf_all['avg_pr'].min(), self.gdf_all['avg_pr'].max())
+        self.norm = plt.Normalize(*self.get_range('avg_pr'))
         self.cmap = plt.cm.cividis  # Color map for visualization
 
-        # Create a plot for better visibility
-        fig, ax = plt.subplots(figsize=(14, 10))
+        # Create a plot for better visibility, on top of the cached basemap
+        fig, ax = self.create_map_axes(**MAP_FIGURES['kapsalon'])
 
         # Plot the restaurant locations with color mapping based on 'avg_pr'
         scatter = gdf_platform.plot(
@@ -102,9 +251,6 @@ class MapMaker:
             legend=False  # Disable the automatic legend to customize it later
         )
 
-        # Add a basemap using contextily
-        ctx.add_basemap(ax, source=ctx.providers.OpenStreetMap.Mapnik)
-
         # Add a color bar (legend) on the side of the map
         sm = plt.cm.ScalarMappable(cmap=self.cmap, norm=self.norm)
         sm.set_array([])
@@ -122,7 +268,8 @@ class MapMaker:
 
         # Save the plot as a .jpg file
         output_file_path = os.path.join(output_directory, f"{platform_name}_kapsalons_map.jpg")
-        plt.savefig(output_file_path, bbox_inches='tight', dpi=300, format='jpg')
+        with span('savefig', dpi=300):
+            plt.savefig(output_file_path, bbox_inches='tight', dpi=300, format='jpg')
         plt.close()  # Close the plot to free up memory
 
     def create_combined_map(self, border_path,output_file=None):
@@ -132,14 +279,12 @@ class MapMaker:
         Args:
             output_file (str): Path to save the output file. If None, the plot will not be saved.
         """
-        if self.borders is None:
+        if self.borders_path is None:
             self.set_borders(border_path)
         self.df_all = self.df_all[self.df_all['rest_count'] > 0]
 
-        fig, ax = plt.subplots(figsize=(12, 8))
-
-        # Plot the boundaries
-        self.borders.plot(ax=ax, facecolor='none', edgecolor='black', linewidth=0.5)
+        # The boundaries and the basemap are rendered once and shared with the individual maps
+        fig, ax = self.create_map_axes(**MAP_FIGURES['combined'])
 
         # Plot the restaurant locations for each platform
         for platform in self.df_all['platform'].unique():
@@ -147,22 +292,21 @@ class MapMaker:
             ax.scatter(
                 gdf_platform.geometry.x,
                 gdf_platform.geometry.y,
-                s=np.interp(gdf_platform['rest_count'], (self.gdf_all['rest_count'].min(), self.gdf_all['rest_count'].max()), (10, 100)),
+                s=np.interp(gdf_platform['rest_count'], self.get_range('rest_count'), (10, 100)),
                 c=gdf_platform['color'].iloc[0],
                 alpha=0.7,
                 label=platform.capitalize()
             )
 
-        # Add a basemap using contextily
-        ctx.add_basemap(ax, source=ctx.providers.OpenStreetMap.Mapnik)
-
         # Customize the plot
         ax.set_title("Distribution of Restaurants by Platform", fontsize=16)
         ax.set_axis_off()
         plt.legend(loc='upper right')
 
         if output_file:
-            plt.savefig(output_file, bbox_inches='tight', dpi=300, format='jpg')  # Save as .jpg
+            os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+            with span('savefig', dpi=300):
+                plt.savefig(output_file, bbox_inches='tight', dpi=300, format='jpg')  # Save as .jpg
             plt.close()  # Close the plot to avoid it being shown
         else:
             plt.show()
@@ -175,56 +319,298 @@ class MapMaker:
             output_directory (str): Directory to save the individual maps. Default is 'output_maps/'.
         """
         self.df_all = self.df_all[self.df_all['rest_count'] > 0]
-        if  self.borders is None:
-            self.set_borders(border_path)
         for platform in self.df_all['platform'].unique():
-            gdf_platform = self.gdf_all[self.gdf_all['platform'] == platform]
-            fig, ax = plt.subplots(figsize=(12, 8))
+            self.create_individual_map(platform, border_path, output_directory)
 
-            # Plot the boundaries
-            self.borders.plot(ax=ax, facecolor='none', edgecolor='black', linewidth=0.5)
-
-            # Plot the restaurant locations with a color scale
-            scatter = ax.scatter(
-                gdf_platform.geometry.x,
-                gdf_platform.geometry.y,
-                s=np.interp(gdf_platform['rest_count'], (self.gdf_all['rest_count'].min(), self.gdf_all['rest_count'].max()), (10, 100)),
-                c=gdf_platform['rest_count'],
-                cmap='plasma',
-                alpha=0.7,
-                label=platform.capitalize()
-            )
+    def create_individual_map(self, platform, border_path, output_directory="output_maps/"):
+        """
+        Create the map of one platform with color scale and size scale.
 
-            # Add a basemap using contextily
-            ctx.add_basemap(ax, source=ctx.providers.OpenStreetMap.Mapnik)
+        Args:
+            platform (str): The name of the platform to create a map for.
+            output_directory (str): Directory to save the map. Default is 'output_maps/'.
+        """
+        if self.borders_path is None:
+            self.set_borders(border_path)
+        gdf_platform = self.gdf_all[self.gdf_all['platform'] == platform]
+
+        # Boundaries and basemap, rendered for the first platform and reused for the others
+        fig, ax = self.create_map_axes(**MAP_FIGURES['individual'])
+
+        # Plot the restaurant locations with a color scale
+        scatter = ax.scatter(
+            gdf_platform.geometry.x,
+            gdf_platform.geometry.y,
+            s=np.interp(gdf_platform['rest_count'], self.get_range('rest_count'), (10, 100)),
+            c=gdf_platform['rest_count'],
+            cmap='plasma',
+            alpha=0.7,
+            label=platform.capitalize()
+        )
 
-            # Add a color bar
-            cbar = plt.colorbar(scatter, ax=ax, orientation='vertical')
-            cbar.set_label('Number of Restaurants', fontsize=12)
+        # Add a color bar
+        cbar = plt.colorbar(scatter, ax=ax, orientation='vertical')
+        cbar.set_label('Number of Restaurants', fontsize=12)
 
-            # Customize the plot
-            ax.set_title(f"Distribution of Restaurants for {platform.capitalize()}", fontsize=16)
-            ax.set_axis_off()
-            plt.legend(loc='upper right')
-            # Save the map as a .jpg file
-            output_file = f"{output_directory}{platform}_distribution.jpg"
+        # Customize the plot
+        ax.set_title(f"Distribution of Restaurants for {platform.capitalize()}", fontsize=16)
+        ax.set_axis_off()
+        plt.legend(loc='upper right')
+        # Save the map as a .jpg file
+        os.makedirs(output_directory, exist_ok=True)
+        output_file = os.path.join(output_directory, f"{platform}_distribution.jpg")
+        with span('savefig', dpi=300):
             plt.savefig(output_file, bbox_inches='tight', dpi=300, format='jpg')
-            plt.close()  # Close the plot to avoid it being shown
+        plt.close()  # Close the plot to avoid it being shown
     
-    def create_vegi_map(self):
-        self.df_all = pd.read_csv('vizualizations_data/veg_restaurants.csv')
+    def create_vegi_map(self, point_budget=5000):
+        self.df_all = normalize_dtypes(pd.read_csv('vizualizations_data/veg_restaurants.csv'))[0]
         self.gdf_all = self.create_geodataframe()
-        fig = px.scatter_map(self.df_all, lat="lat", lon="lon",size_max=0.2,color="source",zoom=8, color_discrete_map={"ubereats": "navy", "deliveroo": "maroon","takeaway":"lightgreen"})
-        fig.update_traces(marker=dict(opacity=0.5))
-        fig.show()
-
-
+        self.ranges = {}
+        fig = scatter_map_lod(self.df_all, "source", {"ubereats": "navy", "deliveroo": "maroon","takeaway":"lightgreen"}, point_budget=point_budget)
+        show_figure(fig, 'Vegetarian restaurants', self.report)
+
+
+
+
+def bin_points(df, lat='lat', lon='lon', group='source', bin_size=0.01):
+    """
+    Pre-aggregate points for a scatter map, so the figure does not carry every row.
+
+    Args:
+        df (pd.DataFrame): Points with lat, lon and group columns.
+        bin_size (float): Size of a bin in degrees, 0.01 is about 1 km. None keeps every point.
+
+    Returns:
+        pd.DataFrame: One row per group and bin, with the mean lat and lon of its points and
+        their number in 'count'.
+    """
+    if bin_size is None:
+        return df.rename(columns={lat: 'lat', lon: 'lon'}).assign(count=1)
+    df = df.dropna(subset=[lat, lon])
+    binned = df.assign(lat_bin=(df[lat] / bin_size).round(), lon_bin=(df[lon] / bin_size).round())
+    return binned.groupby([group, 'lat_bin', 'lon_bin'], observed=True).agg(
+        lat=(lat, 'mean'),
+        lon=(lon, 'mean'),
+        count=(lat, 'size')
+        ).reset_index().drop(columns=['lat_bin', 'lon_bin'])
+
+
+def scatter_map_lod(df, color, color_discrete_map, point_budget=5000, zoom=8, min_zoom=5, max_zoom=16, zoom_step=3, cell_pixels=12):
+    """
+    Scatter map with a few levels of detail, with at most point_budget markers over all of them.
+
+    Every zoom_step zoom levels the points are binned in cells of about cell_pixels pixels
+    at that zoom, until the next level would go over the budget. Once binning no longer
+    halves the number of markers, the raw points are used instead of finer levels, if
+    they fit in what is left of the budget. So the figure never carries more markers than
+    the budget, and not more than the raw points when they fit. A slider switches
+    between the levels. In a Report the level also follows the zoom of the map.
+
+    Args:
+        df (pd.DataFrame): Points with lat and lon columns.
+        color (str): Column the markers are colored by.
+        color_discrete_map (dict): Color per value of the color column.
+        point_budget (int): Most markers in all levels together.
+        zoom (int): Initial zoom of the map.
+        min_zoom (int): Zoom of the coarsest level.
+        max_zoom (int): Largest zoom of a binned level.
+        zoom_step (int): Zoom levels between two levels of detail.
+        cell_pixels (int): Size of a bin in screen pixels at its zoom level.
+
+    Returns:
+        go.Figure: The map, with the zoom from which each level is shown in layout.meta.
+    """
+    levels = []
+    marker_count = 0
+    raw_zoom = max_zoom + 1
+    for level_zoom in range(min_zoom, max_zoom + 1, zoom_step):
+        binned = bin_points(df, group=color, bin_size=360 / (2 ** level_zoom * 256) * cell_pixels)
+        if 2 * len(binned) > len(df):
+            raw_zoom = level_zoom
+            break
+        if marker_count + len(binned) > point_budget:
+            break
+        levels.append((level_zoom, str(level_zoom), binned))
+        marker_count += len(binned)
+    if marker_count + len(df) <= point_budget:
+        levels.append((raw_zoom, 'all', bin_points(df, group=color, bin_size=None)))
+    if not levels:
+        raise ValueError(f"Even zoom level {min_zoom} needs more than {point_budget} markers")
+    fig = go.Figure()
+    shown = max([number for number, (level_zoom, _, _) in enumerate(levels) if level_zoom <= zoom], default=0)
+    for number, (_, _, binned) in enumerate(levels):
+        level_fig = px.scatter_map(binned, lat="lat", lon="lon", size="count", size_max=15, color=color,
+                                   hover_data=['count'], color_discrete_map=color_discrete_map)
+        for trace in level_fig.data:
+            trace.update(meta=number, visible=number == shown, opacity=0.5)
+            fig.add_trace(trace)
+    trace_levels = [trace.meta for trace in fig.data]
+    fig.update_layout(
+        map=dict(style='open-street-map', zoom=zoom, center=dict(lat=df['lat'].mean(), lon=df['lon'].mean())),
+        meta={'lod_zooms': [0] + [level_zoom for level_zoom, _, _ in levels[1:]]},
+        sliders=[dict(
+            active=shown,
+            currentvalue=dict(prefix='Detail: '),
+            steps=[dict(label=label, method='restyle', args=[{'visible': [level == number for level in trace_levels]}])
+                   for number, (_, label, _) in enumerate(levels)])])
+    return fig
+
+
+def show_figure(fig, title, report=None):
+    """Add a plotly figure to the report when there is one, open it in the browser otherwise."""
+    if report is not None:
+        report.add_figure(fig, fig.layout.title.text or title)
+    else:
+        with span('show figure'):
+            fig.show()
+
+
+# MapMakers of a worker process, reused by the jobs on the same data, and the static
+# layers rendered for them by render_maps
+_worker_map_makers = {}
+_worker_static_layers = {}
+
+
+def make_map_job(map_type, file_paths, platform=None, border_path=None, output=None, tile_cache=None):
+    """
+    Describe one map for render_maps.
+
+    Args:
+        map_type (str): 'combined', 'individual' or 'kapsalon'.
+        file_paths (dict): CSV file per platform, as for MapMaker.
+        platform (str): Platform of an individual or kapsalon map.
+        border_path (str): Region borders of the combined and individual maps.
+        output (str): Output file of a combined map, output directory of the others.
+        tile_cache (TileCache): Optional local tile store for the basemap.
+
+    Returns:
+        dict: The job.
+    """
+    return {
+        'name': map_type if platform is None else f"{map_type}_{platform}",
+        'map_type': map_type,
+        'file_paths': file_paths,
+        'platform': platform,
+        'border_path': border_path,
+        'output': output,
+        'tile_cache': tile_cache,
+    }
+
+
+def get_data_key(job):
+    """Data and borders of a map job, the jobs with the same key can share a MapMaker."""
+    return (tuple(job['file_paths'].items()), job['border_path'])
+
+
+def get_map_maker(job):
+    """MapMaker for a job, with the borders of the job set."""
+    maker = MapMaker(job['file_paths'], tile_cache=job['tile_cache'])
+    if job['border_path'] is not None:
+        maker.set_borders(job['border_path'])
+    return maker
+
+
+@timed('render static layers')
+def render_static_layers(jobs):
+    """
+    Static layers of the maps of jobs, rendered once per data set by a MapMaker in this process.
+
+    Returns:
+        dict: MapMaker.get_static_layers per data key of get_data_key.
+    """
+    makers = {}
+    for job in jobs:
+        key = get_data_key(job)
+        if key not in makers:
+            makers[key] = get_map_maker(job)
+        makers[key].get_map_background(**MAP_FIGURES[job['map_type']])
+    return {key: maker.get_static_layers() for key, maker in makers.items()}
+
+
+def init_map_worker(static_layers=None):
+    matplotlib.use('Agg')
+    _worker_static_layers.update(static_layers or {})
+
+
+def render_map_job(job, profile=False):
+    """
+    Render one map in a worker process.
+
+    Returns:
+        tuple: The time it took and, when profile is set, the spans of the job for
+        Profiler.add_spans (an empty list otherwise).
+    """
+    start = time.perf_counter()
+    with collect_spans(profile) as profiler, span(f"map {job['name']}"):
+        key = get_data_key(job)
+        if key not in _worker_map_makers:
+            _worker_map_makers[key] = get_map_maker(job)
+            if key in _worker_static_layers:
+                _worker_map_makers[key].add_static_layers(_worker_static_layers[key])
+        maker = _worker_map_makers[key]
+        match job['map_type']:
+            case 'combined':
+                maker.create_combined_map(job['border_path'], output_file=job['output'])
+            case 'individual':
+                maker.create_individual_map(job['platform'], job['border_path'], output_directory=job['output'])
+            case 'kapsalon':
+                maker.create_kapsalon_map_for_platform(job['platform'], output_directory=job['output'])
+            case map_type:
+                raise ValueError(f"Unsupported map type: {map_type}")
+        plt.close('all')
+    return time.perf_counter() - start, profiler.spans if profiler is not None else []
+
+
+def render_maps(jobs, max_workers=None, max_tasks_per_child=8):
+    """
+    Render maps in a pool of processes with the headless Agg backend.
+
+    The static layers of the maps, the basemap and the region borders, are rendered once
+    in this process and sent to every worker when it starts, so the workers neither load
+    the borders nor rasterise a basemap. Each worker keeps one MapMaker per data set, so
+    the jobs it runs on the same data share the loaded CSVs. Workers are replaced after
+    max_tasks_per_child jobs, which bounds the memory they hold on to. When the run is
+    profiled the workers send the spans of their jobs back, without cProfile or
+    tracemalloc data.
+
+    Args:
+        jobs (list): Jobs made by make_map_job. Combined maps need an output file, as
+            the workers cannot show them.
+        max_workers (int): Number of processes. Default is one per core, at most one per job.
+        max_tasks_per_child (int): Jobs a worker runs before it is replaced.
+
+    Returns:
+        dict: Seconds spent per job name.
+    """
+    max_workers = max_workers or min(len(jobs), os.cpu_count() or 1)
+    timings = {}
+    profiler = get_profiler()
+    start = time.perf_counter()
+    static_layers = render_static_layers(jobs)
+    with span('render maps'), ProcessPoolExecutor(max_workers=max_workers, initializer=init_map_worker, initargs=(static_layers,),
+                                                 max_tasks_per_child=max_tasks_per_child) as executor:
+        futures = {executor.submit(render_map_job, job, profiler is not None): job['name'] for job in jobs}
+        for done, future in enumerate(as_completed(futures), start=1):
+            timings[futures[future]], spans = future.result()
+            if profiler is not None:
+                profiler.add_spans(spans, parent=current_path())
+            print(f"[{done}/{len(jobs)}] {futures[future]}: {timings[futures[future]]:.3f}s")
+    print(f"{len(jobs)} maps on {max_workers} processes: {time.perf_counter() - start:.3f}s")
+    return timings
 
 
 class PlotMaker():
-    def __init__(self,df,name) -> None:
+    def __init__(self,df,name,report=None) -> None:
+        """
+        Args:
+            df (pd.DataFrame): Data to plot.
+            name (str): Name of the data, used in the titles.
+            report (Report): Optional report the figures are added to instead of being shown.
+        """
         self.df = df
         self.df_name = name
+        self.report = report
     
 
     def change_df(self,df,name):
@@ -251,11 +637,11 @@ class PlotMaker():
             showlegend=False
         )
         fig.update_yaxes(categoryorder='array', categoryarray=self.df['name'][::-1])
-        fig.show()
+        show_figure(fig, self.df_name, self.report)
 
     def plot_top_categories(self):
         df = self.df.head()
-        df['category'] = df['category'].replace('2600','Miscellaneous')
+        df['category'] = df['category'].astype(str).replace('2600','Miscellaneous')
         fig = px.bar(df, x='category', y='avg_rating',
                 hover_data=['avg_rating','avg_number_of_ratings'], color='category',
                 title=f'Top 5 categories in {self.df_name}',
@@ -263,20 +649,17 @@ class PlotMaker():
                 )
         fig.update_traces(showlegend=False)
         fig.update_layout( xaxis={'categoryorder':'total descending'},title_x=0.5)
-        fig.show()
+        show_figure(fig, self.df_name, self.report)
 
-    def plot_veg_restaurants(self):
-        df=self.df
-        fig = px.scatter_map(df, lat="latitude", lon="longitude",size_max=0.2,color="source",zoom=8, color_discrete_map={"ubereats": "navy", "deliveroo": "maroon","takeaway":"lightgreen"})
-        fig.update_traces(marker=dict(opacity=0.5))
-        fig.show()
+    def plot_veg_restaurants(self, point_budget=5000):
+        fig = scatter_map_lod(self.df, "source", {"ubereats": "navy", "deliveroo": "maroon","takeaway":"lightgreen"}, point_budget=point_budget)
+        show_figure(fig, f'Vegetarian restaurants ({self.df_name})', self.report)
 
 
     def price_distribution(self):
         
         df_clean = self.df.apply(pd.to_numeric, errors='coerce')
         df_clean = df_clean.dropna(how='any')
-        df_clean['ubereats'] = df_clean['ubereats'].apply(lambda x: x / 100 if pd.notnull(x) else x)
 
         df_long = df_clean.melt(var_name='Platform', value_name='Price (in Euros)')
         
@@ -301,5 +684,30 @@ class PlotMaker():
         )
         
         print(df_long['Price Range'].value_counts())
-        fig.show()
+        show_figure(fig, self.df_name, self.report)
+
+    def plot_price_histogram(self):
+        """
+        Plot price bin counts that were already computed in the database.
+
+        Expects the long format of DataBaseManager.create_price_histogram_for_all_db,
+        with 'Platform', 'Price Range' and 'count' columns.
+        """
+        fig = px.bar(
+            self.df,
+            x='Price Range',
+            y='count',
+            color='Platform',
+            title=f"Price Distribution per Platform (in Euros) -",
+            labels={"Price Range": "Price Range (in Euros)", "count": "Frequency"},
+            barmode='group',
+            color_discrete_map={
+                'ubereats': 'blue',
+                'takeaway': 'green',
+                'deliveroo': 'red'
+            }
+        )
+
+        print(self.df.groupby('Price Range', sort=False)['count'].sum())
+        show_figure(fig, self.df_name, self.report)
 
@@ -0,0 +1,298 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+from sqlalchemy import event
+
+
+# Profiler of the run in progress, None when nothing is being profiled. The spans
+# below cost one attribute lookup when it is None.
+_profiler = None
+
+
+class Profiler:
+    def __init__(self, mode=None) -> None:
+        """
+        Collect the spans of a run: the stages timed with span or timed, and every SQL
+        statement executed by an engine passed to instrument_engine.
+
+        A span started in a thread takes the span it is nested in as parent. Threads of
+        a pool start without one, pass parent=current_path() from the submitting thread
+        to put their spans under it.
+
+        Args:
+            mode (str): None for the timings only, 'cprofile' to also profile the Python
+                functions called in every thread that runs a span, 'tracemalloc' to also
+                record the memory allocated during every span and the largest allocation
+                sites. Both slow the run down.
+        """
+        if mode not in (None, 'cprofile', 'tracemalloc'):
+            raise ValueError(f"Unsupported profiling mode: {mode}")
+        self.mode = mode
+        self.spans = []
+        self.profiles = []
+        self.memory = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.start_time = time.perf_counter()
+        self.end_time = None
+
+    def start(self):
+        if self.mode == 'tracemalloc':
+            tracemalloc.start()
+
+    def stop(self):
+        self.end_time = time.perf_counter()
+        if self.mode == 'tracemalloc':
+            snapshot = tracemalloc.take_snapshot()
+            self.memory = {
+                'peak_mb': round(tracemalloc.get_traced_memory()[1] / 1e6, 2),
+                'top_allocations': [{'location': str(stat.traceback), 'size_mb': round(stat.size / 1e6, 3), 'count': stat.count}
+                                    for stat in snapshot.statistics('lineno')[:20]],
+            }
+            tracemalloc.stop()
+
+    def get_stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def current_path(self):
+        stack = self.get_stack()
+        return stack[-1] if stack else ()
+
+    def record(self, path, start, seconds, attributes):
+        with self.lock:
+            self.spans.append({'name': path[-1], 'path': list(path), 'thread': threading.current_thread().name,
+                               'start': start, 'seconds': seconds, 'attributes': attributes})
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+        stack = self.get_stack()
+        path = (tuple(parent) if parent is not None else self.current_path()) + (name.replace(';', ','),)
+        profile = None
+        if self.mode == 'cprofile' and not stack:
+            # the outermost span of a thread profiles everything that thread runs
+            profile = cProfile.Profile()
+            profile.enable()
+        if self.mode == 'tracemalloc':
+            memory_before = tracemalloc.get_traced_memory()[0]
+        stack.append(path)
+        start = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            if profile is not None:
+                profile.disable()
+                with self.lock:
+                    self.profiles.append(profile)
+            if self.mode == 'tracemalloc':
+                # includes what other threads allocated meanwhile
+                attributes['memory_mb'] = round((tracemalloc.get_traced_memory()[0] - memory_before) / 1e6, 3)
+            self.record(path, start, seconds, attributes)
+
+    def record_query(self, statement, seconds, rowcount):
+        attributes = {'statement': ' '.join(statement.split())[:500]}
+        if rowcount >= 0:
+            attributes['rows'] = rowcount
+        self.record(self.current_path() + ('sql execute',), time.perf_counter() - seconds, seconds, attributes)
+
+    def add_spans(self, spans, parent=None):
+        """Add the spans collected by another profiler, like that of a map worker process, under parent."""
+        parent = tuple(parent) if parent is not None else self.current_path()
+        with self.lock:
+            for span in spans:
+                self.spans.append(dict(span, path=list(parent) + span['path']))
+
+    def get_stages(self):
+        stages = defaultdict(lambda: {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+        for span in self.spans:
+            stage = stages[span['name']]
+            stage['count'] += 1
+            stage['total_seconds'] += span['seconds']
+            stage['max_seconds'] = max(stage['max_seconds'], span['seconds'])
+        return dict(sorted(stages.items(), key=lambda item: -item[1]['total_seconds']))
+
+    def get_queries(self):
+        queries = defaultdict(lambda: {'count': 0, 'total_seconds': 0.0})
+        for span in self.spans:
+            if span['name'] == 'sql execute':
+                query = queries[span['attributes']['statement']]
+                query['count'] += 1
+                query['total_seconds'] += span['seconds']
+        return [{'statement': statement, **query} for statement, query in sorted(queries.items(), key=lambda item: -item[1]['total_seconds'])]
+
+    def get_functions(self, limit=40):
+        """The functions with the highest cumulative time in the cProfile mode."""
+        if not self.profiles:
+            return []
+        stats = pstats.Stats(self.profiles[0], stream=io.StringIO())
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        rows = [{'function': f'{file}:{line}({function})', 'calls': calls, 'total_seconds': total, 'cumulative_seconds': cumulative}
+                for (file, line, function), (_, calls, total, cumulative, _) in stats.stats.items()]
+        return sorted(rows, key=lambda row: -row['cumulative_seconds'])[:limit]
+
+    def report(self):
+        """
+        The timings of the run.
+
+        Returns:
+            dict: Wall time, the time per stage name summed over its spans, the SQL
+            statements by total time, every span (start in seconds since the start of the
+            run) and, depending on the mode, the functions or the memory.
+        """
+        end_time = self.end_time or time.perf_counter()
+        return {
+            'started_at': self.started_at,
+            'mode': self.mode,
+            'wall_seconds': end_time - self.start_time,
+            'stages': self.get_stages(),
+            'queries': self.get_queries(),
+            'spans': [dict(span, start=span['start'] - self.start_time) for span in self.spans],
+            'functions': self.get_functions(),
+            'memory': self.memory,
+        }
+
+    def folded_stacks(self):
+        """
+        Self time per span path in microseconds, in the folded format of flamegraph.pl and speedscope.
+
+        Spans with the same path are added up. Spans that ran in parallel threads are
+        counted at their own duration, so their parent can have no self time left.
+        """
+        total = defaultdict(float)
+        children = defaultdict(float)
+        for span in self.spans:
+            path = tuple(span['path'])
+            total[path] += span['seconds']
+            children[path[:-1]] += span['seconds']
+        lines = []
+        for path, seconds in total.items():
+            self_time = round(max(seconds - children[path], 0) * 1e6)
+            if self_time:
+                lines.append(f"{';'.join(path)} {self_time}")
+        return sorted(lines)
+
+    def write(self, output_dir):
+        """
+        Write timings.json, stacks.folded and, in the cProfile mode, profile.prof (for
+        pstats or snakeviz) to output_dir, and print the slowest stages.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, 'timings.json'), 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+        with open(os.path.join(output_dir, 'stacks.folded'), 'w') as f:
+            f.write('\n'.join(self.folded_stacks()) + '\n')
+        if self.profiles:
+            stats = pstats.Stats(*self.profiles, stream=io.StringIO())
+            stats.dump_stats(os.path.join(output_dir, 'profile.prof'))
+        for name, stage in list(self.get_stages().items())[:10]:
+            print(f"{name}: {stage['total_seconds']:.3f}s in {stage['count']} spans")
+        print(f"Profile written to {output_dir}")
+
+
+def get_profiler():
+    return _profiler
+
+
+def current_path():
+    """Path of the span the calling thread is in, to pass as parent to the spans of a worker thread."""
+    return _profiler.current_path() if _profiler is not None else None
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """
+    Time a stage of the run in progress, does nothing when nothing is profiled.
+
+    Yields the attributes of the span, more can be added to it inside the block.
+    """
+    if _profiler is None:
+        yield attributes
+        return
+    with _profiler.span(name, parent, **attributes) as span_attributes:
+        yield span_attributes
+
+
+def timed(name=None):
+    """Decorator putting every call of a function in a span, named after the function by default."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profiling(output_dir, mode=None, name='run'):
+    """
+    Profile everything run inside the block and write the results to output_dir.
+
+    Args:
+        output_dir (str): Directory of the results, see Profiler.write. When None
+            nothing is profiled.
+        mode (str): None, 'cprofile' or 'tracemalloc', see Profiler.
+        name (str): Name of the root span.
+    """
+    global _profiler
+    if output_dir is None:
+        yield None
+        return
+    _profiler = Profiler(mode)
+    _profiler.start()
+    try:
+        with _profiler.span(name):
+            yield _profiler
+    finally:
+        profiler, _profiler = _profiler, None
+        profiler.stop()
+        profiler.write(output_dir)
+
+
+@contextmanager
+def collect_spans(enabled=True):
+    """
+    Collect the spans of the block in a profiler of its own, for work done in another
+    process. The spans are then in the yielded profiler, to send back to Profiler.add_spans.
+    """
+    global _profiler
+    if not enabled:
+        yield None
+        return
+    _profiler = Profiler()
+    try:
+        yield _profiler
+    finally:
+        _profiler = None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['query_start'].pop()
+    if _profiler is not None:
+        # SQLite only runs a SELECT up to its first row here, the rest is in the fetch
+        _profiler.record_query(statement, time.perf_counter() - start, cursor.rowcount)
+
+
+def instrument_engine(engine):
+    """Record the time and row count of every statement the engine executes while a run is profiled."""
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    return engine
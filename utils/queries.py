@@ -0,0 +1,261 @@
+from sqlalchemy import select, func, desc, cast, case, literal, Float, String
+
+from utils.ranking import get_score
+
+
+# Logical queries, written once against utils.platforms.PlatformSchema.
+# Each function takes the schema of one platform and returns a select that
+# can be executed on that platform's database.
+
+
+def mean_rating(schema):
+    """Mean rating over all restaurants of the platform, the prior of the bayesian score."""
+    return select(func.avg(schema.rating())).select_from(schema.table('restaurants')).correlate(None).scalar_subquery()
+
+
+def restaurant_score(schema, score='weighted', prior_reviews=50):
+    """Score of a restaurant, see utils.ranking.SCORES."""
+    return cast(get_score(score)(schema.rating(), schema.review_count(), mean_rating(schema), prior_reviews), Float)
+
+
+def restaurants_per_location(schema):
+    locations_to_restaurants = schema.table('locations_to_restaurants')
+    location_id = schema.col('locations', 'id')
+    restaurant_count = func.count(schema.col('locations_to_restaurants', 'restaurant_id')).label('rest_count')
+    return select(
+        location_id.label('id'),
+        schema.col('locations', 'name').label('name'),
+        schema.col('locations', 'lat').label('lat'),
+        schema.col('locations', 'lon').label('lon'),
+        restaurant_count
+        ).select_from(schema.table('locations')). \
+        outerjoin(locations_to_restaurants, location_id == schema.col('locations_to_restaurants', 'location_id')). \
+        group_by(location_id). \
+        order_by(desc(restaurant_count))
+
+
+def ranked_restaurants(schema, limit=10, score='weighted', prior_reviews=50, category='', dish='', min_reviews=0, per_category=True):
+    """
+    The best restaurants by score, per category or over all of them.
+
+    The top of every category comes out of one scan: the restaurants are numbered by
+    score within their category with a window function and only the first limit of each
+    are kept.
+
+    Args:
+        limit (int): Number of restaurants per category.
+        score (str): Name of a score in utils.ranking.SCORES.
+        prior_reviews (int): Weight of the mean rating in the bayesian score, in reviews.
+        category (str): Only the restaurants in this category. Default is every category.
+        dish (str): Only the restaurants with a menu item whose name contains dish.
+        min_reviews (int): Only the restaurants with at least this many reviews.
+        per_category (bool): Rank per category, with a category column. Otherwise rank
+            all the matching restaurants together, each one once.
+    """
+    columns = [
+        schema.restaurant_id().label('id'),
+        schema.col('restaurants', 'name').label('name'),
+        schema.col('restaurants', 'rating').label('rating'),
+        schema.review_count().label('review_count'),
+        restaurant_score(schema, score, prior_reviews).label('score')
+    ]
+    if per_category:
+        columns.insert(0, schema.col('categories', 'category').label('category'))
+    query = select(*columns).select_from(schema.table('restaurants')).distinct()
+    if per_category or category:
+        query = schema.join_categories(query)
+    if category:
+        query = query.where(schema.category_filter(category))
+    if dish:
+        with_dish = select(schema.col('menu_items', 'restaurant_id')).where(schema.menu_name_like(dish))
+        query = query.where(schema.col('restaurants', 'id').in_(with_dish))
+    if min_reviews:
+        query = query.where(schema.review_count() >= min_reviews)
+    candidates = query.subquery()
+    rank = func.row_number().over(
+        partition_by=candidates.c.category if per_category else None,
+        order_by=(candidates.c.score.desc(), candidates.c.id)
+        ).label('rank')
+    ranked = select(candidates, rank).subquery()
+    order = [ranked.c.category, ranked.c.rank] if per_category else [ranked.c.rank]
+    return select(ranked).where(ranked.c.rank <= limit).order_by(*order)
+
+
+def top_restaurants_in_category(schema, category='Pizza', limit=10, score='weighted', prior_reviews=50):
+    ranked = ranked_restaurants(schema, limit, score, prior_reviews, category=category, per_category=False).subquery()
+    return select(
+        ranked.c.id,
+        ranked.c.name,
+        ranked.c.rating,
+        ranked.c.review_count,
+        ranked.c.score.label('weight_score')
+        ).order_by(ranked.c.rank)
+
+
+def menu_prices(schema):
+    return select(schema.price().label('price')).select_from(schema.table('menu_items'))
+
+
+def top_categories(schema, min_avg_reviews=100, score='weighted', prior_reviews=50):
+    """Categories by the score of their average rating and number of reviews, best first."""
+    category = schema.col('categories', 'category')
+    avg_rating = func.avg(schema.rating())
+    avg_reviews = func.avg(schema.review_count())
+    category_score = cast(get_score(score)(avg_rating, avg_reviews, mean_rating(schema), prior_reviews), Float)
+    query = select(
+        category.label('category'),
+        avg_rating.label('avg_rating'),
+        avg_reviews.label('avg_number_of_ratings'),
+        category_score.label('adjustedRating')
+        ).select_from(schema.table('restaurants'))
+    return schema.join_categories(query). \
+        group_by(category). \
+        having(avg_reviews > min_avg_reviews). \
+        order_by(category_score.desc())
+
+
+def dish_prices(schema, dish='kapsalon'):
+    restaurant_name = schema.col('restaurants', 'name')
+    query = select(
+        restaurant_name.label('name'),
+        func.avg(schema.price()).label('avg_pr'),
+        func.min(schema.col('locations', 'lat')).label('lat'),
+        func.min(schema.col('locations', 'lon')).label('lon')
+        ).select_from(schema.table('restaurants'))
+    query = schema.join_locations(schema.join_menu_items(query))
+    return query.where(schema.menu_name_like(dish)). \
+        group_by(restaurant_name)
+
+
+def price_to_rating(schema, limit=10, score='weighted', prior_reviews=50):
+    restaurant_id = schema.col('restaurants', 'id')
+    restaurant_name = schema.col('restaurants', 'name')
+    avg_price = func.avg(schema.price())
+    avg_score = func.avg(restaurant_score(schema, score, prior_reviews))
+    query = select(
+        schema.restaurant_id().label('id'),
+        restaurant_name.label('name'),
+        avg_price.label('average_price'),
+        avg_score.label('average_rating'),
+        (avg_price / avg_score).label('price_to_rating_ratio')
+        ).select_from(schema.table('restaurants'))
+    return schema.join_menu_items(query). \
+        where(func.coalesce(schema.price(), 0) > 0, func.coalesce(schema.rating(), 0) > 0). \
+        group_by(restaurant_id, restaurant_name). \
+        order_by((avg_price / avg_score).asc()). \
+        limit(limit)
+
+
+def restaurants_with_dish(schema, dish='veg'):
+    query = select(
+        schema.col('restaurants', 'name').label('Restaurant_Name'),
+        schema.col('restaurants', 'lat').label('lat'),
+        schema.col('restaurants', 'lon').label('lon')
+        ).select_from(schema.table('restaurants')).distinct()
+    return schema.join_menu_items(query). \
+        where(schema.menu_name_like(dish))
+
+
+def price_histogram(schema, start=0, bin_width=10, bin_count=10):
+    """
+    Number of menu items per price bin of bin_width euros, bins are closed on the left.
+
+    A price is compared with the bin edges start + number * bin_width rather than divided
+    by bin_width, so it lands in the same bin as with dbhandler.count_in_bins on those
+    edges, also when bin_width is not a whole number.
+    """
+    if bin_width <= 0:
+        raise ValueError(f"Bin width must be positive: {bin_width}")
+    price = schema.price()
+    edges = [start + number * bin_width for number in range(bin_count + 1)]
+    price_bin = sum((case((price >= edge, 1), else_=0) for edge in edges[1:-1]), literal(0)).label('bin')
+    return select(price_bin, func.count().label('count')). \
+        select_from(schema.table('menu_items')). \
+        where(schema.col('menu_items', 'price').is_not(None),
+              price >= edges[0],
+              price < edges[-1]). \
+        group_by(price_bin). \
+        order_by(price_bin)
+
+
+def menu_items_with_restaurant(schema):
+    """Every menu item with its restaurant, the input of the dish search index."""
+    query = select(
+        schema.restaurant_id().label('restaurant_id'),
+        schema.col('restaurants', 'name').label('name'),
+        cast(schema.col('restaurants', 'lat'), Float).label('lat'),
+        cast(schema.col('restaurants', 'lon'), Float).label('lon'),
+        schema.col('menu_items', 'name').label('item_name'),
+        schema.optional_col('menu_items', 'description').label('description'),
+        schema.price().label('price')
+        ).select_from(schema.table('restaurants'))
+    return schema.join_menu_items(query)
+
+
+# Extracts for utils/store.py: every table in logical names, with string ids and
+# prices, review counts and coordinates already cleaned.
+
+def extract_restaurants(schema):
+    return select(
+        schema.restaurant_id().label('restaurant_id'),
+        schema.col('restaurants', 'name').label('name'),
+        schema.rating().label('rating'),
+        schema.review_count().label('review_count'),
+        cast(schema.col('restaurants', 'lat'), Float).label('lat'),
+        cast(schema.col('restaurants', 'lon'), Float).label('lon')
+        ).select_from(schema.table('restaurants'))
+
+
+def extract_locations(schema):
+    return select(
+        cast(schema.col('locations', 'id'), String).label('location_id'),
+        schema.col('locations', 'name').label('name'),
+        cast(schema.col('locations', 'lat'), Float).label('lat'),
+        cast(schema.col('locations', 'lon'), Float).label('lon')
+        ).select_from(schema.table('locations'))
+
+
+def extract_locations_to_restaurants(schema):
+    return select(
+        cast(schema.col('locations_to_restaurants', 'restaurant_id'), String).label('restaurant_id'),
+        cast(schema.col('locations_to_restaurants', 'location_id'), String).label('location_id')
+        ).select_from(schema.table('locations_to_restaurants'))
+
+
+def extract_categories(schema):
+    return select(
+        cast(schema.col('categories', 'restaurant_id'), String).label('restaurant_id'),
+        schema.col('categories', 'category').label('category')
+        ).select_from(schema.table('categories'))
+
+
+def extract_menu_items(schema):
+    return select(
+        cast(schema.col('menu_items', 'restaurant_id'), String).label('restaurant_id'),
+        schema.col('menu_items', 'name').label('name'),
+        schema.optional_col('menu_items', 'description').label('description'),
+        schema.price().label('price')
+        ).select_from(schema.table('menu_items'))
+
+
+EXTRACTS = {
+    'restaurants': extract_restaurants,
+    'locations': extract_locations,
+    'locations_to_restaurants': extract_locations_to_restaurants,
+    'categories': extract_categories,
+    'menu_items': extract_menu_items,
+}
+
+
+# Every query the analyses run, with the parameters they are run with.
+ANALYSIS_QUERIES = [
+    (restaurants_per_location, {}),
+    (top_restaurants_in_category, {'category': 'Pizza'}),
+    (ranked_restaurants, {}),
+    (menu_prices, {}),
+    (top_categories, {}),
+    (dish_prices, {'dish': 'kapsalon'}),
+    (price_to_rating, {}),
+    (restaurants_with_dish, {'dish': 'veg'}),
+    (price_histogram, {}),
+]
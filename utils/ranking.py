@@ -0,0 +1,56 @@
+import numpy as np
+
+
+# Scores to rank restaurants (or categories) by. They only use arithmetic, so the same
+# function builds the SQL expression of utils/queries.py from columns and computes the
+# score in pandas from Series, as utils/store.py does.
+
+def weighted_score(rating, review_count, mean_rating, prior_reviews):
+    """The score of the questions: rating x 0.3 + number of reviews x 0.7."""
+    return rating * 0.3 + review_count * 0.7
+
+
+def bayesian_score(rating, review_count, mean_rating, prior_reviews):
+    """
+    Bayesian average of the rating: the rating as if the restaurant also had prior_reviews
+    reviews at the mean rating of the platform. A 5.0 from 3 reviews then no longer beats
+    a 4.7 from 900, and a restaurant without reviews gets the mean rating.
+    """
+    return (rating * review_count + mean_rating * prior_reviews) / (review_count + prior_reviews)
+
+
+SCORES = {
+    'weighted': weighted_score,
+    'bayesian': bayesian_score,
+}
+
+
+def get_score(score):
+    """Score function of a name in SCORES, or score itself when it is a function."""
+    if callable(score):
+        return score
+    if score not in SCORES:
+        raise ValueError(f"Unsupported score: {score}")
+    return SCORES[score]
+
+
+def top_n(df, score_column, limit, group=None, tie_column=None, ascending=False):
+    """
+    The limit best rows of df by score_column, per group when given, from a single sort.
+
+    Rows without a score come last. Ties are broken on tie_column, like the ORDER BY of
+    the window function in queries.ranked_restaurants.
+
+    Returns:
+        pd.DataFrame: The rows with a 'rank' column starting at 1, ordered by group and rank.
+    """
+    by = [score_column] + ([tie_column] if tie_column else [])
+    order = [ascending] + ([True] if tie_column else [])
+    df = df.sort_values(by, ascending=order, kind='stable', na_position='last')
+    if group is not None:
+        df = df.sort_values(group, kind='stable')
+        rank = df.groupby(group, sort=False, observed=True).cumcount().to_numpy() + 1
+    else:
+        rank = np.arange(1, len(df) + 1)
+    df = df.assign(rank=rank)
+    return df[df['rank'] <= limit].reset_index(drop=True)
@@ -0,0 +1,115 @@
+import base64
+import html
+import mimetypes
+import os
+
+from plotly.offline import get_plotlyjs
+
+
+# Shows the level of detail of a scatter_map_lod figure that matches the zoom of the map
+LOD_SCRIPT = """
+var gd = document.getElementById('{plot_id}');
+var lodZooms = gd.layout.meta && gd.layout.meta.lod_zooms;
+if (lodZooms) {
+    gd.on('plotly_relayout', function(update) {
+        var zoom = update['map.zoom'];
+        if (zoom === undefined) return;
+        var level = 0;
+        lodZooms.forEach(function(minZoom, number) { if (zoom >= minZoom) level = number; });
+        if (level === gd.lodLevel) return;
+        gd.lodLevel = level;
+        Plotly.restyle(gd, {visible: gd.data.map(function(trace) { return trace.meta === level; })});
+    });
+}
+"""
+
+
+def get_data_uri(path):
+    """Content of an image file as a data: URI."""
+    mime_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    with open(path, 'rb') as f:
+        return f'data:{mime_type};base64,{base64.b64encode(f.read()).decode("ascii")}'
+
+
+class Report:
+    def __init__(self, title='Delivery market analysis') -> None:
+        """
+        Collect the figures of a run and write them to one self-contained HTML file.
+
+        The plotly.js bundle is embedded once in the page and shared by all figures,
+        instead of once per figure as with fig.write_html.
+
+        Args:
+            title (str): Title of the report page.
+        """
+        self.title = title
+        self.items = []
+
+    def add_figure(self, fig, title):
+        """Add a plotly figure."""
+        self.items.append({'kind': 'figure', 'title': title, 'figure': fig})
+
+    def add_image(self, path, title):
+        """Add an image file, like the maps of MapMaker. It is read and embedded when the report is written."""
+        self.items.append({'kind': 'image', 'title': title, 'path': path})
+
+    def write(self, path='report.html'):
+        """
+        Write the report.
+
+        Args:
+            path (str): Output HTML file. The images are embedded in it as data URIs, so it can
+                be moved or shared on its own.
+        """
+        report_dir = os.path.dirname(os.path.abspath(path))
+        sections = []
+        for number, item in enumerate(self.items):
+            sections.append(f'<h2>{html.escape(item["title"])}</h2>')
+            match item['kind']:
+                case 'figure':
+                    sections.append(item['figure'].to_html(full_html=False, include_plotlyjs=False, div_id=f'figure-{number}', post_script=LOD_SCRIPT))
+                case 'image':
+                    sections.append(f'<img src="{get_data_uri(item["path"])}" alt="{html.escape(item["title"])}" style="max-width:100%">')
+        page = '\n'.join([
+            '<!DOCTYPE html>',
+            '<html>',
+            '<head>',
+            '<meta charset="utf-8">',
+            f'<title>{html.escape(self.title)}</title>',
+            f'<script type="text/javascript">{get_plotlyjs()}</script>',
+            '</head>',
+            '<body>',
+            f'<h1>{html.escape(self.title)}</h1>',
+            *sections,
+            '</body>',
+            '</html>',
+        ])
+        os.makedirs(report_dir, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(page)
+        print(f"Report with {len(self.items)} figures written to {path}")
+
+    def export_images(self, output_directory='report_images', image_format='png'):
+        """
+        Also save every plotly figure as a static image.
+
+        Needs the kaleido package, which plotly uses to render static images. Kaleido
+        renders one image at a time in a single browser process, so the figures are
+        written one after the other.
+
+        Args:
+            output_directory (str): Directory of the images.
+            image_format (str): 'png', 'jpg', 'svg' or 'pdf'.
+
+        Returns:
+            list: Paths of the written images.
+        """
+        os.makedirs(output_directory, exist_ok=True)
+        jobs = []
+        for number, item in enumerate(self.items):
+            if item['kind'] == 'figure':
+                file_name = f'{number:02d}_{"".join(char if char.isalnum() else "_" for char in item["title"])}.{image_format}'
+                jobs.append((item['figure'], os.path.join(output_directory, file_name)))
+        for figure, path in jobs:
+            figure.write_image(path)
+        return [path for _, path in jobs]
@@ -0,0 +1,151 @@
+import bisect
+import pickle
+import re
+
+import numpy as np
+import pandas as pd
+
+
+TOKEN_PATTERN = r'[a-z0-9]+'
+# Letters that do not decompose into a base letter and an accent, spelled out in ASCII
+TRANSLITERATIONS = str.maketrans({'œ': 'oe', 'æ': 'ae', 'ß': 'ss', 'ø': 'o', 'đ': 'd', 'ð': 'd', 'þ': 'th', 'ł': 'l', 'ı': 'i'})
+COMBINING_MARKS = r'[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]'
+# Version of the tokenisation, saved indexes of another version are built again
+INDEX_VERSION = 2
+
+
+def fold_series(texts):
+    """
+    Lower case texts without accents, so 'Crème brûlée' and 'creme brulee' are the same
+    and 'Bœuf' is 'boeuf'. Other characters outside ASCII are kept, so they separate tokens.
+    """
+    return texts.fillna('').astype(str).str.lower().str.translate(TRANSLITERATIONS). \
+        str.normalize('NFKD').str.replace(COMBINING_MARKS, '', regex=True)
+
+
+def fold(text):
+    """fold_series for a single text, so the index and the search terms are folded the same way."""
+    return fold_series(pd.Series([text], dtype=object)).iloc[0]
+
+
+def tokenize(text):
+    return re.findall(TOKEN_PATTERN, fold(text))
+
+
+def tokenize_series(texts):
+    """Vectorised tokenize over a Series, one list of tokens per row."""
+    # menus repeat the same dish names, every distinct text is only tokenized once
+    codes, uniques = pd.factorize(texts.fillna(''))
+    tokens = fold_series(pd.Series(uniques, dtype=object)).str.findall(TOKEN_PATTERN).to_numpy()
+    return pd.Series(tokens[codes] if len(codes) else [], index=texts.index, dtype=object)
+
+
+class MenuSearchIndex:
+    def __init__(self, items, fields=('item_name', 'description')) -> None:
+        """
+        Inverted index over the menu items of all platforms.
+
+        Args:
+            items (pd.DataFrame): One row per menu item, as returned by
+                DataBaseManager.get_menu_items_for_search, with a 'source' column.
+            fields (tuple): Text columns of items that are indexed.
+        """
+        self.items = items.reset_index(drop=True)
+        self.postings = {}
+        self.vocabulary = {}
+        for field in fields:
+            tokens = tokenize_series(self.items[field]).explode().dropna()
+            pairs = pd.DataFrame({'token': tokens.to_numpy(), 'row': tokens.index.to_numpy(dtype=np.int64)}). \
+                drop_duplicates().sort_values(['token', 'row'])
+            words, starts = np.unique(pairs['token'].to_numpy(), return_index=True)
+            self.postings[field] = dict(zip(words.tolist(), np.split(pairs['row'].to_numpy(), starts[1:])))
+            self.vocabulary[field] = words.tolist()
+
+    def match_tokens(self, field, token, match):
+        vocabulary = self.vocabulary[field]
+        match match:
+            case 'token':
+                return [token] if token in self.postings[field] else []
+            case 'prefix':
+                start = bisect.bisect_left(vocabulary, token)
+                end = bisect.bisect_left(vocabulary, token + '\uffff')
+                return vocabulary[start:end]
+            case 'substring':
+                return [word for word in vocabulary if token in word]
+            case _:
+                raise ValueError(f"Unsupported match: {match}")
+
+    def lookup(self, term, fields=None, match='substring'):
+        """
+        Row numbers of the items matching every token of term in one of the fields.
+
+        Args:
+            term (str): Search term, tokenised and accent folded like the index.
+            fields (tuple): Fields to search. Default is all indexed fields.
+            match (str): 'substring' (like SQL LIKE '%term%' per word), 'prefix' or 'token'.
+
+        Returns:
+            np.ndarray: Sorted row numbers into self.items.
+        """
+        fields = fields or tuple(self.postings)
+        row_ids = None
+        for token in tokenize(term):
+            postings = [self.postings[field][word] for field in fields for word in self.match_tokens(field, token, match)]
+            rows = np.unique(np.concatenate(postings)) if postings else np.array([], dtype=np.int64)
+            row_ids = rows if row_ids is None else np.intersect1d(row_ids, rows)
+        if row_ids is None:
+            return np.array([], dtype=np.int64)
+        return row_ids
+
+    def search(self, term, platforms=None, aggregate='restaurants', fields=None, match='substring'):
+        """
+        Find the menu items matching term.
+
+        Args:
+            term (str): Dish to look for, for example 'kapsalon' or 'veg'.
+            platforms (list): Platforms to keep. Default is all of them.
+            aggregate (str): 'items' for one row per menu item, 'restaurants' for one row per
+                restaurant with the average price and number of matching items, 'platforms'
+                for one row per platform.
+            fields (tuple): Fields to search. Default is all indexed fields.
+            match (str): How the tokens of term are matched, see lookup.
+
+        Returns:
+            pd.DataFrame: Matching items, restaurants or platforms. The restaurant rows have
+            the name, avg_pr, lat, lon and source columns used by the maps.
+        """
+        items = self.items.iloc[self.lookup(term, fields=fields, match=match)]
+        if platforms is not None:
+            items = items[items['source'].isin(platforms)]
+        match aggregate:
+            case 'items':
+                return items.reset_index(drop=True)
+            case 'restaurants':
+                return items.groupby(['source', 'restaurant_id'], sort=False, observed=True).agg(
+                    name=('name', 'first'),
+                    avg_pr=('price', 'mean'),
+                    lat=('lat', 'first'),
+                    lon=('lon', 'first'),
+                    item_count=('item_name', 'size')
+                    ).reset_index()
+            case 'platforms':
+                return items.groupby('source', observed=True).agg(
+                    restaurant_count=('restaurant_id', 'nunique'),
+                    item_count=('item_name', 'size'),
+                    avg_pr=('price', 'mean')
+                    ).reset_index()
+            case _:
+                raise ValueError(f"Unsupported aggregate: {aggregate}")
+
+    def save(self, path, fingerprints):
+        with open(path, 'wb') as f:
+            pickle.dump({'version': INDEX_VERSION, 'fingerprints': fingerprints, 'index': self}, f)
+
+    @staticmethod
+    def load(path, fingerprints):
+        """Index saved at path, or None when it was built from other versions of the databases or of the index."""
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+        if saved.get('version') != INDEX_VERSION or saved['fingerprints'] != fingerprints:
+            return None
+        return saved['index']
@@ -0,0 +1,489 @@
+import argparse
+import asyncio
+import inspect
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit, parse_qsl
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from utils import queries
+from utils.dbhandler import DataBaseManager, ResultCache, PANDAS_DTYPES, db_urls, get_column_kinds
+
+
+# The analyses the service exposes, by name: the logical queries of utils/queries.py.
+# Their keyword arguments are the query parameters.
+ENDPOINTS = {logical_query.__name__: logical_query for logical_query, _ in queries.ANALYSIS_QUERIES}
+# Type of every query parameter, a default of 10 does not mean 2.5 is a bad value.
+PARAMETER_TYPES = {
+    'limit': int,
+    'score': str,
+    'prior_reviews': float,
+    'category': str,
+    'dish': str,
+    'min_reviews': int,
+    'per_category': bool,
+    'min_avg_reviews': float,
+    'start': float,
+    'bin_width': float,
+    'bin_count': int,
+}
+FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+def get_query_params(logical_query):
+    """Keyword arguments of a logical query and their default values."""
+    parameters = list(inspect.signature(logical_query).parameters.values())[1:]
+    return {parameter.name: parameter.default for parameter in parameters}
+
+
+def parse_params(logical_query, raw_params):
+    """Convert the query string values to their PARAMETER_TYPES, ValueError on unknown or bad ones."""
+    defaults = get_query_params(logical_query)
+    params = {}
+    for name, value in raw_params.items():
+        if name not in defaults:
+            raise ValueError(f"Unknown parameter of {logical_query.__name__}: {name}")
+        parameter_type = PARAMETER_TYPES[name]
+        if parameter_type is bool:
+            # bool('false') would be True
+            params[name] = value.lower() in ('1', 'true', 'yes')
+        else:
+            params[name] = parameter_type(value)
+    return params
+
+
+def get_price_histogram(manager, db_name, start=0, bin_width=10, bin_count=10):
+    """The price histogram with its 'Price Range' labels and its empty bins, like the price plots get it."""
+    return manager.get_price_histogram(db_name, bins=start + np.arange(bin_count + 1) * bin_width)
+
+
+# Analyses answered by a DataBaseManager method rather than with the rows of their query
+MANAGER_ANALYSES = {
+    'price_histogram': get_price_histogram,
+}
+
+
+def get_key(name, db_names, params):
+    return (name, tuple(db_names), tuple(sorted(params.items())))
+
+
+def to_json_records(df, lines=False):
+    # float32 columns through their shortest repr, or 27.85 would come out as 27.8500003815
+    floats = {column: df[column].astype(str).astype('float64') for column in df.columns if df[column].dtype == 'float32'}
+    return df.assign(**floats).to_json(orient='records', lines=lines)
+
+
+class ArrowChunks:
+    """File-like object collecting what a pyarrow IPC writer writes, to send it chunk by chunk."""
+    def __init__(self) -> None:
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+class ChunkEncoder:
+    def __init__(self, response_format) -> None:
+        """Serialise the chunks of a streamed response, as NDJSON lines or as the messages of an Arrow IPC stream."""
+        self.response_format = response_format
+        self.sink = ArrowChunks()
+        self.arrow_writer = None
+        self.schema = None
+
+    def encode(self, df):
+        match self.response_format:
+            case 'ndjson':
+                return to_json_records(df, lines=True).rstrip('\n').encode() + b'\n' if len(df) else b''
+            case 'arrow':
+                if self.arrow_writer is None:
+                    # the later chunks, also those of other platforms, are cast to the types of the first one
+                    self.schema = pa.Schema.from_pandas(df, preserve_index=False)
+                    self.arrow_writer = pa.ipc.new_stream(self.sink, self.schema)
+                if len(df):
+                    self.arrow_writer.write_batch(pa.RecordBatch.from_pandas(df, schema=self.schema, preserve_index=False))
+                return self.sink.take()
+
+    def close(self, empty):
+        """Last bytes of the response. empty is a DataFrame without rows, for the columns of a result without chunks."""
+        if self.response_format != 'arrow':
+            return b''
+        if self.arrow_writer is None:
+            self.encode(empty)
+        self.arrow_writer.close()
+        return self.sink.take()
+
+
+def get_empty_frame(query):
+    """DataFrame without rows with the columns of a query, typed like the chunks of DataBaseManager.iter_query."""
+    return pd.DataFrame({column: pd.Series(dtype=PANDAS_DTYPES.get(kind, 'object')) for column, kind in get_column_kinds(query).items()})
+
+
+class Run:
+    def __init__(self, loop, streamed) -> None:
+        """
+        One execution of an analysis, shared by every request for its result that arrives
+        while it runs.
+
+        future is set by QueryService.start_run and gives the whole result. A streamed run
+        also keeps its chunks as they are fetched, and next_chunk is done every time one is
+        added, so the streamed responses can send them before the run completes. Its stop
+        is set when no request waits for it any more.
+
+        Args:
+            loop (asyncio.AbstractEventLoop): Loop of the service.
+            streamed (bool): The result is fetched chunk by chunk.
+        """
+        self.loop = loop
+        self.streamed = streamed
+        self.future = None
+        self.chunks = []
+        self.next_chunk = loop.create_future()
+        self.listeners = 0
+        self.stop = threading.Event()
+
+    def add(self, chunk):
+        self.chunks.append(chunk)
+        self.next_chunk.set_result(None)
+        self.next_chunk = self.loop.create_future()
+
+
+class QueryService:
+    def __init__(self, manager, max_workers=4, ttl=300, max_cached=128, chunk_rows=5000) -> None:
+        """
+        Local HTTP service answering the analyses of a DataBaseManager as JSON, NDJSON or Arrow.
+
+        GET /analyses/<name>?platform=ubereats,takeaway&format=ndjson&<parameters> runs a
+        logical query of ENDPOINTS on the platforms (all of them by default), with one
+        'platform' column in the result. GET /analyses lists the analyses and their
+        parameters, GET /stats the counters of the service.
+
+        The queries run on a thread pool of max_workers threads, so the event loop is never
+        blocked by SQLite and at most that many queries run at the same time. The tables
+        are reflected on that pool too, for every platform before the first connection.
+        Requests for the same analysis, platforms and parameters that arrive while it is
+        running share that one run instead of starting their own, and the results are kept
+        in memory for ttl seconds. NDJSON and Arrow responses are streamed: chunk_rows rows
+        at a time are fetched, and every request streaming the run serialises them on the
+        thread pool and sends them as they come, also when it joined the run later. A
+        streamed run stops early when all its requests went away. The analyses of
+        MANAGER_ANALYSES are not rows of their query and are never streamed.
+
+        Args:
+            manager (DataBaseManager): Manager of the platform databases.
+            max_workers (int): Number of threads running queries and serialising results.
+            ttl (float): Seconds a result is served from memory.
+            max_cached (int): Number of results kept in memory, the least recently used go first.
+            chunk_rows (int): Rows per chunk of a streamed response.
+        """
+        self.manager = manager
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='query')
+        self.ttl = ttl
+        self.max_cached = max_cached
+        self.chunk_rows = chunk_rows
+        self.cache = OrderedDict()
+        self.in_flight = {}
+        self.stats = {'requests': 0, 'executions': 0, 'streams': 0, 'coalesced': 0, 'cache_hits': 0, 'errors': 0}
+        self.responding = set()
+
+    async def compute(self, name, db_names, params):
+        loop = asyncio.get_running_loop()
+        frames = await asyncio.gather(*[
+            loop.run_in_executor(self.executor, self.run_analysis, name, db_name, params)
+            for db_name in db_names])
+        return pd.concat([df.assign(platform=db_name) for db_name, df in zip(db_names, frames)], ignore_index=True)
+
+    def start_run(self, key, name, db_names, params, streamed):
+        loop = asyncio.get_running_loop()
+        run = Run(loop, streamed)
+        self.stats['executions'] += 1
+        if streamed:
+            self.stats['streams'] += 1
+            run.future = loop.run_in_executor(self.executor, self.produce, run, name, db_names, params)
+        else:
+            run.future = asyncio.ensure_future(self.compute(name, db_names, params))
+        self.in_flight[key] = run
+        run.future.add_done_callback(partial(self.finish, key, run))
+        return run
+
+    def join_run(self, key):
+        """The run in progress for key, or None when there is none or it is stopping."""
+        run = self.in_flight.get(key)
+        if run is None or run.stop.is_set():
+            return None
+        self.stats['coalesced'] += 1
+        return run
+
+    def finish(self, key, run, future):
+        if self.in_flight.get(key) is run:
+            del self.in_flight[key]
+        # a stopped run gives None
+        if not future.cancelled() and future.exception() is None and future.result() is not None:
+            self.cache[key] = (time.monotonic() + self.ttl, future.result())
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+
+    def leave_run(self, run):
+        run.listeners -= 1
+        if run.streamed and run.listeners == 0 and not run.future.done():
+            run.stop.set()
+
+    async def wait_for_run(self, run):
+        run.listeners += 1
+        try:
+            # a client that disconnects does not cancel the run the others wait for
+            return await asyncio.shield(run.future)
+        finally:
+            self.leave_run(run)
+
+    def get_cached(self, key):
+        if key in self.cache:
+            expires, df = self.cache[key]
+            if expires > time.monotonic():
+                self.stats['cache_hits'] += 1
+                self.cache.move_to_end(key)
+                return df
+            del self.cache[key]
+        return None
+
+    async def get_result(self, name, db_names, params):
+        """Result of an analysis from the cache, from the run in progress or from a new run."""
+        key = get_key(name, db_names, params)
+        df = self.get_cached(key)
+        if df is not None:
+            return df
+        run = self.join_run(key) or self.start_run(key, name, db_names, params, streamed=False)
+        return await self.wait_for_run(run)
+
+    def run_analysis(self, name, db_name, params):
+        if name in MANAGER_ANALYSES:
+            return MANAGER_ANALYSES[name](self.manager, db_name, **params)
+        return self.manager.run_query(ENDPOINTS[name], db_name, **params)
+
+    def build_query(self, name, db_name, params):
+        """The query of an analysis on a platform, ValueError on a bad parameter value. Reflects the tables on first use."""
+        return self.manager.build_query(ENDPOINTS[name], db_name, **params)
+
+    def warm_up(self, db_name):
+        for name, logical_query in ENDPOINTS.items():
+            self.build_query(name, db_name, {})
+
+    def produce(self, run, name, db_names, params):
+        """
+        Run an analysis chunk by chunk in a worker thread, adding the chunks to run on the
+        event loop as they are fetched. Returns the whole result, or None when run.stop
+        was set before the end.
+        """
+        frames = []
+        for db_name in db_names:
+            chunks = self.manager.iter_query(ENDPOINTS[name], db_name, chunksize=self.chunk_rows, **params)
+            try:
+                for chunk in chunks:
+                    if run.stop.is_set():
+                        return None
+                    chunk = chunk.assign(platform=db_name)
+                    frames.append(chunk)
+                    run.loop.call_soon_threadsafe(run.add, chunk)
+            finally:
+                chunks.close()
+        if not frames:
+            return get_empty_frame(self.build_query(name, db_names[0], params)).assign(platform=pd.Series(dtype=object))
+        return pd.concat(frames, ignore_index=True)
+
+    async def stream_result(self, writer, name, db_names, params, response_format):
+        """Send a result as it is fetched, from a new streamed run or by joining the one in progress."""
+        key = get_key(name, db_names, params)
+        df = self.get_cached(key)
+        if df is not None:
+            await self.send_result(writer, df, response_format)
+            return
+        run = self.join_run(key) or self.start_run(key, name, db_names, params, streamed=True)
+        if not run.streamed:
+            await self.send_result(writer, await self.wait_for_run(run), response_format)
+            return
+        loop = asyncio.get_running_loop()
+        encoder = ChunkEncoder(response_format)
+        sent = 0
+        run.listeners += 1
+        try:
+            while sent < len(run.chunks) or not run.future.done():
+                if sent == len(run.chunks):
+                    await asyncio.wait([run.future, run.next_chunk], return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                data = await loop.run_in_executor(self.executor, encoder.encode, run.chunks[sent])
+                sent += 1
+                # the head waits for the first chunk, so a run that fails right away is still a 500
+                if writer not in self.responding:
+                    await self.send_head(writer, 200, FORMATS[response_format])
+                await self.send_chunk(writer, data)
+            df = run.future.result()
+            if writer not in self.responding:
+                await self.send_head(writer, 200, FORMATS[response_format])
+            await self.send_chunk(writer, await loop.run_in_executor(self.executor, encoder.close, df.iloc[:0]))
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        finally:
+            # a client that went away stops the run once nobody else waits for it
+            self.leave_run(run)
+
+    def parse_request(self, target):
+        """Analysis name, platforms, parameters and format of a request target."""
+        url = urlsplit(target)
+        name = url.path.removeprefix('/analyses/')
+        if name not in ENDPOINTS:
+            raise LookupError(f"Unknown analysis: {name}")
+        raw_params = dict(parse_qsl(url.query))
+        response_format = raw_params.pop('format', 'json')
+        if response_format not in FORMATS:
+            raise ValueError(f"Unsupported format: {response_format}")
+        db_names = list(self.manager.db_urls.keys())
+        if 'platform' in raw_params:
+            db_names = list(dict.fromkeys(raw_params.pop('platform').split(',')))
+            for db_name in db_names:
+                if db_name not in self.manager.db_urls:
+                    raise ValueError(f"Unknown platform: {db_name}")
+        return name, db_names, parse_params(ENDPOINTS[name], raw_params), response_format
+
+    async def handle(self, reader, writer):
+        request_line = []
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            # the headers are not needed, every response closes the connection
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if len(request_line) != 3:
+                return
+            method, target, _ = request_line
+            self.stats['requests'] += 1
+            if method != 'GET':
+                await self.send_json(writer, 405, {'error': f"Unsupported method: {method}"})
+                return
+            path = urlsplit(target).path.rstrip('/')
+            match path:
+                case '/analyses':
+                    await self.send_json(writer, 200, {name: get_query_params(logical_query) for name, logical_query in ENDPOINTS.items()})
+                case '/stats':
+                    await self.send_json(writer, 200, dict(self.stats, cached=len(self.cache), in_flight=len(self.in_flight)))
+                case _:
+                    try:
+                        name, db_names, params, response_format = self.parse_request(target)
+                    except LookupError as error:
+                        await self.send_json(writer, 404, {'error': str(error)})
+                        return
+                    except ValueError as error:
+                        await self.send_json(writer, 400, {'error': str(error)})
+                        return
+                    try:
+                        # the query is built once first so a bad parameter value (like an unknown score) is a 400
+                        await asyncio.get_running_loop().run_in_executor(self.executor, self.build_query, name, db_names[0], params)
+                    except ValueError as error:
+                        await self.send_json(writer, 400, {'error': str(error)})
+                        return
+                    if response_format == 'json' or name in MANAGER_ANALYSES:
+                        df = await self.get_result(name, db_names, params)
+                        await self.send_result(writer, df, response_format)
+                    else:
+                        await self.stream_result(writer, name, db_names, params, response_format)
+        except ConnectionError:
+            pass
+        except Exception as error:
+            self.stats['errors'] += 1
+            print(f"Error in {request_line}: {error!r}")
+            if writer not in self.responding:
+                # once the head of a response is sent the client can only tell from the cut off body
+                try:
+                    await self.send_json(writer, 500, {'error': repr(error)})
+                except ConnectionError:
+                    pass
+        finally:
+            self.responding.discard(writer)
+            writer.close()
+
+    async def send_head(self, writer, status, content_type, content_length=None):
+        headers = [f'HTTP/1.1 {status} {REASONS[status]}', f'Content-Type: {content_type}', 'Connection: close']
+        if content_length is None:
+            headers.append('Transfer-Encoding: chunked')
+        else:
+            headers.append(f'Content-Length: {content_length}')
+        self.responding.add(writer)
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+    async def send_json(self, writer, status, content):
+        body = json.dumps(content, default=str).encode()
+        await self.send_head(writer, status, FORMATS['json'], len(body))
+        writer.write(body)
+        await writer.drain()
+
+    async def send_chunk(self, writer, data):
+        if data:
+            writer.write(f'{len(data):X}\r\n'.encode() + data + b'\r\n')
+            await writer.drain()
+
+    async def send_result(self, writer, df, response_format):
+        loop = asyncio.get_running_loop()
+        run = partial(loop.run_in_executor, self.executor)
+        if response_format == 'json':
+            body = await run(lambda: to_json_records(df).encode())
+            await self.send_head(writer, 200, FORMATS['json'], len(body))
+            writer.write(body)
+            await writer.drain()
+            return
+        await self.send_head(writer, 200, FORMATS[response_format])
+        encoder = ChunkEncoder(response_format)
+        for start in range(0, len(df), self.chunk_rows):
+            await self.send_chunk(writer, await run(encoder.encode, df.iloc[start:start + self.chunk_rows]))
+        await self.send_chunk(writer, await run(encoder.close, df.iloc[:0]))
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, self.warm_up, db_name) for db_name in self.manager.db_urls])
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving {len(ENDPOINTS)} analyses on http://{host}:{port}/analyses")
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host='127.0.0.1', port=8080):
+        """Serve until interrupted."""
+        try:
+            asyncio.run(self.serve(host, port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.executor.shutdown()
+            self.manager.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the analyses of the platform databases over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--ttl', type=float, default=300)
+    args = parser.parse_args()
+    manager = DataBaseManager(db_urls, reflection_cache_dir='databases/reflection_cache', result_cache=ResultCache('databases/result_cache'))
+    QueryService(manager, max_workers=args.workers, ttl=args.ttl).run(args.host, args.port)
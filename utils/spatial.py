@@ -0,0 +1,179 @@
+import math
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from utils import borders as border_cache
+
+
+MAP_CRS = 'EPSG:3857'  # web mercator, the CRS of the maps
+AREA_CRS = 'EPSG:3035'  # equal area CRS for Europe, its meters are ground meters
+
+
+def project_points(df, crs):
+    """Points of the lat and lon columns of df in crs, rows without coordinates are dropped."""
+    df = df.dropna(subset=['lat', 'lon'])
+    points = gpd.GeoSeries(gpd.points_from_xy(df['lon'], df['lat']), index=df.index, crs='EPSG:4326')
+    return df, points.to_crs(crs)
+
+
+def assign_to_polygons(points, polygons):
+    """
+    Position in polygons of the polygon containing each point, or -1.
+
+    The polygons go into an STRtree and all points are queried at once. A point on a
+    border shared by two polygons goes to the first one.
+
+    Args:
+        points (array-like): Shapely points.
+        polygons (array-like): Shapely polygons, in the same CRS as the points.
+
+    Returns:
+        np.ndarray: Polygon position per point.
+    """
+    tree = shapely.STRtree(polygons)
+    point_ids, polygon_ids = tree.query(points, predicate='within')
+    assigned = np.full(len(points), -1, dtype=np.int64)
+    # reversed, so the first polygon of a point is written last and wins
+    assigned[point_ids[::-1]] = polygon_ids[::-1]
+    return assigned
+
+
+def hex_cells(x, y, cell_size):
+    """
+    Axial coordinates (q, r) of the pointy-top hexagons containing the points.
+
+    Args:
+        x (np.ndarray): X coordinates in meters.
+        y (np.ndarray): Y coordinates in meters.
+        cell_size (float): Width of a hexagon, from one flat side to the other.
+
+    Returns:
+        tuple: q and r as integer arrays.
+    """
+    radius = cell_size / math.sqrt(3)
+    q = (math.sqrt(3) / 3 * x - y / 3) / radius
+    r = 2 / 3 * y / radius
+    # round in cube coordinates, fixing the component with the largest rounding error
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+
+def hex_polygons(q, r, cell_size):
+    """Hexagons of the given axial coordinates, as shapely polygons."""
+    radius = cell_size / math.sqrt(3)
+    center_x = radius * math.sqrt(3) * (q + r / 2)
+    center_y = radius * 1.5 * r
+    angles = np.radians(30 + 60 * np.arange(6))
+    xs = center_x[:, None] + radius * np.cos(angles)[None, :]
+    ys = center_y[:, None] + radius * np.sin(angles)[None, :]
+    return shapely.polygons(np.stack([xs, ys], axis=-1))
+
+
+def square_cells(x, y, cell_size):
+    return np.floor(x / cell_size).astype(np.int64), np.floor(y / cell_size).astype(np.int64)
+
+
+def square_polygons(column, row, cell_size):
+    return shapely.box(column * cell_size, row * cell_size, (column + 1) * cell_size, (row + 1) * cell_size)
+
+
+class SpatialAggregator:
+    def __init__(self, analyses, border_path='vizualizations_data/belgium-with-regions_.geojson') -> None:
+        """
+        Count restaurants per Belgian region and per grid cell, for choropleth maps.
+
+        Args:
+            analyses (PlatformAnalyses): Where the restaurants come from, a DataBaseManager
+                or an AnalyticsStore.
+            border_path (str): Shapefile or GeoJSON file with the regions.
+        """
+        self.analyses = analyses
+        self.border_path = border_path
+        self.points = {}
+
+    def get_points(self, db_name):
+        """Restaurants of a platform with their point in the equal area CRS, loaded once."""
+        if db_name not in self.points:
+            self.points[db_name] = project_points(self.analyses.get_restaurants(db_name), AREA_CRS)
+        return self.points[db_name]
+
+    def summarize(self, restaurants, keys, db_name):
+        """Number of restaurants and average rating per key, for one platform."""
+        df = restaurants.assign(**keys).groupby(list(keys)).agg(
+            restaurant_count=('restaurant_id', 'size'),
+            avg_rating=('rating', 'mean')
+            ).reset_index()
+        df['platform'] = db_name
+        return df
+
+    def aggregate_by_region(self, db_names=None):
+        """
+        Restaurants per region and platform.
+
+        Args:
+            db_names (list): Platforms to aggregate. Default is all of them.
+
+        Returns:
+            gpd.GeoDataFrame: One row per region and platform, regions without restaurants
+            included, with restaurant_count, avg_rating, area_km2, density (restaurants per
+            km2) and the region geometry in EPSG:3857.
+        """
+        regions = border_cache.load_borders(self.border_path).reset_index(drop=True)
+        regions_area = regions.to_crs(AREA_CRS)
+        area_km2 = regions_area.area.to_numpy() / 1e6
+        frames = []
+        for db_name, (restaurants, points) in self.analyses.fan_out(self.get_points, db_names=db_names, label='restaurant points').items():
+            region_ids = assign_to_polygons(points.values, regions_area.geometry.values)
+            inside = region_ids >= 0
+            counts = self.summarize(restaurants[inside], {'region_index': region_ids[inside]}, db_name)
+            counts = counts.set_index('region_index').reindex(regions.index)
+            counts['platform'] = db_name
+            counts['restaurant_count'] = counts['restaurant_count'].fillna(0).astype('int64')
+            frames.append(counts)
+        df = pd.concat(frames)
+        df = regions[['id', 'name', 'geometry']].rename(columns={'id': 'region_id', 'name': 'region'}). \
+            join(df, how='inner')
+        df['area_km2'] = area_km2[df.index]
+        df['density'] = df['restaurant_count'] / df['area_km2']
+        return gpd.GeoDataFrame(df.reset_index(drop=True), geometry='geometry', crs=MAP_CRS)
+
+    def aggregate_by_grid(self, cell_size=5000, shape='hex', db_names=None):
+        """
+        Restaurants per grid cell and platform.
+
+        Args:
+            cell_size (float): Width of a cell in ground meters.
+            shape (str): 'hex' for hexagons, 'square' for squares.
+            db_names (list): Platforms to aggregate. Default is all of them.
+
+        Returns:
+            gpd.GeoDataFrame: One row per non empty cell and platform, with the cell
+            coordinates (cell_x, cell_y), restaurant_count, avg_rating, density
+            (restaurants per km2) and the cell geometry in EPSG:3857.
+        """
+        match shape:
+            case 'hex':
+                to_cells, to_polygons = hex_cells, hex_polygons
+                area_km2 = math.sqrt(3) / 2 * cell_size ** 2 / 1e6
+            case 'square':
+                to_cells, to_polygons = square_cells, square_polygons
+                area_km2 = cell_size ** 2 / 1e6
+            case _:
+                raise ValueError(f"Unsupported grid shape: {shape}")
+        frames = []
+        for db_name, (restaurants, points) in self.analyses.fan_out(self.get_points, db_names=db_names, label='restaurant points').items():
+            cell_x, cell_y = to_cells(points.x.to_numpy(), points.y.to_numpy(), cell_size)
+            frames.append(self.summarize(restaurants, {'cell_x': cell_x, 'cell_y': cell_y}, db_name))
+        df = pd.concat(frames, ignore_index=True)
+        df['density'] = df['restaurant_count'] / area_km2
+        geometry = to_polygons(df['cell_x'].to_numpy(), df['cell_y'].to_numpy(), cell_size)
+        return gpd.GeoDataFrame(df, geometry=gpd.GeoSeries(geometry, crs=AREA_CRS).to_crs(MAP_CRS).values, crs=MAP_CRS)
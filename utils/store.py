@@ -0,0 +1,202 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils import queries
+from utils.dbhandler import PlatformAnalyses, PRICE_BINS, count_in_bins, get_bin_labels
+from utils.platforms import PLATFORM_SCHEMAS
+from utils.profiling import span
+from utils.ranking import get_score, top_n
+
+
+# Column types of the tables in the store, the same for every platform.
+STORE_SCHEMAS = {
+    'restaurants': pa.schema([
+        ('restaurant_id', pa.string()), ('name', pa.string()), ('rating', pa.float64()),
+        ('review_count', pa.int64()), ('lat', pa.float64()), ('lon', pa.float64())]),
+    'locations': pa.schema([
+        ('location_id', pa.string()), ('name', pa.string()), ('lat', pa.float64()), ('lon', pa.float64())]),
+    'locations_to_restaurants': pa.schema([
+        ('restaurant_id', pa.string()), ('location_id', pa.string())]),
+    'categories': pa.schema([
+        ('restaurant_id', pa.string()), ('category', pa.string())]),
+    'menu_items': pa.schema([
+        ('restaurant_id', pa.string()), ('name', pa.string()), ('description', pa.string()), ('price', pa.float64())]),
+}
+MANIFEST_FILE = 'manifest.json'
+
+
+def is_store_current(manager, store_dir):
+    """True when store_dir was built from the current version of every database."""
+    manifest_path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    return manifest['fingerprints'] == manager.get_fingerprints()
+
+
+def build_store(manager, store_dir, chunksize=500000):
+    """
+    Extract restaurants, locations, menu items and categories of every platform into
+    one Parquet dataset per table, partitioned by platform.
+
+    Prices are in euros, review counts are integers and coordinates are floats, so the
+    analyses on the store do not have to clean anything.
+
+    Args:
+        manager (DataBaseManager): Manager of the platform databases.
+        store_dir (str): Directory of the store, replaced if it exists.
+        chunksize (int): Rows read from a database and written to the store at a time.
+    """
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    for table_name, extract in queries.EXTRACTS.items():
+        def write_extract(db_name):
+            # one file per chunk, so a table never has to fit in memory
+            for chunk in manager.iter_query(extract, db_name, chunksize=chunksize):
+                table = pa.Table.from_pandas(chunk, schema=STORE_SCHEMAS[table_name], preserve_index=False)
+                table = table.append_column('platform', pa.array([db_name] * len(chunk), pa.string()))
+                pq.write_to_dataset(table, root_path=os.path.join(store_dir, table_name), partition_cols=['platform'])
+        manager.fan_out(write_extract, label=extract.__name__)
+    with open(os.path.join(store_dir, MANIFEST_FILE), 'w') as f:
+        json.dump({'fingerprints': manager.get_fingerprints()}, f, indent=2)
+    print(f"Analytics store written to {store_dir}")
+
+
+class AnalyticsStore(PlatformAnalyses):
+    def __init__(self, store_dir) -> None:
+        """
+        Run the analyses of DataBaseManager on the Parquet store written by build_store.
+
+        The per-platform methods have the same names and return the same columns as the
+        ones of DataBaseManager, so the store can be used in its place.
+
+        Args:
+            store_dir (str): Directory of the store.
+        """
+        self.store_dir = store_dir
+        self.platforms = sorted(os.listdir(os.path.join(store_dir, 'restaurants')))
+        self.platforms = [platform.removeprefix('platform=') for platform in self.platforms]
+        self.frames = {}
+        self.timings = {}
+
+    def load(self, table_name, db_name):
+        """One table of one platform, read once and kept in memory."""
+        if (table_name, db_name) not in self.frames:
+            with span('read parquet', table=table_name, db=db_name):
+                self.frames[(table_name, db_name)] = pd.read_parquet(
+                    os.path.join(self.store_dir, table_name),
+                    filters=[('platform', '=', db_name)],
+                    columns=STORE_SCHEMAS[table_name].names)
+        return self.frames[(table_name, db_name)]
+
+    def get_fingerprints(self):
+        """Fingerprints of the databases the store was built from."""
+        with open(os.path.join(self.store_dir, MANIFEST_FILE)) as f:
+            return json.load(f)['fingerprints']
+
+    def fan_out(self, func, db_names=None, label=None, **params):
+        """Same as DataBaseManager.fan_out, but in this thread: the scans are vectorised already."""
+        if db_names is None:
+            db_names = self.platforms
+        label = label or getattr(func, '__name__', 'query')
+        results = {}
+        for db_name in db_names:
+            with span(f'{label} on {db_name}'):
+                results[db_name] = func(db_name, **params)
+        return results
+
+    def get_menu_items_with_name(self, db_name, dish):
+        menu_items = self.load('menu_items', db_name)
+        return menu_items[menu_items['name'].str.contains(dish, case=False, regex=False, na=False)]
+
+    def rest_per_loc_query(self, db_name='ubereats'):
+        locations = self.load('locations', db_name)
+        counts = self.load('locations_to_restaurants', db_name).groupby('location_id')['restaurant_id'].count()
+        df = locations.assign(rest_count=locations['location_id'].map(counts).fillna(0).astype('int64'))
+        df = df.rename(columns={'location_id': 'id'})[['id', 'name', 'lat', 'lon', 'rest_count']]
+        return df.sort_values('rest_count', ascending=False, kind='stable').reset_index(drop=True)
+
+    def in_category(self, db_name, categories, category):
+        """Mask of the rows of categories in category, matched like PlatformSchema.category_filter."""
+        if PLATFORM_SCHEMAS[db_name]['category_match'] == 'contains':
+            return categories['category'].str.contains(category, case=False, regex=False, na=False)
+        return categories['category'] == category
+
+    def get_restaurant_scores(self, db_name, score='weighted', prior_reviews=50):
+        restaurants = self.load('restaurants', db_name)
+        score = get_score(score)(restaurants['rating'], restaurants['review_count'], restaurants['rating'].mean(), prior_reviews)
+        return restaurants.rename(columns={'restaurant_id': 'id'})[['id', 'name', 'rating', 'review_count']].assign(score=score)
+
+    def get_ranked_restaurants(self, db_name, limit=10, score='weighted', prior_reviews=50, category='', dish='', min_reviews=0, per_category=True):
+        df = self.get_restaurant_scores(db_name, score, prior_reviews)
+        categories = self.load('categories', db_name).rename(columns={'restaurant_id': 'id'})
+        if category:
+            categories = categories[self.in_category(db_name, categories, category)]
+            if not per_category:
+                df = df[df['id'].isin(categories['id'])]
+        if dish:
+            df = df[df['id'].isin(self.get_menu_items_with_name(db_name, dish)['restaurant_id'])]
+        if min_reviews:
+            df = df[df['review_count'] >= min_reviews]
+        if per_category:
+            df = categories.merge(df, on='id')
+        df = top_n(df.drop_duplicates(), 'score', limit, group='category' if per_category else None, tie_column='id')
+        return df[(['category'] if per_category else []) + ['id', 'name', 'rating', 'review_count', 'score', 'rank']]
+
+    def get_top10_Pizza_restaurants(self, db_name, category='Pizza', limit=10, score='weighted'):
+        df = self.get_ranked_restaurants(db_name, limit, score, category=category, per_category=False)
+        df = df.rename(columns={'score': 'weight_score'}).drop(columns='rank')
+        print(df)
+        return df
+
+    def query_prices_per_db(self, db_name='ubereats'):
+        return self.load('menu_items', db_name)['price'].tolist()
+
+    def get_price_histogram(self, db_name, bins=PRICE_BINS):
+        edges = np.asarray(bins, dtype=float)
+        prices = self.load('menu_items', db_name)['price'].to_numpy(dtype=float)
+        return pd.DataFrame({'Price Range': get_bin_labels(edges), 'count': count_in_bins(prices, edges)})
+
+    def get_top_categories(self, db_name, min_avg_reviews=100, score='weighted', prior_reviews=50):
+        restaurants = self.load('restaurants', db_name)
+        df = self.load('categories', db_name).merge(restaurants, on='restaurant_id')
+        df = df.groupby('category').agg(avg_rating=('rating', 'mean'), avg_number_of_ratings=('review_count', 'mean')).reset_index()
+        df = df[df['avg_number_of_ratings'] > min_avg_reviews]
+        df['adjustedRating'] = get_score(score)(df['avg_rating'], df['avg_number_of_ratings'], restaurants['rating'].mean(), prior_reviews)
+        return df.sort_values(by='adjustedRating', ascending=False, kind='stable').reset_index(drop=True)
+
+    def get_kapsalons(self, db_name, dish='kapsalon'):
+        df = self.get_menu_items_with_name(db_name, dish)[['restaurant_id', 'price']]. \
+            merge(self.load('restaurants', db_name)[['restaurant_id', 'name']], on='restaurant_id'). \
+            merge(self.load('locations_to_restaurants', db_name), on='restaurant_id'). \
+            merge(self.load('locations', db_name)[['location_id', 'lat', 'lon']], on='location_id')
+        return df.groupby('name').agg(avg_pr=('price', 'mean'), lat=('lat', 'min'), lon=('lon', 'min')).reset_index()
+
+    def get_top_restaurants_by_price_to_rating(self, db_name, limit=10, score='weighted', prior_reviews=50):
+        restaurants = self.load('restaurants', db_name)
+        restaurants = restaurants.assign(score=get_score(score)(restaurants['rating'], restaurants['review_count'], restaurants['rating'].mean(), prior_reviews))
+        df = self.load('menu_items', db_name)[['restaurant_id', 'price']].merge(restaurants, on='restaurant_id')
+        df = df[(df['price'].fillna(0) > 0) & (df['rating'].fillna(0) > 0)]
+        df = df.groupby(['restaurant_id', 'name']).agg(average_price=('price', 'mean'), average_rating=('score', 'mean')).reset_index()
+        df['price_to_rating_ratio'] = df['average_price'] / df['average_rating']
+        df = df.rename(columns={'restaurant_id': 'id'}).nsmallest(limit, 'price_to_rating_ratio').reset_index(drop=True)
+        print(df.head())
+        return df
+
+    def get_restaurants(self, db_name):
+        return self.load('restaurants', db_name)
+
+    def get_veg_restaurants(self, db_name, dish='veg'):
+        restaurant_ids = self.get_menu_items_with_name(db_name, dish)['restaurant_id']
+        restaurants = self.load('restaurants', db_name)
+        df = restaurants[restaurants['restaurant_id'].isin(restaurant_ids)][['name', 'lat', 'lon']].drop_duplicates()
+        df = df.rename(columns={'name': 'Restaurant_Name'}).reset_index(drop=True)
+        df['source'] = db_name
+        return df
@@ -0,0 +1,190 @@
+import argparse
+import io
+import math
+import os
+import sqlite3
+import urllib.request
+
+import contextily as ctx
+import numpy as np
+from PIL import Image
+
+
+EARTH_HALF_SIZE = 20037508.342789244  # half the width of the web mercator world, in meters
+TILE_SIZE = 256
+BELGIUM_BOUNDS = (2.5, 49.45, 6.45, 51.55)  # west, south, east, north in lon/lat
+USER_AGENT = 'delivery_market_analysis_with_SQL tile cache'
+
+
+def lonlat_to_mercator(lon, lat):
+    x = lon * EARTH_HALF_SIZE / 180
+    y = math.log(math.tan((90 + lat) * math.pi / 360)) * EARTH_HALF_SIZE / math.pi
+    return x, y
+
+
+def mercator_to_tile(x, y, zoom):
+    """Tile column and row containing a web mercator point."""
+    tile_span = 2 * EARTH_HALF_SIZE / 2 ** zoom
+    last_tile = 2 ** zoom - 1
+    column = min(max(int((x + EARTH_HALF_SIZE) // tile_span), 0), last_tile)
+    row = min(max(int((EARTH_HALF_SIZE - y) // tile_span), 0), last_tile)
+    return column, row
+
+
+def tile_bounds(column, row, zoom):
+    """West, south, east, north of a tile in web mercator meters."""
+    tile_span = 2 * EARTH_HALF_SIZE / 2 ** zoom
+    west = -EARTH_HALF_SIZE + column * tile_span
+    north = EARTH_HALF_SIZE - row * tile_span
+    return west, north - tile_span, west + tile_span, north
+
+
+def get_zoom(width, height, max_zoom=19):
+    """Zoom level at which an extent of width x height meters is covered by a handful of tiles, like contextily."""
+    zoom_x = math.ceil(math.log2(4 * EARTH_HALF_SIZE / width))
+    zoom_y = math.ceil(math.log2(4 * EARTH_HALF_SIZE / height))
+    return min(max(zoom_x, zoom_y, 0), max_zoom)
+
+
+class TileCache:
+    def __init__(self, cache_dir='tile_cache', provider=None, offline=False, mbtiles_path=None) -> None:
+        """
+        Disk-backed basemap tiles for MapMaker.
+
+        Tiles are looked up in an MBTiles file (when given), then in cache_dir, and only
+        then downloaded from the provider and stored in cache_dir. In offline mode nothing
+        is downloaded, so maps are rendered purely from local tiles.
+
+        Args:
+            cache_dir (str): Directory of the tile store, one {z}/{x}/{y}.png per tile and provider.
+            provider (TileProvider): Tile provider from contextily.providers. Default is OpenStreetMap.Mapnik.
+            offline (bool): Never download tiles, missing tiles are left blank.
+            mbtiles_path (str): Optional MBTiles file to read tiles from.
+        """
+        self.provider = provider or ctx.providers.OpenStreetMap.Mapnik
+        self.cache_dir = os.path.join(cache_dir, self.provider.name)
+        self.offline = offline
+        self.mbtiles_path = mbtiles_path
+        self.max_zoom = self.provider.get('max_zoom', 19)
+
+    def get_path(self, column, row, zoom):
+        return os.path.join(self.cache_dir, str(zoom), str(column), f'{row}.png')
+
+    def read_mbtiles(self, column, row, zoom):
+        with sqlite3.connect(f'file:{self.mbtiles_path}?mode=ro', uri=True) as connection:
+            # MBTiles rows count from the south (TMS)
+            found = connection.execute(
+                'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+                (zoom, column, 2 ** zoom - 1 - row)).fetchone()
+        return found[0] if found else None
+
+    def download(self, column, row, zoom):
+        url = self.provider.build_url(x=column, y=row, z=zoom)
+        request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            data = response.read()
+        path = self.get_path(column, row, zoom)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return data
+
+    def get_tile(self, column, row, zoom):
+        """Encoded image of a tile, or None when it is not available offline."""
+        if self.mbtiles_path is not None:
+            data = self.read_mbtiles(column, row, zoom)
+            if data is not None:
+                return data
+        path = self.get_path(column, row, zoom)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        if self.offline:
+            return None
+        return self.download(column, row, zoom)
+
+    def get_tile_range(self, extent, zoom):
+        west, south, east, north = extent
+        first_column, first_row = mercator_to_tile(west, north, zoom)
+        last_column, last_row = mercator_to_tile(east, south, zoom)
+        return first_column, first_row, last_column, last_row
+
+    def get_image(self, extent, zoom='auto'):
+        """
+        Mosaic of the tiles covering an extent in web mercator.
+
+        Args:
+            extent (tuple): West, south, east, north in EPSG:3857 meters.
+            zoom (int): Zoom level, or 'auto' to pick one from the size of the extent.
+
+        Returns:
+            tuple: RGB image as a numpy array and its (west, east, south, north) extent, as for imshow.
+        """
+        if zoom == 'auto':
+            zoom = get_zoom(extent[2] - extent[0], extent[3] - extent[1], self.max_zoom)
+        first_column, first_row, last_column, last_row = self.get_tile_range(extent, zoom)
+        image = np.full(((last_row - first_row + 1) * TILE_SIZE, (last_column - first_column + 1) * TILE_SIZE, 3), 255, dtype=np.uint8)
+        missing = 0
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                data = self.get_tile(column, row, zoom)
+                if data is None:
+                    missing += 1
+                    continue
+                tile = np.asarray(Image.open(io.BytesIO(data)).convert('RGB').resize((TILE_SIZE, TILE_SIZE)))
+                top = (row - first_row) * TILE_SIZE
+                left = (column - first_column) * TILE_SIZE
+                image[top:top + TILE_SIZE, left:left + TILE_SIZE] = tile
+        if missing:
+            print(f"{missing} tiles at zoom {zoom} are not in the tile cache")
+        west, _, _, north = tile_bounds(first_column, first_row, zoom)
+        _, south, east, _ = tile_bounds(last_column, last_row, zoom)
+        return image, (west, east, south, north)
+
+    def add_basemap(self, ax, zoom='auto', **imshow_kwargs):
+        """Drop-in for ctx.add_basemap on an axis in EPSG:3857, drawing the tiles from this cache."""
+        xmin, xmax = ax.get_xlim()
+        ymin, ymax = ax.get_ylim()
+        image, extent = self.get_image((xmin, ymin, xmax, ymax), zoom=zoom)
+        ax.imshow(image, extent=extent, interpolation='bilinear', zorder=0, **imshow_kwargs)
+        ax.set_xlim(xmin, xmax)
+        ax.set_ylim(ymin, ymax)
+
+    def prewarm(self, bounds=BELGIUM_BOUNDS, zooms=range(6, 12), max_tiles=20000):
+        """
+        Download every tile of a lon/lat bounding box at the given zoom levels.
+
+        Args:
+            bounds (tuple): West, south, east, north in lon/lat. Default is Belgium.
+            zooms (iterable): Zoom levels to fetch.
+            max_tiles (int): Refuse to fetch more tiles than this, tile servers limit bulk downloads.
+
+        Returns:
+            int: Number of tiles that were downloaded.
+        """
+        west, south = lonlat_to_mercator(bounds[0], bounds[1])
+        east, north = lonlat_to_mercator(bounds[2], bounds[3])
+        tile_ranges = {zoom: self.get_tile_range((west, south, east, north), zoom) for zoom in zooms}
+        tile_count = sum((c1 - c0 + 1) * (r1 - r0 + 1) for c0, r0, c1, r1 in tile_ranges.values())
+        if tile_count > max_tiles:
+            raise ValueError(f"Pre-warming needs {tile_count} tiles, more than max_tiles={max_tiles}")
+        downloaded = 0
+        for zoom, (first_column, first_row, last_column, last_row) in tile_ranges.items():
+            for column in range(first_column, last_column + 1):
+                for row in range(first_row, last_row + 1):
+                    if not os.path.exists(self.get_path(column, row, zoom)):
+                        self.download(column, row, zoom)
+                        downloaded += 1
+            print(f"zoom {zoom}: {(last_column - first_column + 1) * (last_row - first_row + 1)} tiles cached")
+        return downloaded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pre-warm the basemap tile cache for Belgium.')
+    parser.add_argument('--cache-dir', default='tile_cache')
+    parser.add_argument('--min-zoom', type=int, default=6)
+    parser.add_argument('--max-zoom', type=int, default=11)
+    args = parser.parse_args()
+    TileCache(args.cache_dir).prewarm(zooms=range(args.min_zoom, args.max_zoom + 1))